@@ -3,30 +3,117 @@ Data analysis methods for data generated by the Brunel network simulations.
 
 """
 
+import os
+import traceback
+import multiprocessing
+from glob import glob
 import numpy as np
 from neo import AnalogSignal, get_io, iolist
 from quantities import ms, dimensionless, Quantity
 from ninemltoolkitio import NineMLToolkitIO
+from spikestore import SpikeStore
+from spikestats import (firing_rates, cv_isi, local_variation, fano_factors, mean_statistic,
+                        correlation_statistics, synchrony, spectral_statistics, classify_regime)
 
 iolist.insert(0, NineMLToolkitIO)
 
+# the quantities calculated by spike_statistics(), in the order of the columns of "statistics.csv"
+STATISTICS = ["spike_counts", "firing_rate", "cv_isi", "lv", "fano_factor",
+              "cc_min", "cc_max", "cc_mean", "chi",
+              "dominant_frequency", "synchrony_power", "regime"]
+
+
+def _in_ms(t):
+    if isinstance(t, Quantity):
+        return float(t.rescale(ms))
+    return float(t)
+
+
+def spike_times(spiketrains):
+    """
+    Return the spike times (in ms) of all the spike trains in a list, or in a
+    SpikeStore, as a single array.
+    """
+    if isinstance(spiketrains, SpikeStore):
+        return spiketrains.times
+    if len(spiketrains) == 0:
+        return np.array([])
+    # all the spike trains from a recording are assumed to have the same units
+    scale = float(spiketrains[0].units.rescale(ms).magnitude)
+    return scale * np.concatenate([np.asarray(st) for st in spiketrains])
+
+
+def spike_histogram(spiketrains, begin, end, bin_width=0.1):
+    """
+    Return the total number of spikes from all `spiketrains` in each bin of width
+    `bin_width` (ms) between `begin` and `end`, and the bin edges.
+
+    The bins are the same as those of np.histogram(times, np.arange(begin, end, bin_width)),
+    but all the spike times are binned in a single pass.
+    """
+    begin, end = _in_ms(begin), _in_ms(end)
+    edges = np.arange(begin, end, bin_width)
+    n_bins = max(edges.size - 1, 0)
+    times = spike_times(spiketrains)
+    times = times[(times >= begin) & (times <= edges[-1])] if n_bins else times[:0]
+    index = np.searchsorted(edges, times, side="right") - 1
+    index[index == n_bins] = n_bins - 1  # the last bin includes its right edge
+    return np.bincount(index, minlength=n_bins), edges
+
+
+KERNELS = ("box", "gaussian", "alpha")
+
+
+def smoothing_kernel(kernel, width, bin_width):
+    """
+    Return a kernel with unit area, sampled every `bin_width` (ms), with an odd
+    number of samples and t=0 at the middle sample.
+
+    `width` (ms) is the full width of the "box" kernel, the standard deviation of
+    the "gaussian" kernel and the time constant of the (causal) "alpha" kernel.
+    """
+    if kernel == "box":
+        half_width = int(round(width / bin_width / 2))
+        values = np.ones(2 * half_width + 1)
+    else:
+        extent = 5 * width if kernel == "gaussian" else 10 * width
+        t = np.arange(-int(np.ceil(extent / bin_width)), int(np.ceil(extent / bin_width)) + 1) * bin_width
+        if kernel == "gaussian":
+            values = np.exp(-0.5 * (t / width)**2)
+        elif kernel == "alpha":
+            values = np.where(t >= 0, t / width * np.exp(-t / width), 0.0)
+        else:
+            raise ValueError("kernel should be one of {}".format(", ".join(KERNELS)))
+    return values / values.sum()
+
+
+def population_rate(spiketrains, begin, end, bin_width=0.1, kernel=None, kernel_width=None):
+    """
+    Return the population-averaged firing rate (in spikes/s per neuron) between
+    `begin` and `end` (ms), in bins of `bin_width` (ms), as an AnalogSignal.
+
+    `spiketrains` may be a list of SpikeTrains or a SpikeStore. The rate may
+    be smoothed with a "box", "gaussian" or "alpha" `kernel` (see
+    smoothing_kernel() for the meaning of `kernel_width`).
+    """
+    counts, edges = spike_histogram(spiketrains, begin, end, bin_width)
+    rate = counts * (1000.0 / bin_width / len(spiketrains))
+    if kernel:
+        values = smoothing_kernel(kernel, kernel_width, bin_width)
+        offset = values.size // 2
+        rate = np.convolve(rate, values)[offset:offset + rate.size]
+    return AnalogSignal(rate, sampling_period=bin_width*ms, units=dimensionless,
+                        channel_index=0, t_start=_in_ms(begin)*ms, name="Instantaneous firing rate")
+
 
 def instantaneous_firing_rate(segment, begin, end):
-    """Computed in bins of 0.1 ms """
-    bins = np.arange(begin, end, 0.1)
-    hist, _ = np.histogram(segment.spiketrains[0].time_slice(begin, end), bins)
-    for st in segment.spiketrains[1:]:
-        h, _ = np.histogram(st.time_slice(begin, end), bins)
-        hist += h
-    return AnalogSignal(hist, sampling_period=0.1*ms, units=dimensionless,
+    """Total spike count of the population, computed in bins of 0.1 ms """
+    counts, edges = spike_histogram(segment.spiketrains, begin, end, 0.1)
+    return AnalogSignal(counts, sampling_period=0.1*ms, units=dimensionless,
                         channel_index=0, name="Spike count")
 
 
 def spike_statistics(idx, row, ioclass=None):
-    from elephant.statistics import mean_firing_rate, cv, isi
-    from elephant.conversion import BinnedSpikeTrain
-    from elephant.spike_train_correlation import corrcoef
-
     print(idx)
     results = {}
 
@@ -39,25 +126,136 @@ def spike_statistics(idx, row, ioclass=None):
     spiketrains = data_block.segments[0].spiketrains
 
     if spiketrains:
-        # calculate mean firing rate
-        results["spike_counts"] = sum(st.size for st in spiketrains)
-        rates = [mean_firing_rate(st) for st in spiketrains]
-        results["firing_rate"] = Quantity(rates, units=rates[0].units).rescale("1/s").mean()
-
-        # calculate coefficient of variation of the inter-spike interval
-        cvs = [cv(isi(st)) for st in spiketrains if st.size > 1]
-        if len(cvs) > 0:
-            results["cv_isi"] = sum(cvs)/len(cvs)
-        else:
-            results["cv_isi"] = 0
+        # the statistics are calculated for all neurons at once, from a flat array of spike times
+        store = SpikeStore.from_spiketrains(spiketrains)
+        results["spike_counts"] = store.times.size
+        results["firing_rate"] = firing_rates(store).mean()
 
-        # calculate global cross-correlation
-        #cc_matrix = corrcoef(BinnedSpikeTrain(spiketrains, binsize=5*ms))
-        #results["cc_min"] = cc_matrix.min()
-        #results["cc_max"] = cc_matrix.max()
-        #results["cc_mean"] = cc_matrix.mean()
+        # mean coefficient of variation of the inter-spike interval, local variation
+        # and Fano factor, over the neurons for which they are defined
+        results["cv_isi"] = mean_statistic(cv_isi(store))
+        results["lv"] = mean_statistic(local_variation(store))
+        results["fano_factor"] = mean_statistic(fano_factors(store))
+
+        # calculate pairwise correlations of the spike counts in 5 ms bins, using
+        # a random sample of pairs for large networks, and the synchrony measure chi
+        results.update(correlation_statistics(store, bin_width=5.0, seed=32875))
+        results["chi"] = synchrony(store, bin_width=5.0)
+
+        # classify the dynamical regime from the spectrum of the population rate,
+        # discarding the initial transient
+        results.update(spectral_statistics(store, begin=store.t_start + 100.0))
+        results["regime"] = classify_regime(results["cv_isi"], results["dominant_frequency"],
+                                            results["synchrony_power"])
 
     if hasattr(io, "close"):
         io.close()
     return results
 
+
+
+def data_files(output_file):
+    """
+    Return the list of data files for a simulation. The 9ML-toolkit writes several
+    files, whose names begin with `output_file`.
+    """
+    if os.path.exists(output_file):
+        return [output_file]
+    return glob(output_file + ".dat") + glob(output_file + "_state.*.dat")
+
+
+def data_fingerprint(output_file):
+    """
+    Return the total size (in bytes) and the latest modification time of the data
+    files for a simulation, used to detect when the data have changed.
+    """
+    info = [os.stat(path) for path in data_files(output_file)]
+    if not info:
+        return 0, 0.0
+    return sum(st.st_size for st in info), round(max(st.st_mtime for st in info), 3)
+
+
+def _row_statistics(task):
+    # run in a worker process by update_statistics()
+    idx, row, ioclass = task
+    try:
+        return idx, spike_statistics(idx, row, ioclass=ioclass)
+    except Exception:
+        traceback.print_exc()
+        return idx, None
+
+
+def update_statistics(results_dir, ioclass=None, n_workers=None):
+    """
+    Calculate spike train statistics for each successful simulation listed in
+    the file "sweeps.csv" in `results_dir`, and return them as a pandas DataFrame.
+
+    The data files are analysed in parallel, using `n_workers` processes
+    (default: the number of cores), and each row of "statistics.csv" is written
+    as soon as it is ready, so that an interrupted calculation loses nothing.
+    Statistics already in "statistics.csv" are reused, unless the size or
+    modification time of the data file has changed since they were calculated.
+    Rows for which the analysis fails are left out, and are retried by the next call.
+    """
+    import pandas
+
+    sweeps = pandas.read_csv(os.path.join(results_dir, "sweeps.csv"),
+                             delim_whitespace=True, comment="#")
+    sweeps = sweeps[sweeps["exit_status"] == 0]  # skip failed simulations
+    sweeps = sweeps.drop_duplicates("output_file", keep="last").reset_index(drop=True)
+    fingerprints = [data_fingerprint(output_file) for output_file in sweeps["output_file"]]
+    sweeps["data_size"] = [size for size, mtime in fingerprints]
+    sweeps["data_mtime"] = [mtime for size, mtime in fingerprints]
+    columns = list(sweeps.columns) + STATISTICS
+
+    statistics_file = os.path.join(results_dir, "statistics.csv")
+    previous = None
+    if os.path.exists(statistics_file):
+        previous = pandas.read_csv(statistics_file, delim_whitespace=True)
+        if set(columns).issubset(previous.columns):
+            previous = previous.drop_duplicates("output_file", keep="last").set_index("output_file")
+        else:
+            previous = None  # calculated by an older version of this function
+
+    rows = {}
+    tasks = []
+    for idx, row in sweeps.iterrows():
+        row = row.to_dict()
+        if previous is not None and row["output_file"] in previous.index:
+            old = previous.loc[row["output_file"]]
+            if old["data_size"] == row["data_size"] and old["data_mtime"] == row["data_mtime"]:
+                row.update((name, old[name]) for name in STATISTICS)
+                rows[idx] = row
+                continue
+        tasks.append((idx, row, ioclass))
+    print("Reusing statistics for {} data files, calculating for {}".format(len(rows), len(tasks)))
+
+    # rewrite the statistics which are still valid, then append the new ones as they arrive
+    tmp_file = statistics_file + ".tmp"
+    pandas.DataFrame([rows[idx] for idx in sorted(rows)], columns=columns).to_csv(
+        tmp_file, sep=" ", index=False)
+    os.rename(tmp_file, statistics_file)
+
+    with open(statistics_file, "a") as fp:
+        def record(idx, results):
+            if results is None:
+                return
+            row = dict(sweeps.loc[idx])
+            row.update((name, np.asarray(value).item()) for name, value in results.items())
+            rows[idx] = row
+            pandas.DataFrame([row], columns=columns).to_csv(fp, sep=" ", index=False, header=False)
+            fp.flush()
+
+        if n_workers == 1:
+            for task in tasks:
+                record(*_row_statistics(task))
+        elif tasks:
+            pool = multiprocessing.Pool(n_workers)
+            try:
+                for idx, results in pool.imap_unordered(_row_statistics, tasks):
+                    record(idx, results)
+            finally:
+                pool.terminate()
+                pool.join()
+
+    return pandas.DataFrame([rows[idx] for idx in sorted(rows)], columns=columns)
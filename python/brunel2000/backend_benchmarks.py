@@ -0,0 +1,338 @@
+# encoding: utf-8
+"""
+Compare the performance of the implementations of the Brunel (2000) network
+model, for a range of network sizes and numbers of threads and MPI processes.
+
+Each simulation is run by run.py in a new process (with the output files in
+its own subdirectory of "data" in the output directory), one at a time so that the
+measurements do not disturb one another. For each simulation the report gives
+the time taken to import the simulator, build the network, run the simulation
+and write the data, the real-time factor (wall-clock seconds of simulation per
+second of model time), the peak memory use and the size of the output files.
+
+Strong scaling (a network of fixed size run with more virtual processes) is
+measured by default. With --weak, the network size is instead proportional to
+the number of virtual processes, with each value of --orders giving the order
+per virtual process. Threads and MPI processes are used only with the
+implementations which support them (see implementations.PARALLELISM).
+
+The results are written to "report.json" and "report.csv" in the output
+directory, with a figure of the simulation time and the parallel efficiency,
+"report.png". With --compare, the results are compared with an earlier
+report, and the simulations which became slower, or used more memory, by more
+than --tolerance are listed (the exit status is then 1).
+
+Usage: backend_benchmarks.py [-h] [--implementations IMPLEMENTATIONS [...]]
+                             [--orders ORDERS [ORDERS ...]]
+                             [--threads THREADS [THREADS ...]]
+                             [--processes PROCESSES [PROCESSES ...]]
+                             [--weak] [--duration DURATION]
+                             [--repeats REPEATS] [--output-dir OUTPUT_DIR]
+                             [--compare COMPARE] [--tolerance TOLERANCE]
+                             parameter_file
+
+positional arguments:
+  parameter_file        baseline parameter file, e.g. parameters/AI.yml
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --implementations IMPLEMENTATIONS [IMPLEMENTATIONS ...]
+                        the implementations to compare (default: nest
+                        pyNN.nest pyNN.neuron nineml numpy)
+  --orders ORDERS [ORDERS ...]
+                        values of the network parameter "order" (default:
+                        250 500 1000 2500)
+  --threads THREADS [THREADS ...]
+                        numbers of threads per MPI process (default: 1)
+  --processes PROCESSES [PROCESSES ...]
+                        numbers of MPI processes (default: 1)
+  --weak                measure weak scaling: "order" is per virtual process
+  --duration DURATION   simulation duration (ms) (default: from the
+                        parameter file)
+  --repeats REPEATS     number of times to repeat each simulation (the
+                        shortest is reported) (default: 1)
+  --output-dir OUTPUT_DIR
+                        directory for the report (default:
+                        results/benchmarks-<timestamp>)
+  --compare COMPARE     an earlier report.json to compare with
+  --tolerance TOLERANCE
+                        relative increase in time or memory reported as a
+                        regression (default: 0.2)
+"""
+
+from __future__ import division, print_function
+import os
+import sys
+import glob
+import json
+import argparse
+import multiprocessing
+from copy import deepcopy
+from datetime import datetime
+import yaml
+from scheduler import run_jobs
+from implementations import PARALLELISM
+from timing import PHASES, load_timings
+
+DEFAULT_IMPLEMENTATIONS = ["nest", "pyNN.nest", "pyNN.neuron", "nineml", "numpy"]
+COLUMNS = (("implementation", "order", "processes", "threads", "virtual_processes",
+            "exit_status", "wall_time") +
+           tuple("{}_time".format(phase) for phase in PHASES) +
+           ("real_time_factor", "max_rss", "output_size"))
+EXTENSIONS = {"9mltoolkit": "", "numpy": ".pkl", "numpy.hybrid": ".pkl"}
+
+
+def configurations(implementations, orders, threads, processes, weak=False):
+    """
+    Return the (implementation, order, processes, threads) combinations to run,
+    leaving out the numbers of threads or processes greater than one for
+    implementations which do not support them.
+    """
+    for implementation in implementations:
+        parallelism = PARALLELISM.get(implementation, ())
+        for n_processes in processes:
+            if n_processes > 1 and "mpi" not in parallelism:
+                continue
+            for n_threads in threads:
+                if n_threads > 1 and "threads" not in parallelism:
+                    continue
+                for order in orders:
+                    if weak:
+                        order *= n_processes * n_threads
+                    yield implementation, order, n_processes, n_threads
+
+
+def output_size(directory):
+    """Return the total size (bytes) of the files in `directory`, other than timings and profiles."""
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(directory, "*"))
+               if os.path.isfile(path) and ".timings." not in os.path.basename(path))
+
+
+def run_benchmarks(parameters, config, output_dir):
+    """
+    Run a simulation for each configuration, `config.repeats` times, and return
+    a list of records (dicts with keys COLUMNS), keeping the repeat with the
+    shortest wall-clock time.
+    """
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run.py")
+    duration = parameters["experiment"]["duration"]
+    records = []
+    for implementation, order, n_processes, n_threads in configurations(
+            config.implementations, config.orders, config.threads, config.processes, config.weak):
+        label = "{}_order{}_np{}_nt{}".format(implementation, order, n_processes, n_threads)
+        point = deepcopy(parameters)
+        point["network"]["order"] = order
+        point["experiment"]["threads"] = n_threads
+        point["experiment"]["mpi_processes"] = n_processes
+        data_dir = os.path.join(output_dir, "data", label)
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+        output_file = os.path.join(data_dir, "brunel{}".format(EXTENSIONS.get(implementation, ".h5")))
+        point["experiment"]["full_filename"] = output_file
+        parameter_file = os.path.join(output_dir, "parameters_{}.yml".format(label))
+        with open(parameter_file, "w") as fp:
+            yaml.dump(point, fp)
+        timings_file = os.path.join(output_dir, "timings_{}.json".format(label))
+
+        best = None
+        for i in range(config.repeats):
+            if os.path.exists(timings_file):
+                os.remove(timings_file)
+            command = [sys.executable, script_path, implementation, parameter_file,
+                       "--timings", timings_file]
+            result = run_jobs([(label, command)], n_workers=1)[label]
+            if best is not None and best["exit_status"] == 0 and \
+                    (result["exit_status"] != 0 or result["wall_time"] >= best["wall_time"]):
+                continue
+            timings = {}
+            if result["exit_status"] == 0 and os.path.exists(timings_file):
+                timings = load_timings(timings_file)
+            best = {
+                "implementation": implementation,
+                "order": order,
+                "processes": n_processes,
+                "threads": n_threads,
+                "virtual_processes": n_processes * n_threads,
+                "exit_status": result["exit_status"],
+                "wall_time": result["wall_time"],
+                "real_time_factor": timings.get("simulate", float("nan")) / (duration / 1000.0),
+                # for MPI runs, this is the peak of the largest process
+                "max_rss": result["max_rss"],
+                "output_size": output_size(data_dir) if result["exit_status"] == 0 else 0
+            }
+            for phase in PHASES:
+                best["{}_time".format(phase)] = timings.get(phase, float("nan"))
+        records.append(best)
+        print("{implementation} order={order} processes={processes} threads={threads}: "
+              "exit status {exit_status}, simulate {simulate_time:.2f} s, "
+              "real-time factor {real_time_factor:.2f}, max RSS {max_rss} kB".format(**best))
+    return records
+
+
+def add_efficiency(records, weak=False):
+    """
+    Add the parallel efficiency of each simulation, relative to the simulation
+    with the fewest virtual processes of the same implementation and network
+    size (strong scaling) or network size per virtual process (weak scaling).
+    """
+    def group(record):
+        order = record["order"]
+        if weak:
+            order = order // record["virtual_processes"]
+        return record["implementation"], order
+
+    reference = {}
+    for record in records:
+        key = group(record)
+        if record["exit_status"] == 0 and (key not in reference or
+                                           record["virtual_processes"] < reference[key]["virtual_processes"]):
+            reference[key] = record
+    for record in records:
+        ref = reference.get(group(record))
+        if ref is None or record["exit_status"] != 0:
+            record["efficiency"] = float("nan")
+        elif weak:
+            record["efficiency"] = ref["simulate_time"] / record["simulate_time"]
+        else:
+            record["efficiency"] = (ref["simulate_time"] * ref["virtual_processes"]) / \
+                                   (record["simulate_time"] * record["virtual_processes"])
+
+
+def write_report(records, output_dir, metadata):
+    """Write the records to "report.json" and, as a space-separated table, "report.csv"."""
+    with open(os.path.join(output_dir, "report.json"), "w") as fp:
+        json.dump({"metadata": metadata, "results": records}, fp, indent=2)
+    columns = COLUMNS + ("efficiency",)
+    with open(os.path.join(output_dir, "report.csv"), "w") as fp:
+        fp.write(" ".join(columns) + "\n")
+        for record in records:
+            fp.write(" ".join(str(record[column]) for column in columns) + "\n")
+
+
+def plot_report(records, filename, weak=False):
+    """
+    Plot the simulation time against the number of virtual processes, and
+    against the network size, and the parallel efficiency.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    records = [record for record in records if record["exit_status"] == 0]
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4.5))
+    groups = {}
+    for record in records:
+        order = record["order"] // record["virtual_processes"] if weak else record["order"]
+        groups.setdefault((record["implementation"], order), []).append(record)
+    for (implementation, order), group in sorted(groups.items()):
+        group.sort(key=lambda record: record["virtual_processes"])
+        n_vp = [record["virtual_processes"] for record in group]
+        label = "{} (order {}{})".format(implementation, order, " per VP" if weak else "")
+        axes[0].loglog(n_vp, [record["simulate_time"] for record in group], "o-", label=label)
+        axes[2].semilogx(n_vp, [record["efficiency"] for record in group], "o-", label=label)
+    serial = {}
+    for record in records:
+        if record["virtual_processes"] == 1:
+            serial.setdefault(record["implementation"], []).append(record)
+    for implementation, group in sorted(serial.items()):
+        group.sort(key=lambda record: record["order"])
+        orders = [record["order"] for record in group]
+        axes[1].loglog(orders, [record["build_time"] for record in group], "o--",
+                       label="{} build".format(implementation))
+        axes[1].loglog(orders, [record["simulate_time"] for record in group], "o-",
+                       label="{} simulate".format(implementation))
+    axes[0].set_xlabel("Virtual processes")
+    axes[0].set_ylabel("Simulation time (s)")
+    axes[1].set_xlabel("Order (one virtual process)")
+    axes[1].set_ylabel("Time (s)")
+    axes[2].set_xlabel("Virtual processes")
+    axes[2].set_ylabel("{} scaling efficiency".format("Weak" if weak else "Strong"))
+    for ax in axes:
+        ax.legend(fontsize="x-small")
+    fig.tight_layout()
+    fig.savefig(filename)
+
+
+def regressions(records, previous, tolerance):
+    """
+    Return a list of messages describing the simulations in `records` which
+    took longer, or used more memory, than the same simulation in `previous`
+    by more than the fraction `tolerance`, or which now fail.
+    """
+    def key(record):
+        return (record["implementation"], record["order"], record["processes"], record["threads"])
+
+    previous = dict((key(record), record) for record in previous if record["exit_status"] == 0)
+    messages = []
+    for record in records:
+        old = previous.get(key(record))
+        if old is None:
+            continue
+        label = "{} order={} processes={} threads={}".format(*key(record))
+        if record["exit_status"] != 0:
+            messages.append("{}: failed with exit status {}".format(label, record["exit_status"]))
+            continue
+        for quantity in ("build_time", "simulate_time", "max_rss"):
+            if record[quantity] > old[quantity] * (1 + tolerance):
+                messages.append("{}: {} increased from {} to {}".format(
+                    label, quantity, old[quantity], record[quantity]))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("parameter_file", help="baseline parameter file, e.g. parameters/AI.yml")
+    parser.add_argument("--implementations", nargs="+", default=DEFAULT_IMPLEMENTATIONS,
+                        help="the implementations to compare")
+    parser.add_argument("--orders", type=int, nargs="+", default=[250, 500, 1000, 2500],
+                        help="values of the network parameter 'order'")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1],
+                        help="numbers of threads per MPI process")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1],
+                        help="numbers of MPI processes")
+    parser.add_argument("--weak", action="store_true",
+                        help="measure weak scaling: 'order' is per virtual process")
+    parser.add_argument("--duration", type=float,
+                        help="simulation duration (ms) (default: from the parameter file)")
+    parser.add_argument("--repeats", type=int, default=1,
+                        help="number of times to repeat each simulation (the shortest is reported)")
+    parser.add_argument("--output-dir", help="directory for the report")
+    parser.add_argument("--compare", help="an earlier report.json to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative increase in time or memory reported as a regression")
+    config = parser.parse_args()
+
+    with open(config.parameter_file) as fp:
+        parameters = yaml.load(fp)
+    if config.duration:
+        parameters["experiment"]["duration"] = config.duration
+    output_dir = config.output_dir or "results/benchmarks-{:%Y%m%d-%H%M%S}".format(datetime.now())
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    records = run_benchmarks(parameters, config, output_dir)
+    add_efficiency(records, config.weak)
+    metadata = {
+        "timestamp": datetime.now().isoformat(),
+        "parameter_file": config.parameter_file,
+        "duration": parameters["experiment"]["duration"],
+        "weak_scaling": config.weak,
+        "host": os.uname()[1],
+        "cpu_count": multiprocessing.cpu_count(),
+    }
+    write_report(records, output_dir, metadata)
+    plot_report(records, os.path.join(output_dir, "report.png"), config.weak)
+    print("Report written to {}".format(output_dir))
+
+    if config.compare:
+        with open(config.compare) as fp:
+            previous = json.load(fp)["results"]
+        messages = regressions(records, previous, config.tolerance)
+        for message in messages:
+            print(message)
+        if messages:
+            sys.exit(1)
+        print("No regressions compared with {}".format(config.compare))
+
+
+if __name__ == "__main__":
+    main()
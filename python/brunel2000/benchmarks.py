@@ -0,0 +1,296 @@
+# encoding: utf-8
+"""
+Benchmarks for the data handling code used with the Brunel (2000) network model.
+
+Each benchmark compares a new implementation with the approach it replaced,
+using synthetic data of a similar size to that produced by the simulations.
+
+Usage: benchmarks.py [-h] [--repeats REPEATS]
+                     {segment,rate,statistics,delivery,hybrid} ...
+
+positional arguments:
+  segment     grouping of recorded spikes by neuron, as a function of the
+              number of recorded neurons
+  rate        population firing rate histogram, as a function of the number
+              of neurons and of the bin width
+  statistics  firing rates, CV(ISI), local variation and Fano factors of
+              all the neurons in a set of data files
+  delivery    delivery of spikes through the recurrent connections of the
+              NumPy implementation, as a function of the firing rate
+  hybrid      simulation of the network by the NumPy implementation with
+              precise spike times, compared with spike times on a time grid
+
+optional arguments:
+  -h, --help           show this help message and exit
+  --repeats REPEATS    number of times to repeat each measurement
+"""
+
+from __future__ import division, print_function
+import argparse
+import time
+import numpy as np
+
+
+def best_of(func, repeats):
+    """Return the shortest of `repeats` wall-clock times for calling `func`."""
+    times = []
+    for i in range(repeats):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def synthetic_spikes(n_neurons, rate, duration, seed=78923):
+    """
+    Generate Poisson spike times for `n_neurons` neurons firing at `rate` (Hz)
+    for `duration` (ms), in the format of the events from a NEST spike detector.
+    """
+    rng = np.random.RandomState(seed)
+    n_spikes = rng.poisson(n_neurons * rate * duration / 1000.0)
+    return {
+        "times": np.sort(rng.uniform(0, duration, size=n_spikes)),
+        "senders": rng.randint(1, n_neurons + 1, size=n_spikes)
+    }
+
+
+def synthetic_spiketrains(n_neurons, rate, duration):
+    """Generate a list of `n_neurons` Poisson SpikeTrains."""
+    from spikestore import SpikeStore
+    events = synthetic_spikes(n_neurons, rate, duration)
+    store = SpikeStore.from_events(events["times"], events["senders"],
+                                   channel_ids=np.arange(1, n_neurons + 1), t_stop=duration)
+    return store.spiketrains()
+
+
+def benchmark_segment(config):
+    import neo
+    from utility import segment_from_events
+
+    def masked(events, id_list):
+        # the approach previously used in segment_from_recording_device()
+        return [neo.SpikeTrain(events["times"][events["senders"] == id],
+                               t_stop=config.duration, units="ms")
+                for id in id_list]
+
+    print("{:>10} {:>10} {:>12} {:>12} {:>8}".format("n_record", "n_spikes",
+                                                     "masked (s)", "grouped (s)", "speedup"))
+    for n_record in config.n_record:
+        events = synthetic_spikes(n_record, config.rate, config.duration)
+        id_list = list(range(1, n_record + 1))
+        t_masked = best_of(lambda: masked(events, id_list), config.repeats)
+        t_grouped = best_of(lambda: segment_from_events([events], ["times"], [id_list],
+                                                        config.duration),
+                            config.repeats)
+        print("{:>10} {:>10} {:>12.4f} {:>12.4f} {:>8.1f}".format(
+            n_record, events["times"].size, t_masked, t_grouped, t_masked / t_grouped))
+
+
+def benchmark_rate(config):
+    from quantities import ms
+    from analysis import population_rate
+
+    def per_train(spiketrains, begin, end, bin_width):
+        # the approach previously used in four_panel_figure.instantaneous_firing_rate()
+        bins = np.arange(begin, end, bin_width)
+        hist, _ = np.histogram(spiketrains[0].time_slice(begin*ms, end*ms)/ms, bins)
+        for st in spiketrains[1:]:
+            h, _ = np.histogram(st.time_slice(begin*ms, end*ms)/ms, bins)
+            hist += h
+        return hist * (1000/bin_width/len(spiketrains))
+
+    print("{:>10} {:>10} {:>14} {:>14} {:>8}".format("n_neurons", "bin (ms)", "per-train (s)",
+                                                     "population (s)", "speedup"))
+    for n_neurons in config.n_neurons:
+        spiketrains = synthetic_spiketrains(n_neurons, config.rate, config.duration)
+        begin, end = config.duration - 200.0, config.duration
+        for bin_width in config.bin_width:
+            expected = per_train(spiketrains, begin, end, bin_width)
+            assert np.allclose(population_rate(spiketrains, begin, end, bin_width).magnitude.flat,
+                               expected)
+            t_old = best_of(lambda: per_train(spiketrains, begin, end, bin_width), config.repeats)
+            t_new = best_of(lambda: population_rate(spiketrains, begin, end, bin_width),
+                            config.repeats)
+            print("{:>10} {:>10} {:>14.4f} {:>14.4f} {:>8.1f}".format(
+                n_neurons, bin_width, t_old, t_new, t_old / t_new))
+
+
+def benchmark_statistics(config):
+    from quantities import ms
+    from elephant.statistics import mean_firing_rate, cv, isi, lv, fanofactor
+    from spikestore import SpikeStore
+    from spikestats import firing_rates, cv_isi, local_variation, fano_factors
+
+    def per_train(spiketrains):
+        # the approach previously used in analysis.spike_statistics(), plus LV and Fano factor
+        rates = [mean_firing_rate(st).rescale("1/s") for st in spiketrains]
+        cvs = [cv(isi(st)) for st in spiketrains if st.size > 1]
+        lvs = [lv(isi(st)) for st in spiketrains if st.size > 2]
+        windows = np.arange(0, config.duration, 100.0)
+        fanos = [fanofactor([st.time_slice(t*ms, (t + 100.0)*ms) for t in windows])
+                 for st in spiketrains if st.size > 0]
+        return rates, cvs, lvs, fanos
+
+    def batched(spiketrains):
+        store = SpikeStore.from_spiketrains(spiketrains)
+        return (firing_rates(store), cv_isi(store), local_variation(store),
+                fano_factors(store, 100.0))
+
+    print("{:>10} {:>10} {:>14} {:>14} {:>8}".format("n_files", "n_neurons", "per-train (s)",
+                                                     "batched (s)", "speedup"))
+    files = [synthetic_spiketrains(config.n_neurons, config.rate, config.duration)
+             for i in range(config.n_files)]
+    # check that the batched statistics agree with those from elephant
+    expected = per_train(files[0])
+    for values, batched_values in zip(expected, batched(files[0])):
+        batched_values = batched_values[~np.isnan(batched_values)]
+        assert np.allclose(np.array(values, dtype=float), batched_values)
+    t_old = best_of(lambda: [per_train(spiketrains) for spiketrains in files], config.repeats)
+    t_new = best_of(lambda: [batched(spiketrains) for spiketrains in files], config.repeats)
+    print("{:>10} {:>10} {:>14.4f} {:>14.4f} {:>8.1f}".format(
+        config.n_files, config.n_neurons, t_old, t_new, t_old / t_new))
+
+
+def benchmark_delivery(config):
+    from spike_delivery import SpikeDelivery
+
+    n_neurons = 5 * config.order
+    indegree = int(0.1 * n_neurons)
+    rng = np.random.RandomState(2846)
+    sources = rng.randint(0, n_neurons, size=n_neurons * indegree)
+    targets = np.repeat(np.arange(n_neurons), indegree)
+    weights = rng.uniform(-1, 1, size=n_neurons)
+    methods = ("loop", "add.at", "bincount")
+    delivery = dict((method, SpikeDelivery.from_pairs(sources, targets, weights, n_neurons,
+                                                      delay_steps=15,
+                                                      method=method if method != "loop" else "bincount"))
+                    for method in methods)
+
+    def loop(spiking, step):
+        # the simplest approach: one update per spiking neuron
+        d = delivery["loop"]
+        row = d.buffer[(step + 1 + d.delay_steps) % d.buffer.shape[0]]
+        for i in spiking:
+            row[d.targets[d.indptr[i]:d.indptr[i + 1]]] += d.weights[i]
+
+    def run(method, spike_steps):
+        send = loop if method == "loop" else delivery[method].send
+        for step, spiking in enumerate(spike_steps):
+            send(spiking, step)
+
+    print("{} neurons, {} connections, dt = {} ms; throughput in millions of "
+          "synaptic events per second".format(n_neurons, sources.size, config.dt))
+    print("{:>10} {:>12}".format("rate (Hz)", "spikes/step") +
+          "".join("{:>12}".format(method) for method in methods))
+    for rate in config.rates:
+        spike_steps = [np.flatnonzero(rng.uniform(size=n_neurons) < rate * config.dt / 1000.0)
+                       for step in range(config.n_steps)]
+        n_events = sum(spiking.size for spiking in spike_steps) * indegree
+        times = [best_of(lambda: run(method, spike_steps), config.repeats) for method in methods]
+        print("{:>10} {:>12.1f}".format(rate, n_events / indegree / config.n_steps) +
+              "".join("{:>12.1f}".format(n_events / t / 1e6) for t in times))
+
+
+def benchmark_hybrid(config):
+    from brunel_network_numpy import build_network
+    from spikestore import SpikeStore
+    from spikestats import cv_isi, mean_statistic
+
+    print("order {}, g = {}, eta = {}, {} ms; rate and CV(ISI) after the first 100 ms".format(
+          config.order, config.g, config.eta, config.duration))
+    print("{:>24} {:>10} {:>10} {:>10} {:>10}".format("integration", "time (s)", "speedup",
+                                                     "rate (Hz)", "CV(ISI)"))
+    cases = [("time grid", dt) for dt in config.grid_dt] + [("precise", dt) for dt in config.hybrid_dt]
+    reference = None
+    for integration, dt in cases:
+        network = build_network(order=config.order, g=config.g, eta=config.eta, dt=dt,
+                                rng=np.random.RandomState(config.seed),
+                                hybrid=integration == "precise")
+        all_neurons = np.arange(network.size)
+        start = time.time()
+        spikes, signals = network.run(config.duration, all_neurons, np.array([], dtype=int))
+        elapsed = time.time() - start
+        reference = reference or elapsed
+        late = spikes["times"] >= 100.0
+        store = SpikeStore.from_events(spikes["times"][late], spikes["senders"][late],
+                                       channel_ids=all_neurons, t_start=100.0, t_stop=config.duration)
+        print("{:>24} {:>10.1f} {:>10.1f} {:>10.2f} {:>10.2f}".format(
+              "{}, dt={} ms".format(integration, dt), elapsed, reference / elapsed,
+              store.spike_counts.sum() / network.size / (config.duration - 100.0) * 1000.0,
+              mean_statistic(cv_isi(store), default=np.nan)))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--repeats", type=int, default=3,
+                    help="number of times to repeat each measurement")
+subparsers = parser.add_subparsers(dest="benchmark")
+
+segment_parser = subparsers.add_parser("segment",
+                                       help="grouping of recorded spikes by neuron")
+segment_parser.add_argument("--n-record", type=int, nargs="+",
+                            default=[500, 1000, 2500, 5000, 12500],
+                            help="numbers of recorded neurons")
+segment_parser.add_argument("--rate", type=float, default=30.0,
+                            help="mean firing rate (Hz)")
+segment_parser.add_argument("--duration", type=float, default=1200.0,
+                            help="recording duration (ms)")
+segment_parser.set_defaults(func=benchmark_segment)
+
+rate_parser = subparsers.add_parser("rate",
+                                    help="population firing rate histogram")
+rate_parser.add_argument("--n-neurons", type=int, nargs="+",
+                         default=[500, 1000, 2500, 5000, 12500],
+                         help="numbers of neurons")
+rate_parser.add_argument("--bin-width", type=float, nargs="+", default=[0.1, 1.0],
+                         help="bin widths (ms)")
+rate_parser.add_argument("--rate", type=float, default=38.0,
+                         help="mean firing rate (Hz)")
+rate_parser.add_argument("--duration", type=float, default=1200.0,
+                         help="recording duration (ms)")
+rate_parser.set_defaults(func=benchmark_rate)
+
+statistics_parser = subparsers.add_parser("statistics",
+                                          help="spike train statistics for a set of data files")
+statistics_parser.add_argument("--n-files", type=int, default=200,
+                               help="number of data files")
+statistics_parser.add_argument("--n-neurons", type=int, default=500,
+                               help="number of neurons per file")
+statistics_parser.add_argument("--rate", type=float, default=10.0,
+                               help="mean firing rate (Hz)")
+statistics_parser.add_argument("--duration", type=float, default=1200.0,
+                               help="recording duration (ms)")
+statistics_parser.set_defaults(func=benchmark_statistics)
+
+delivery_parser = subparsers.add_parser("delivery",
+                                        help="delayed delivery of spikes through recurrent connections")
+delivery_parser.add_argument("--order", type=int, default=1000,
+                             help="network size, as in the parameter files")
+delivery_parser.add_argument("--rates", type=float, nargs="+", default=[1, 5, 10, 30, 100],
+                             help="firing rates (Hz)")
+delivery_parser.add_argument("--dt", type=float, default=0.1,
+                             help="time step (ms)")
+delivery_parser.add_argument("--n-steps", type=int, default=1000,
+                             help="number of time steps")
+delivery_parser.set_defaults(func=benchmark_delivery)
+
+hybrid_parser = subparsers.add_parser("hybrid",
+                                      help="network simulation with precise spike times")
+hybrid_parser.add_argument("--order", type=int, default=1000,
+                           help="network size, as in the parameter files")
+hybrid_parser.add_argument("--g", type=float, default=6.0,
+                           help="relative strength of inhibitory synapses")
+hybrid_parser.add_argument("--eta", type=float, default=1.0,
+                           help="ratio of external to threshold firing rates; the defaults "
+                                "give asynchronous activity at a low rate")
+hybrid_parser.add_argument("--duration", type=float, default=1200.0,
+                           help="simulation duration (ms)")
+hybrid_parser.add_argument("--grid-dt", type=float, nargs="+", default=[0.01, 0.1],
+                           help="time steps (ms) with spike times on the time grid")
+hybrid_parser.add_argument("--hybrid-dt", type=float, nargs="+", default=[0.1, 0.5],
+                           help="time steps (ms) with precise spike times")
+hybrid_parser.add_argument("--seed", type=int, default=4569435,
+                           help="random number seed")
+hybrid_parser.set_defaults(func=benchmark_hybrid)
+
+config = parser.parse_args()
+config.func(config)
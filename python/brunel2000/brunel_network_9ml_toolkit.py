@@ -6,54 +6,165 @@ Network model from
 expressed in NineML using the Python API and then
 simulated using the 9ml-toolkit
 
+Compiling the model takes much longer than simulating a small network, so
+the exported XML and the compiled model are cached (see cache.py) and reused by later simulations
+of the same model, e.g. with a different seed or duration. The numerical
+values of the parameters are compiled into the model, so the cache key
+includes them. To compile the model in the working directory every time,
+set "model_cache: false" in the "experiment" parameters.
+
 """
 
 from __future__ import division
 from datetime import datetime
 import os, sys
+import re
+import shutil
+import tempfile
 from sarge import run
-from brunel_network_nineml import build_model
+from brunel_network_nineml import export_model
 from ninemltoolkitio import NineMLToolkitIO
+from timing import Timer, timings_filename
+from cache import FileCache, content_hash, file_hash
+
+TOOLKIT_COMMAND = os.path.join(os.path.dirname(sys.executable), "9ML-network")
+COMPILE_OPTIONS = "-m crk3"
+CACHED_MODEL_NAME = "model"  # the name of the XML file, without extension, in the cache
 
 
-def run_simulation(parameters, plot_figure=False):
+def run_simulation(parameters, plot_figure=False, timer=None):
 
+    timer = timer or Timer()
+    timer.start("export")
 
     # create XML file using Python lib9ml
     timestamp = datetime.now()
-    model = build_model(**parameters["network"])
+    use_cache = parameters["experiment"].get("model_cache", True)
     if "full_filename" in parameters["experiment"]:  # actually a directory name + prefix
         #ext = os.path.splitext(parameters["experiment"]["full_filename"])[1]
         #xml_file = parameters["experiment"]["full_filename"].replace(ext, ".xml")
         xml_file = parameters["experiment"]["full_filename"] + ".xml"
     else:
         xml_file = "{}.xml".format(parameters["experiment"]["base_filename"])
-    model.write(xml_file)
-    print("Exported model to file {}".format(xml_file))
-
-    # run simulation using 9ML-toolkit
-    working_dir = os.path.dirname(xml_file)
-    xml_file = os.path.basename(xml_file)
-    cmd = "{}/9ML-network -m crk3 {}".format(os.path.dirname(sys.executable),
-                                             xml_file)
-    print(cmd)
-    run(cmd, cwd=working_dir, async=False)
+    export_model(parameters["network"], xml_file, use_cache)
 
-    cmd = './Sim_{} -d {} --timestep={} --spikerecord="All" --statesample=1'.format(
-                                                         os.path.splitext(xml_file)[0],
+    # generate and compile the simulation code using 9ML-toolkit
+    timer.start("compile")
+    working_dir = os.path.dirname(xml_file) or "."
+    name = os.path.splitext(os.path.basename(xml_file))[0]
+    if use_cache:
+        model_dir = compiled_model(xml_file)
+    else:
+        compile_model(xml_file)
+
+    timer.start("simulate")
+    options = '-d {} --timestep={} --spikerecord="All" --statesample=1'.format(
                                                          parameters["experiment"]["duration"],
                                                          parameters["experiment"]["timestep"],
                                                          parameters["experiment"]["n_record"])
+    if use_cache:
+        run_compiled_model(model_dir, name, working_dir, options)
+    else:
+        cmd = './Sim_{} {}'.format(name, options)
+        print(cmd)
+        run(cmd, cwd=working_dir, async=False)
 
-
-    print(cmd)
-    run(cmd, cwd=working_dir, async=False)
-
+    # the toolkit writes the data during the simulation
     if plot_figure:
+        timer.start("retrieve")
         io = NineMLToolkitIO(parameters["experiment"]["base_filename"])
         block = io.read()[0]
         data = {"All": block.segments[0]}
     else:
-        data = None
+        data = {}
 
+    timer.stop()
+    if "full_filename" in parameters["experiment"]:
+        timer.save(timings_filename(parameters["experiment"]["full_filename"]))
+    data["timings"] = timer.timings
     return data
+
+
+def compile_model(xml_file):
+    """
+    Generate and compile the simulation code for the model in `xml_file`,
+    creating the executable "Sim_<name>" in the same directory, where <name>
+    is the name of the XML file without its extension.
+    """
+    cmd = "{} {} {}".format(TOOLKIT_COMMAND, COMPILE_OPTIONS, os.path.basename(xml_file))
+    print(cmd)
+    run(cmd, cwd=os.path.dirname(xml_file) or ".", async=False)
+
+
+def model_key(xml_file):
+    """
+    Return the cache key for the compiled model: a hash of the XML, of the
+    component definitions which it references and of the toolkit version.
+    """
+    with open(xml_file, "rb") as fp:
+        xml = fp.read()
+    parts = [xml, COMPILE_OPTIONS]
+    if os.path.exists(TOOLKIT_COMMAND):
+        status = os.stat(TOOLKIT_COMMAND)
+        parts.append("{} {}".format(status.st_size, int(status.st_mtime)))
+    for url in sorted(set(re.findall(r'url="([^"#]+)', xml.decode("utf-8")))):
+        if os.path.isfile(url):
+            parts.append(file_hash(url))
+    return content_hash(*parts)
+
+
+def compiled_model(xml_file):
+    """
+    Return the cache directory containing the compiled model for `xml_file`,
+    compiling it if it is not already in the cache.
+    """
+    def create(directory):
+        cached_xml_file = os.path.join(directory, CACHED_MODEL_NAME + ".xml")
+        shutil.copy(xml_file, cached_xml_file)
+        compile_model(cached_xml_file)
+        if not os.path.exists(os.path.join(directory, "Sim_" + CACHED_MODEL_NAME)):
+            raise Exception("9ML-network did not create Sim_{}".format(CACHED_MODEL_NAME))
+
+    cache = FileCache("9mltoolkit")
+    key = model_key(xml_file)
+    if cache.get(key):
+        print("Using the compiled model in {}".format(cache.path(key)))
+    return cache.get_or_create(key, create)
+
+
+def rename(filename, old_name, new_name):
+    """Replace `old_name` with `new_name` at the start of `filename` or after "Sim_"."""
+    for prefix in ("Sim_", ""):
+        if filename.startswith(prefix + old_name):
+            return prefix + new_name + filename[len(prefix + old_name):]
+    return filename
+
+
+def run_compiled_model(model_dir, name, working_dir, options):
+    """
+    Run the compiled model in `model_dir` (from compiled_model()), with the
+    command-line `options`, as though it had been compiled from "<name>.xml"
+    in `working_dir`, so that the output files have the usual names.
+
+    The model is run in a temporary subdirectory, so that simulations of the
+    same model can run concurrently in the same working directory.
+    """
+    run_dir = tempfile.mkdtemp(prefix=".run-", dir=working_dir)
+    try:
+        for filename in os.listdir(model_dir):
+            source = os.path.join(model_dir, filename)
+            target = os.path.join(run_dir, rename(filename, CACHED_MODEL_NAME, name))
+            try:
+                os.symlink(os.path.abspath(source), target)
+            except (AttributeError, OSError):  # e.g. not supported by the file system
+                shutil.copy2(source, target)
+        from_cache = set(os.listdir(run_dir))
+        cmd = './Sim_{} {}'.format(name, options)
+        print(cmd)
+        run(cmd, cwd=run_dir, async=False)
+        for filename in os.listdir(run_dir):
+            if filename not in from_cache:
+                shutil.move(os.path.join(run_dir, filename),
+                            os.path.join(working_dir, rename(filename, CACHED_MODEL_NAME, name)))
+    finally:
+        shutil.rmtree(run_dir)
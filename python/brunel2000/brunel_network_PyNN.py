@@ -4,42 +4,64 @@ Simulation script for the Brunel (2000) network model described with the PyNN AP
 
 from __future__ import division, print_function
 from datetime import datetime
+import numpy as np
 from numpy import exp, random
 from pyNN.utility import SimulationProgressBar
 from pyNN.random import RandomDistribution, NumpyRNG
-from utility import psp_height
+from utility import psp_height, write_population_data, numpy_seed
+from timing import Timer, timings_filename
+from connectivity import connectivity_from_parameters
 
 
-def run_simulation(parameters, plot_figure=False):
+def run_simulation(parameters, plot_figure=False, timer=None):
     """
 
     """
+    timer = timer or Timer()
     timestamp = datetime.now()
     dt = 0.1
     simulator_name = parameters["simulator"]
-    exec("import {} as sim".format(simulator_name))
+    with timer.phase("import"):
+        exec("import {} as sim".format(simulator_name))
+
+    timer.start("build")
 
     seed = parameters["experiment"]["seed"]
-    sim.setup(timestep=dt, rng_seeds=[seed])
+    threads = parameters["experiment"].get("threads", 1)
+    if simulator_name == "pyNN.nest":
+        # NEST needs one random number generator per virtual process (thread
+        # or MPI process), so they are all seeded from `seed`
+        sim.setup(timestep=dt, threads=threads, rng_seeds_seed=seed)
+    else:
+        sim.setup(timestep=dt, rng_seeds=[seed])
 
+    timer.start("connect")
+    connectivity = connectivity_from_parameters(parameters)
+    timer.start("build")
     print("Building network")
-    stim, exc, inh = build_network(sim, seed=seed, **parameters["network"])
+    stim, exc, inh = build_network(sim, seed=seed, timer=timer, connectivity=connectivity,
+                                   **parameters["network"])
 
+    timer.start("build")
+    # the same neurons must be chosen on every MPI process
+    record_rng = NumpyRNG(numpy_seed(seed))
     if plot_figure:
         stim[:100].record('spikes')
-        exc.sample(50).record("spikes")
-        exc.sample(3).record("v")
-        inh.sample(50).record("spikes")
-        inh.sample(3).record("v")
+        exc.sample(50, rng=record_rng).record("spikes")
+        exc.sample(3, rng=record_rng).record("v")
+        inh.sample(50, rng=record_rng).record("spikes")
+        inh.sample(3, rng=record_rng).record("v")
     else:
         all = exc + inh
-        all.sample(parameters["experiment"]["n_record"]).record("spikes")
+        all.sample(parameters["experiment"]["n_record"], rng=record_rng).record("spikes")
 
+    timer.start("simulate")
     print("Running simulation")
     t_stop = parameters["experiment"]["duration"]
     pb = SimulationProgressBar(t_stop/80, t_stop)
     sim.run(t_stop, callbacks=[pb])
 
+    timer.start("retrieve")
     print("Handling data")
     data = {}
     if plot_figure:
@@ -53,16 +75,24 @@ def run_simulation(parameters, plot_figure=False):
             filename = "{}_{}_{:%Y%m%d%H%M%S}.h5".format(parameters["experiment"]["base_filename"],
                                                          parameters["simulator"],
                                                          timestamp)
-        print("Writing data to {}".format(filename))
-        all.write_data(filename)
+        write_population_data(sim, all, filename, timer)
+        timer.stop()
+        if sim.rank() == 0:
+            timer.save(timings_filename(filename))
 
     sim.end()
+    timer.stop()
+    data["timings"] = timer.timings
     return data
 
 
 def build_network(sim, order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
                   tau=20.0, tau_syn=0.1, tau_refrac=2.0, v_reset=10.0,
-                  R=1.5, g=5, eta=2, seed=None):
+                  R=1.5, g=5, eta=2, seed=None, timer=None, connectivity=None):
+    """
+    If `connectivity` (a connectivity.Connectivity) is given, the recurrent
+    connections are taken from it rather than drawn by the connectors.
+    """
 
     NE = 4 * order
     NI = 1 * order
@@ -80,7 +110,8 @@ def build_network(sim, order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
     p_rate = 1000.0 * nu_ex * CE
 
     assert seed is not None
-    rng = NumpyRNG(seed)
+    timer = timer or Timer()
+    rng = NumpyRNG(numpy_seed(seed))
 
     neuron_params = {"cm":        CMem,
                      "tau_m":      tau,
@@ -98,13 +129,23 @@ def build_network(sim, order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
 
     stim = sim.Population(NE + NI, sim.SpikeSourcePoisson(rate=p_rate))
 
+    timer.start("connect")
     print("Connecting network")
 
     exc_synapse = sim.StaticSynapse(weight=J_ex, delay=delay)
     inh_synapse = sim.StaticSynapse(weight=J_in, delay=delay)
 
     input_connections = sim.Projection(stim, all, sim.OneToOneConnector(), exc_synapse)
-    exc_connections = sim.Projection(exc, all, sim.FixedNumberPreConnector(n=CE, rng=rng), exc_synapse)  # check is Pre not Post
-    inh_connections = sim.Projection(inh, all, sim.FixedNumberPreConnector(n=CI, rng=rng), inh_synapse)
+    if connectivity is None:
+        exc_connector = sim.FixedNumberPreConnector(n=CE, rng=rng)  # check is Pre not Post
+        inh_connector = sim.FixedNumberPreConnector(n=CI, rng=rng)
+    else:
+        # the weights come from the synapse types, so only the connections are reused
+        sources, targets = connectivity.connections(excitatory=True)
+        exc_connector = sim.FromListConnector(np.column_stack((sources, targets)))
+        sources, targets = connectivity.connections(excitatory=False)
+        inh_connector = sim.FromListConnector(np.column_stack((sources - NE, targets)))
+    exc_connections = sim.Projection(exc, all, exc_connector, exc_synapse)
+    inh_connections = sim.Projection(inh, all, inh_connector, inh_synapse)
 
     return stim, exc, inh
@@ -1,30 +1,49 @@
 """
 
 Based on the brunel-alpha-nest.py example from the NEST distribution
+
+The simulation may be distributed over threads, set by "threads" in the
+"experiment" parameters, and over MPI processes, by launching the script with
+mpirun (run.py does this when "mpi_processes" is greater than one). Each MPI
+process records only its own neurons; the recorded data are gathered to, and
+written by, the first process.
 """
 
 from __future__ import division, print_function
 from datetime import datetime
 import nest
+import numpy as np
 from numpy import exp, random
 import neo
-from utility import segment_from_recording_device, psp_height
+from utility import segment_from_recording_device, psp_height, virtual_process_seeds, numpy_seed
+from timing import Timer, timings_filename
+from connectivity import connectivity_from_parameters
 
 
-def run_simulation(parameters, plot_figure=False):
+def run_simulation(parameters, plot_figure=False, timer=None):
     """
 
     """
+    timer = timer or Timer()
+    timer.start("build")
     timestamp = datetime.now()
     dt = parameters["experiment"]["timestep"]
     nest.ResetKernel()
     seed = parameters["experiment"]["seed"]
-    nest.SetKernelStatus({"resolution": dt, "print_time": True, 'local_num_threads': 1,
-                          "rng_seeds": [seed],
-                          "grng_seed": seed + 1})
-
-    stim, exc, inh = build_network(**parameters["network"])
-
+    nest.SetKernelStatus({"resolution": dt, "print_time": True,
+                          'local_num_threads': parameters["experiment"].get("threads", 1)})
+    n_vp = nest.GetKernelStatus("total_num_virtual_procs")
+    rng_seeds, grng_seed = virtual_process_seeds(seed, n_vp)
+    nest.SetKernelStatus({"rng_seeds": rng_seeds, "grng_seed": grng_seed})
+    print("{} MPI process(es) x {} thread(s) = {} virtual processes".format(
+          nest.NumProcesses(), nest.GetKernelStatus("local_num_threads"), n_vp))
+
+    timer.start("connect")
+    connectivity = connectivity_from_parameters(parameters)
+    timer.start("build")
+    stim, exc, inh = build_network(timer=timer, connectivity=connectivity, **parameters["network"])
+
+    timer.start("build")
     if plot_figure:
         sspikes = nest.Create("spike_detector")
         espikes = nest.Create("spike_detector")
@@ -45,13 +64,16 @@ def run_simulation(parameters, plot_figure=False):
     else:
         all_spikes = nest.Create("spike_detector")
         nest.SetStatus(all_spikes, [{"label": "brunel-py-all", "withtime": True, "withgid": True}])
-        to_record = random.permutation(exc + inh)[:parameters["experiment"]["n_record"]].tolist()
+        # the same neurons must be chosen on every MPI process
+        to_record = random.RandomState(numpy_seed(seed)).permutation(exc + inh)[:parameters["experiment"]["n_record"]].tolist()
         nest.Connect(to_record, all_spikes, syn_spec="excitatory")
 
+    timer.start("simulate")
     print("Simulating")
     simtime = parameters["experiment"]["duration"]
     nest.Simulate(simtime + dt)
 
+    timer.start("retrieve")
     print("Handling data")
     data = {}
     if plot_figure:
@@ -60,6 +82,11 @@ def run_simulation(parameters, plot_figure=False):
         data["inh"] = segment_from_recording_device([ispikes, ivm], ['times', 'V_m'], [inh[:50], inh[:3]], simtime, "inh")
     else:
         data["all"] = segment_from_recording_device([all_spikes], ['times'], [to_record], simtime, "all")
+    if nest.Rank() > 0:
+        # the data were gathered to the first MPI process, which writes them
+        data = {}
+    elif not plot_figure:
+        timer.start("write")
         block = neo.Block()
         block.segments.append(data["all"])
         if "full_filename" in parameters["experiment"]:
@@ -69,15 +96,24 @@ def run_simulation(parameters, plot_figure=False):
                                                            timestamp)
         io = neo.get_io(filename)
         io.write(block)
+        timer.stop()
+        timer.save(timings_filename(filename))
 
     #import pdb; pdb.set_trace()
+    timer.stop()
+    data["timings"] = timer.timings
     return data
 
 
 def build_network(order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
                   tau=20.0, tau_syn=0.1, tau_refrac=2.0, v_reset=10.0,
-                  R=1.5, g=5, eta=2):
+                  R=1.5, g=5, eta=2, timer=None, connectivity=None):
+    """
+    If `connectivity` (a connectivity.Connectivity) is given, the recurrent
+    connections are taken from it rather than drawn by NEST.
+    """
 
+    timer = timer or Timer()
     NE = 4 * order
     NI = 1 * order
     CE = int(epsilon * NE)  # number of excitatory synapses per neuron
@@ -113,6 +149,7 @@ def build_network(order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
     nest.SetDefaults("poisson_generator", {"rate": p_rate})
     stim = nest.Create("poisson_generator")
 
+    timer.start("connect")
     print("Connecting network")
 
     nest.CopyModel("static_synapse", "excitatory", {"weight": J_ex, "delay": delay})
@@ -122,9 +159,15 @@ def build_network(order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
     nest.Connect(stim, inh, syn_spec="excitatory")
 
 
-    # We now iterate over all neuron IDs, and connect the neuron to
-    # the sources from our array. The first loop connects the excitatory neurons
-    # and the second loop the inhibitory neurons.
+    if connectivity is not None:
+        # the weights come from the synapse models, so only the connections are reused
+        gids = np.array(exc + inh)
+        for excitatory, synapse_model in ((True, "excitatory"), (False, "inhibitory")):
+            print("{} connections".format(synapse_model.capitalize()))
+            sources, targets = connectivity.connections(excitatory)
+            nest.Connect(gids[sources].tolist(), gids[targets].tolist(),
+                         {"rule": "one_to_one"}, synapse_model)
+        return stim, exc, inh
 
     print("Excitatory connections")
 
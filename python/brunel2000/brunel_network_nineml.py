@@ -11,35 +11,51 @@ backend.
 
 from __future__ import division
 import os
+import json
+import shutil
+import inspect
 from datetime import datetime
 from pyNN.nineml.read import Network
 from pyNN.utility import SimulationProgressBar
 import nineml.user as nineml
 from nineml.units import ms, mV, nA, unitless, Hz, Mohm
-from utility import psp_height
+from utility import psp_height, write_population_data
+from timing import Timer, timings_filename
+from cache import FileCache, content_hash
 
 #CATALOG_URL = "/home/docker/projects/nineml_demo_2016/catalog/xml/"
 CATALOG_URL = "/home/andrew/dev/NineML_demo_2016/catalog/xml/"
 
-def run_simulation(parameters, plot_figure=False):
+# NineML documents already parsed by this process, indexed by model_key()
+_documents = {}
+
+def run_simulation(parameters, plot_figure=False, timer=None):
     """
 
     """
-    import pyNN.neuron as sim
+    timer = timer or Timer()
+    with timer.phase("import"):
+        import pyNN.neuron as sim
 
+    timer.start("export")
     timestamp = datetime.now()
-    model = build_model(**parameters["network"])
     if "full_filename" in parameters["experiment"]:
         xml_file = os.path.splitext(parameters["experiment"]["full_filename"])[0] + ".xml"
     else:
         xml_file = "{}.xml".format(parameters["experiment"]["base_filename"])
-    model.write(xml_file)
-    print("Exported model to file {}".format(xml_file))
+    use_cache = parameters["experiment"].get("model_cache", True)
+    export_model(parameters["network"], xml_file, use_cache)
 
+    # reading the model creates the populations and the projections together,
+    # so the "build" phase includes creating the connections
+    timer.start("build")
     sim.setup(timestep=parameters["experiment"]["timestep"])
 
     print("Building network")
-    net = Network(sim, xml_file)
+    if use_cache:
+        net = Network(sim, parsed_model(parameters["network"], xml_file))
+    else:
+        net = Network(sim, xml_file)
 
     if plot_figure:
         stim = net.populations["Ext"]
@@ -54,11 +70,13 @@ def run_simulation(parameters, plot_figure=False):
         all = net.assemblies["All"]
         all.sample(parameters["experiment"]["n_record"]).record("spikes")
 
+    timer.start("simulate")
     print("Running simulation")
     t_stop = parameters["experiment"]["duration"]
     pb = SimulationProgressBar(t_stop/80, t_stop)
     sim.run(t_stop, callbacks=[pb])
 
+    timer.start("retrieve")
     print("Handling data")
     data = {}
     if plot_figure:
@@ -71,13 +89,67 @@ def run_simulation(parameters, plot_figure=False):
         else:
             filename = "{}_nineml_{:%Y%m%d%H%M%S}.h5".format(parameters["experiment"]["base_filename"],
                                                              timestamp)
-        print("Writing data to {}".format(filename))
-        all.write_data(filename)
+        write_population_data(sim, all, filename, timer)
+        timer.stop()
+        if sim.rank() == 0:
+            timer.save(timings_filename(filename))
 
     sim.end()
+    timer.stop()
+    data["timings"] = timer.timings
     return data
 
 
+def model_key(network_parameters):
+    """
+    Return a hash of the arguments of build_model(), and of the code which
+    builds the model from them, identifying the NineML description.
+    """
+    import nineml as nineml_package
+    return content_hash(json.dumps(network_parameters, sort_keys=True),
+                        inspect.getsource(build_model),
+                        CATALOG_URL,
+                        getattr(nineml_package, "__version__", ""))
+
+
+def export_model(network_parameters, xml_file, use_cache=True):
+    """
+    Write the NineML description of the model built by
+    build_model(**network_parameters) to `xml_file`.
+
+    If `use_cache` is True, the XML is taken from the cache (see cache.py) if
+    the same model has already been exported, and added to it otherwise.
+    """
+    if not use_cache:
+        build_model(**network_parameters).write(xml_file)
+        print("Exported model to file {}".format(xml_file))
+        return
+
+    def create(directory):
+        build_model(**network_parameters).write(os.path.join(directory, "model.xml"))
+
+    cache = FileCache("nineml")
+    key = model_key(network_parameters)
+    if cache.get(key):
+        print("Using the exported model in {}".format(cache.path(key)))
+    shutil.copy(os.path.join(cache.get_or_create(key, create), "model.xml"), xml_file)
+    print("Exported model to file {}".format(xml_file))
+
+
+def parsed_model(network_parameters, xml_file):
+    """
+    Return the NineML document read from `xml_file`, written by
+    export_model(network_parameters, ...). The document is parsed only once
+    per process for each model, e.g. when a sweep runs many simulations in
+    each worker process.
+    """
+    from nineml import read
+    key = model_key(network_parameters)
+    if key not in _documents:
+        _documents[key] = read(xml_file)
+    return _documents[key]
+
+
 def build_model(order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
                 tau=20.0, tau_syn=0.1, tau_refrac=2.0, v_reset=10.0,
                 R=1.5, g=5, eta=2):
@@ -12,13 +12,16 @@ from pyNN.neuron.nineml import nineml_cell_type
 from pyNN.random import RandomDistribution, NumpyRNG
 from nineml.abstraction import Dynamics
 from nineml import read
-from utility import psp_height
+from utility import psp_height, write_population_data
+from timing import Timer, timings_filename
 
 
-def run_simulation(parameters, plot_figure=False):
+def run_simulation(parameters, plot_figure=False, timer=None):
     """
 
     """
+    timer = timer or Timer()
+    timer.start("build")
     timestamp = datetime.now()
     dt = 0.1
 
@@ -26,8 +29,9 @@ def run_simulation(parameters, plot_figure=False):
     sim.setup(timestep=dt)
 
     print("Building network")
-    stim, exc, inh = build_network(sim, seed=seed, **parameters["network"])
+    stim, exc, inh = build_network(sim, seed=seed, timer=timer, **parameters["network"])
 
+    timer.start("build")
     if plot_figure:
         stim[:100].record('spikes')
         exc.sample(50).record("spikes")
@@ -38,11 +42,13 @@ def run_simulation(parameters, plot_figure=False):
         all = exc + inh
         all.sample(parameters["experiment"]["n_record"]).record("spikes")
 
+    timer.start("simulate")
     print("Running simulation")
     t_stop = parameters["experiment"]["duration"]
     pb = SimulationProgressBar(t_stop/80, t_stop)
     sim.run(t_stop, callbacks=[pb])
 
+    timer.start("retrieve")
     print("Handling data")
     data = {}
     if plot_figure:
@@ -55,16 +61,20 @@ def run_simulation(parameters, plot_figure=False):
         else:
             filename = "{}_ninemlpartial_{:%Y%m%d%H%M%S}.h5".format(parameters["experiment"]["base_filename"],
                                                                               timestamp)
-        print("Writing data to {}".format(filename))
-        all.write_data(filename)
+        write_population_data(sim, all, filename, timer)
+        timer.stop()
+        if sim.rank() == 0:
+            timer.save(timings_filename(filename))
 
     sim.end()
+    timer.stop()
+    data["timings"] = timer.timings
     return data
 
 
 def build_network(sim, order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
                   tau=20.0, tau_syn=0.1, tau_refrac=2.0, v_reset=10.0,
-                  R=1.5, g=5, eta=2, seed=None):
+                  R=1.5, g=5, eta=2, seed=None, timer=None):
 
     NE = 4 * order
     NI = 1 * order
@@ -82,6 +92,7 @@ def build_network(sim, order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
     p_rate = 1000.0 * nu_ex * CE
 
     assert seed is not None
+    timer = timer or Timer()
     rng = NumpyRNG(seed)
 
     neuron_params = {
@@ -105,6 +116,7 @@ def build_network(sim, order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
 
     stim = sim.Population(NE + NI, nineml_cell_type('Poisson', read("sources/Poisson.xml")['Poisson'], {})(rate=p_rate))
 
+    timer.start("connect")
     print("Connecting network")
 
     exc_synapse = sim.StaticSynapse(weight=J_ex, delay=delay)
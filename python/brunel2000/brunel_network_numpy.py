@@ -0,0 +1,483 @@
+"""
+Network model from
+
+    Brunel, N. (2000) J. Comput. Neurosci. 8: 183-208
+
+simulated directly with NumPy, without an external simulator.
+
+The neuron and synapse models are those of sources/brunelIaF.py and
+sources/alphaPSR.py, and the network is that of brunel_network_nineml.py.
+The state of each population is held in arrays, updated for all neurons at
+once in each time step.
+
+The subthreshold dynamics are linear, so they are integrated exactly over each
+time step ("exact integration", Rotter & Diesmann, 1999); the accuracy does not
+depend on the time step, apart from the times of spikes being rounded to the
+end of a step. Since all synapses have the same time constant, the synaptic
+currents onto a neuron are summed into a single pair of state variables (a, b).
+
+As in NEST, a neuron is refractory for exactly tau_refrac after a spike, and
+incoming spikes arrive at the start of a time step. Spikes are delivered
+through the recurrent connections by spike_delivery.SpikeDelivery.
+
+In the "numpy.hybrid" implementation (HybridNetwork), spikes are not rounded
+to the time grid: each incoming spike contributes to the state from its exact
+arrival time, and the time at which the threshold is crossed is found by
+root-finding on the closed-form trajectory. The threshold is tested every
+"hybrid_step" (default 0.1 ms) of the "experiment" parameters, which may be
+much longer than "timestep", used only to sample the membrane potential.
+
+"""
+
+from __future__ import division, print_function
+from datetime import datetime
+import numpy as np
+import neo
+from utility import psp_height, segment_from_events, numpy_seed
+from spike_delivery import SpikeDelivery, TimedSpikeDelivery
+from timing import Timer, timings_filename
+from connectivity import Connectivity, connectivity_from_parameters
+
+
+def run_simulation(parameters, plot_figure=False, timer=None):
+    """
+
+    """
+    timer = timer or Timer()
+    timer.start("build")
+    timestamp = datetime.now()
+    dt = parameters["experiment"]["timestep"]
+    rng = np.random.RandomState(numpy_seed(parameters["experiment"]["seed"]))
+    timer.start("connect")
+    connectivity = connectivity_from_parameters(parameters)
+    timer.start("build")
+
+    hybrid = parameters.get("hybrid", False)
+    if hybrid:
+        network = build_network(dt=parameters["experiment"].get("hybrid_step", 0.1), rng=rng,
+                                hybrid=True, connectivity=connectivity, timer=timer,
+                                **parameters["network"])
+    else:
+        network = build_network(dt=dt, rng=rng, connectivity=connectivity, timer=timer,
+                                **parameters["network"])
+
+    if plot_figure:
+        exc = np.arange(network.n_exc)
+        inh = network.n_exc + np.arange(network.n_inh)
+        record_spikes = np.hstack((exc[:50], inh[:50]))
+        record_v = np.hstack((exc[:3], inh[:3]))
+    else:
+        record_spikes = np.sort(rng.permutation(network.size)[:parameters["experiment"]["n_record"]])
+        record_v = np.array([], dtype=int)
+
+    timer.start("simulate")
+    print("Simulating")
+    simtime = parameters["experiment"]["duration"]
+    if hybrid:
+        spikes, signals = network.run(simtime, record_spikes, record_v, sampling_interval=dt)
+    else:
+        spikes, signals = network.run(simtime, record_spikes, record_v)
+
+    timer.start("retrieve")
+    print("Handling data")
+    data = {}
+    if plot_figure:
+        data["exc"] = segment_from_events([spikes, signals], ['times', 'v'],
+                                          [exc[:50].tolist(), exc[:3].tolist()], simtime, "exc")
+        data["inh"] = segment_from_events([spikes, signals], ['times', 'v'],
+                                          [inh[:50].tolist(), inh[:3].tolist()], simtime, "inh")
+    else:
+        data["all"] = segment_from_events([spikes], ['times'], [record_spikes.tolist()], simtime, "all")
+        timer.start("write")
+        block = neo.Block()
+        block.segments.append(data["all"])
+        if "full_filename" in parameters["experiment"]:
+            filename = parameters["experiment"]["full_filename"]
+        else:
+            filename = "{}_{}_{:%Y%m%d%H%M%S}.pkl".format(parameters["experiment"]["base_filename"],
+                                                         "numpy.hybrid" if hybrid else "numpy",
+                                                         timestamp)
+        io = neo.get_io(filename)
+        io.write(block)
+        timer.stop()
+        timer.save(timings_filename(filename))
+
+    timer.stop()
+    data["timings"] = timer.timings
+    return data
+
+
+def build_network(order=1000, epsilon=0.1, delay=1.5, J=0.1, theta=20.0,
+                  tau=20.0, tau_syn=0.1, tau_refrac=2.0, v_reset=10.0,
+                  R=1.5, g=5, eta=2, dt=0.1, rng=None, hybrid=False, connectivity=None,
+                  timer=None):
+    """
+    Build the network, with the same parameters as brunel_network_nineml.build_model().
+    The recurrent connections are taken from `connectivity` (a
+    connectivity.Connectivity) if given, otherwise they are drawn from `rng`.
+
+    Returns a Network object or, if `hybrid` is True, a HybridNetwork.
+    """
+    if rng is None:
+        rng = np.random.RandomState()
+    timer = timer or Timer()
+    Ne = 4 * order     # number of excitatory neurons
+    Ni = 1 * order     # number of inhibitory neurons
+    Ce = int(epsilon * Ne)  # number of excitatory synapses per neuron
+    Ci = int(epsilon * Ni)  # number of inhibitory synapses per neuron
+    Cext = Ce          # effective number of external synapses per neuron
+    Je = J / psp_height(tau, R, tau_syn)  # (nA) synaptic weight
+    Ji = -g * Je       # inhibitory weights
+    Jext = Je          # external weights
+    nu_thresh = theta / (Je * Ce * R * tau_syn)  # threshold rate
+    nu_ext = eta * nu_thresh      # external rate per synapse
+    input_rate = 1000.0 * nu_ext * Cext   # mean input spiking rate
+
+    print("Building network")
+    N = Ne + Ni
+    timer.start("connect")
+    if connectivity is None:
+        connectivity = Connectivity.generate(order, epsilon, rng)
+    sources, targets = connectivity.sources, connectivity.targets
+    source_weights = np.where(np.arange(N) < Ne, Je, Ji)
+    if hybrid:
+        delivery = TimedSpikeDelivery.from_pairs(sources, targets, source_weights, N, delay, dt)
+        network_class = HybridNetwork
+    else:
+        delivery = SpikeDelivery.from_pairs(sources, targets, source_weights, N,
+                                            delay_steps=int(round(delay / dt)))
+        network_class = Network
+
+    timer.start("build")
+    return network_class(Ne, Ni, delivery, input_rate, Jext, dt=dt, tau=tau, tau_syn=tau_syn,
+                         theta=theta, tau_refrac=tau_refrac, v_reset=v_reset, R=R,
+                         v_init=rng.uniform(0.0, theta, size=N), rng=rng)
+
+
+def propagators(delta, tau, tau_syn, R):
+    """
+    Return the propagators (P_vv, P_va, P_vb, P_aa, P_ab, P_bb) for exact
+    integration over an interval `delta` (ms, a scalar or an array) of
+
+        da/dt = (b - a)/tau_syn,  db/dt = -b/tau_syn,  dv/dt = (-v + R*a)/tau
+
+    so that, e.g., v(t + delta) = P_vv*v(t) + P_va*a(t) + P_vb*b(t).
+    tau and tau_syn must differ.
+    """
+    decay_syn = np.exp(-delta / tau_syn)
+    decay_m = np.exp(-delta / tau)
+    k = 1.0 / tau_syn - 1.0 / tau
+    # with exp(-k*delta) = decay_syn/decay_m, these are
+    #   R/tau * decay_m * int_0^delta exp(-k*s) ds  and
+    #   R/tau * decay_m * int_0^delta s*exp(-k*s) ds / tau_syn
+    P_va = R / (tau * k) * (decay_m - decay_syn)
+    P_vb = R / (tau * tau_syn * k**2) * (decay_m - decay_syn * (1 + k * delta))
+    return decay_m, P_va, P_vb, decay_syn, delta / tau_syn * decay_syn, decay_syn
+
+
+def repeat_events(events, n_queries, n_repeats):
+    """
+    Repeat the spikes in `events`, a tuple (query, times, weights) as used by
+    HybridNetwork.trajectory(), for `n_repeats` sets of `n_queries` queries:
+    the spikes of query q are given to queries q, q + n_queries, and so on.
+    """
+    query, times, weights = events
+    return ((query + n_queries * np.arange(n_repeats)[:, np.newaxis]).ravel(),
+            np.tile(times, n_repeats), np.tile(weights, n_repeats))
+
+
+class Network(object):
+    """
+    A network of BrunelIaF neurons with alpha-function synaptic currents.
+
+    Arguments:
+        n_exc, n_inh: the number of excitatory and inhibitory neurons (the
+                      excitatory neurons come first)
+        delivery: a SpikeDelivery object, containing the recurrent connections,
+                  with weights in nA
+        input_rate: the rate (Hz) of the independent Poisson input to each neuron
+        input_weight: the synaptic weight (nA) of the Poisson input
+
+    Other arguments are as for build_network(), with v_init the initial
+    membrane potential of each neuron.
+    """
+
+    def __init__(self, n_exc, n_inh, delivery, input_rate, input_weight,
+                 dt, tau, tau_syn, theta, tau_refrac, v_reset, R, v_init, rng):
+        self.n_exc = n_exc
+        self.n_inh = n_inh
+        self.size = n_exc + n_inh
+        self.delivery = delivery
+        self.input_rate = input_rate
+        self.input_weight = input_weight
+        self.dt = dt
+        self.theta = theta
+        self.v_reset = v_reset
+        self.rng = rng
+        self.refractory_steps = int(round(tau_refrac / dt))
+
+        (self.P_vv, self.P_va, self.P_vb,
+         self.P_aa, self.P_ab, self.P_bb) = propagators(dt, tau, tau_syn, R)
+
+        # state
+        self.v = np.array(v_init, dtype=float)
+        self.a = np.zeros(self.size)
+        self.b = np.zeros(self.size)
+        self.active_from = np.zeros(self.size, dtype=int)  # first step after the refractory period
+        self.step = 0
+
+    def run(self, duration, record_spikes, record_v):
+        """
+        Advance the network by `duration` (ms).
+
+        Returns the spikes of the neurons in `record_spikes` and the membrane
+        potential of the neurons in `record_v`, at every time step, as dicts in
+        the format of the events of NEST recording devices.
+        """
+        n_steps = int(round(duration / self.dt))
+        p_input = self.input_rate * self.dt / 1000.0
+        v, a, b = self.v, self.a, self.b
+        spike_steps = []
+        spike_ids = []
+        v_values = []
+        is_recorded = np.zeros(self.size, dtype=bool)
+        is_recorded[record_spikes] = True
+
+        for step in range(self.step, self.step + n_steps):
+            self.delivery.collect(step, b)
+            b += self.input_weight * self.rng.poisson(p_input, size=self.size)
+
+            v_new = self.P_vv * v + self.P_va * a + self.P_vb * b
+            a *= self.P_aa
+            a += self.P_ab * b
+            b *= self.P_bb
+            # membrane potential is clamped during the refractory period
+            v[:] = np.where(self.active_from <= step, v_new, v)
+
+            spiking = np.flatnonzero(v > self.theta)
+            if spiking.size > 0:
+                v[spiking] = self.v_reset
+                self.active_from[spiking] = step + 1 + self.refractory_steps
+                self.delivery.send(spiking, step)
+                recorded = spiking[is_recorded[spiking]]
+                spike_ids.append(recorded)
+                spike_steps.append(np.repeat(step + 1, recorded.size))
+            if record_v.size > 0:
+                v_values.append(v[record_v])
+        self.step += n_steps
+
+        spikes = {
+            "senders": np.hstack(spike_ids) if spike_ids else np.array([], dtype=int),
+            "times": self.dt * np.hstack(spike_steps) if spike_steps else np.array([])
+        }
+        times = self.dt * np.arange(self.step - n_steps + 1, self.step + 1)
+        signals = {
+            "senders": np.tile(record_v, n_steps),
+            "times": np.repeat(times, record_v.size),
+            "v": np.hstack(v_values) if v_values else np.array([])
+        }
+        return spikes, signals
+
+
+class HybridNetwork(Network):
+    """
+    A network of BrunelIaF neurons with alpha-function synaptic currents,
+    with spikes at precise times.
+
+    The threshold is tested at the end of each time step, as in Network, but
+    incoming spikes are not moved to the start of a step: the state at the end
+    of a step is calculated exactly, in closed form, from the state at its
+    start and the contribution of each spike from its arrival time. When the
+    threshold has been crossed, the spike time is found by root-finding on the
+    closed-form trajectory within the step (Morrison et al., 2007). Spike times
+    are therefore not rounded to the time grid, and the time step sets only how
+    often the threshold is tested: an excursion above threshold which begins
+    and ends within a step is missed.
+
+    The time step must not be greater than the delay or the refractory period,
+    so that no spike emitted during a step arrives, and no neuron spikes
+    twice, within it.
+
+    Arguments are as for Network, with `delivery` a TimedSpikeDelivery.
+    """
+
+    def __init__(self, n_exc, n_inh, delivery, input_rate, input_weight,
+                 dt, tau, tau_syn, theta, tau_refrac, v_reset, R, v_init, rng):
+        if dt > tau_refrac:
+            raise ValueError("The time step must not be greater than the refractory period")
+        Network.__init__(self, n_exc, n_inh, delivery, input_rate, input_weight,
+                         dt, tau, tau_syn, theta, tau_refrac, v_reset, R, v_init, rng)
+        self.tau = tau
+        self.tau_syn = tau_syn
+        self.tau_refrac = tau_refrac
+        self.R = R
+        self.refractory_end = np.zeros(self.size)  # the time at which the membrane potential is released
+
+    def trajectory(self, t, t0, v0, a0, b0, events=None, select=True):
+        """
+        Return the state (v, a, b) at times `t` (ms) of neurons with state
+        (v0, a0, b0) at times `t0`, not refractory, receiving the spikes in `events`.
+
+        `events` is a tuple (query, times, weights), where query[i] is the index,
+        in `t`, of the neuron receiving the i-th spike. Spikes arriving before
+        t0 or after t are ignored, unless `select` is False, when all the spikes
+        are known to arrive between t0 and t.
+        """
+        P_vv, P_va, P_vb, P_aa, P_ab, P_bb = propagators(t - t0, self.tau, self.tau_syn, self.R)
+        v = P_vv * v0 + P_va * a0 + P_vb * b0
+        a = P_aa * a0 + P_ab * b0
+        b = P_bb * b0
+        if events is not None and events[0].size > 0:
+            query, times, weights = events
+            elapsed = t[query] - times
+            if select:
+                weights = np.where((elapsed > 0) & (times >= t0[query]), weights, 0.0)
+                elapsed = np.maximum(elapsed, 0.0)
+            P_vv, P_va, P_vb, P_aa, P_ab, P_bb = propagators(elapsed, self.tau, self.tau_syn, self.R)
+            v += np.bincount(query, weights=weights * P_vb, minlength=t.size)
+            a += np.bincount(query, weights=weights * P_ab, minlength=t.size)
+            b += np.bincount(query, weights=weights * P_bb, minlength=t.size)
+        return v, a, b
+
+    def events_of(self, idx, targets, times, weights):
+        """
+        Select the spikes in (targets, times, weights) which arrive at the
+        neurons `idx`, returning them in the form used by trajectory().
+        """
+        query = np.full(self.size, -1)
+        query[idx] = np.arange(idx.size)
+        selected = np.flatnonzero(query[targets] >= 0)
+        return query[targets[selected]], times[selected], weights[selected]
+
+    def crossing_time(self, t0, v0, a0, b0, t1, events, n_points=32, tolerance=1e-6):
+        """
+        Return the time (ms) at which the membrane potential of neurons with
+        state (v0, a0, b0) at times `t0`, below threshold, and receiving
+        `events` (as for trajectory()), first crosses threshold, given that it
+        is above threshold at times `t1`.
+
+        The first crossing is bracketed by evaluating the trajectory at
+        `n_points` equally spaced times, then found to within `tolerance` (ms)
+        by Newton's method, starting from a linear interpolation within the
+        bracket and falling back to bisection when a step would leave it.
+        """
+        n = t0.size
+        t = (t0 + (t1 - t0) * (np.arange(1, n_points + 1) / n_points)[:, np.newaxis]).ravel()
+        v = self.trajectory(t, np.tile(t0, n_points), np.tile(v0, n_points), np.tile(a0, n_points),
+                            np.tile(b0, n_points), repeat_events(events, n, n_points))[0]
+        first = np.argmax((v > self.theta).reshape((n_points, n)), axis=0)
+        upper = t[first * n + np.arange(n)]
+        lower = np.where(first > 0, t[(first - 1) * n + np.arange(n)], t0)
+        v_upper = v[first * n + np.arange(n)]
+        v_lower = np.where(first > 0, v[(first - 1) * n + np.arange(n)], v0)
+        # linear interpolation within the bracket gives the starting point
+        t = lower + (upper - lower) * (self.theta - v_lower) / (v_upper - v_lower)
+        while t.size > 0:
+            v, a, b = self.trajectory(t, t0, v0, a0, b0, events)
+            above = v > self.theta
+            upper = np.where(above, t, upper)
+            lower = np.where(above, lower, t)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                step = (v - self.theta) / ((self.R * a - v) / self.tau)
+            converged = (np.abs(step) < tolerance) | (upper - lower < tolerance)
+            inside = (t - step >= lower) & (t - step <= upper)
+            t = np.where(inside, t - step, 0.5 * (lower + upper))
+            if converged.all():
+                break
+        return t
+
+    def run(self, duration, record_spikes, record_v, sampling_interval=0.1):
+        """
+        Advance the network by `duration` (ms).
+
+        Returns the spikes of the neurons in `record_spikes` and the membrane
+        potential of the neurons in `record_v`, every `sampling_interval` (ms)
+        from the start of the run, as dicts in the format of the events of NEST
+        recording devices.
+        """
+        n_steps = int(round(duration / self.dt))
+        mean_input = self.input_rate * self.dt / 1000.0
+        offsets = sampling_interval * np.arange(int(round(n_steps * self.dt / sampling_interval)))
+        sample_times = self.step * self.dt + offsets
+        # the step in which each sample is taken, robust to rounding error at step boundaries
+        sample_steps = self.step + np.floor(np.round(offsets / self.dt, 9)).astype(int)
+        all_neurons = np.arange(self.size)
+        spike_times = []
+        spike_ids = []
+        samples = {"senders": [], "times": [], "v": []}
+        is_recorded = np.zeros(self.size, dtype=bool)
+        is_recorded[record_spikes] = True
+
+        for step in range(self.step, self.step + n_steps):
+            t_start = step * self.dt
+            t_stop = t_start + self.dt
+            recurrent = self.delivery.collect(step)
+            counts = self.rng.poisson(mean_input, size=self.size)
+            n_input = counts.sum()
+            external = (np.repeat(all_neurons, counts),
+                        t_start + self.dt * self.rng.uniform(size=n_input),
+                        np.repeat(self.input_weight, n_input))
+            targets, times, weights = [np.hstack(arrays) for arrays in zip(recurrent, external)]
+
+            # the state at the start of the step or, for neurons released from
+            # the refractory period during the step, at the time of release
+            t0 = np.repeat(t_start, self.size)
+            v0, a0, b0 = self.v, self.a, self.b
+            refractory = self.refractory_end >= t_stop
+            released = np.flatnonzero((self.refractory_end > t_start) & ~refractory)
+            if released.size > 0:
+                a0 = a0.copy()
+                b0 = b0.copy()
+                t0[released] = self.refractory_end[released]
+                a0[released], b0[released] = self.trajectory(
+                    t0[released], np.repeat(t_start, released.size), v0[released], a0[released],
+                    b0[released], self.events_of(released, targets, times, weights))[1:]
+
+            # the state at the end of the step, with the contribution of each
+            # spike calculated from its arrival time
+            if released.size > 0:
+                arrived = np.where(times >= t0[targets], weights, 0.0)
+            else:
+                arrived = weights
+            v, a, b = self.trajectory(np.repeat(t_stop, self.size), t0, v0, a0, b0,
+                                      (targets, times, arrived), select=False)
+            # the membrane potential is clamped during the refractory period
+            v[refractory] = self.v_reset
+
+            spiking = np.flatnonzero(v > self.theta)
+            spike_time = np.repeat(np.inf, self.size)
+            if spiking.size > 0:
+                spike_time[spiking] = self.crossing_time(
+                    t0[spiking], v0[spiking], a0[spiking], b0[spiking], np.repeat(t_stop, spiking.size),
+                    self.events_of(spiking, targets, times, weights))
+                v[spiking] = self.v_reset
+                self.refractory_end[spiking] = spike_time[spiking] + self.tau_refrac
+                self.delivery.send(spiking, spike_time[spiking])
+                recorded = spiking[is_recorded[spiking]]
+                spike_ids.append(recorded)
+                spike_times.append(spike_time[recorded])
+
+            sampled = sample_times[np.searchsorted(sample_steps, step):
+                                   np.searchsorted(sample_steps, step, side="right")]
+            if record_v.size > 0 and sampled.size > 0:
+                idx = np.tile(record_v, sampled.size)
+                t = np.repeat(sampled, record_v.size)
+                v_sampled = self.trajectory(t, t0[idx], v0[idx], a0[idx], b0[idx],
+                                            repeat_events(self.events_of(record_v, targets, times, weights),
+                                                          record_v.size, sampled.size))[0]
+                clamped = ((t0[idx] > t_start) & (t < t0[idx])) | (t >= spike_time[idx]) | refractory[idx]
+                v_sampled[clamped] = self.v_reset
+                samples["senders"].append(idx)
+                samples["times"].append(t)
+                samples["v"].append(v_sampled)
+
+            self.v, self.a, self.b = v, a, b
+        self.step += n_steps
+
+        spikes = {
+            "senders": np.hstack(spike_ids) if spike_ids else np.array([], dtype=int),
+            "times": np.hstack(spike_times) if spike_times else np.array([])
+        }
+        signals = dict((name, np.hstack(values) if values else np.array([]))
+                       for name, values in samples.items())
+        return spikes, signals
@@ -0,0 +1,103 @@
+"""
+A content-addressed cache of files generated from the model description,
+such as compiled simulation code, so that they can be reused by later
+simulations of the same model.
+
+Each entry is a directory, named by a hash of everything the files depend on,
+within a directory for each kind of entry, e.g. "~/.cache/brunel2000/9mltoolkit/<hash>".
+The location of the cache can be changed with the environment variable
+BRUNEL_CACHE_DIR. The cache can safely be deleted at any time.
+
+Entries are created in a temporary directory which is then renamed, so that
+simulations running concurrently, e.g. in a sweep, never see a partial entry.
+
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+
+def default_cache_dir():
+    return os.environ.get("BRUNEL_CACHE_DIR",
+                          os.path.join(os.path.expanduser("~"), ".cache", "brunel2000"))
+
+
+def content_hash(*parts):
+    """Return a hash of `parts`, each of which is a string or bytes."""
+    sha = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode("utf-8")
+        # the length is included so that different splits of the same content differ
+        sha.update(str(len(part)).encode("ascii") + b":" + part)
+    return sha.hexdigest()
+
+
+def file_hash(path):
+    """Return a hash of the contents of the file at `path`."""
+    sha = hashlib.sha1()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class FileCache(object):
+    """
+    A cache of directories of files, indexed by a key, e.g.:
+
+        cache = FileCache("9mltoolkit")
+        key = content_hash(xml)
+        directory = cache.get_or_create(key, compile_model)
+
+    where compile_model(directory) writes the files into `directory`.
+    """
+
+    def __init__(self, name, root=None):
+        self.directory = os.path.join(root or default_cache_dir(), name)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the directory of the entry for `key`, or None if there is none."""
+        path = self.path(key)
+        if os.path.isdir(path):
+            return path
+        return None
+
+    def get_or_create(self, key, create):
+        """
+        Return the directory of the entry for `key`, calling `create(directory)`
+        to create its files if there is no such entry. If `create` raises an
+        exception, no entry is added.
+        """
+        path = self.get(key)
+        if path:
+            return path
+        if not os.path.exists(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # created by another process in the meantime
+                pass
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            create(tmp_dir)
+            os.rename(tmp_dir, self.path(key))
+        except OSError:
+            if self.get(key):  # created by another process in the meantime
+                shutil.rmtree(tmp_dir)
+            else:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return self.path(key)
+
+    def clear(self):
+        """Remove all the entries."""
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
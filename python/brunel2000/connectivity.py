@@ -0,0 +1,145 @@
+"""
+Connectivity of the Brunel (2000) network which can be saved to file and
+reused by many simulations.
+
+Each neuron receives Ce = epsilon*Ne connections from randomly chosen
+excitatory neurons and Ci = epsilon*Ni from inhibitory neurons, as with NEST's
+"fixed_indegree" rule (autapses and multiple connections between the same pair
+of neurons are allowed). Neurons are numbered from zero, the excitatory neurons
+first. The connections are held in CSR form, indexed by the postsynaptic neuron:
+the presynaptic neurons of neuron i are sources[indptr[i]:indptr[i + 1]], stored
+as int32, so a network of order 2500 (15.6 million connections) takes 62 MB.
+
+The connectivity does not depend on the synaptic weights or on the external
+input, so in a sweep over g and eta the same file can be used for every point:
+set "connectivity_file" in the "experiment" parameters. The connections are
+drawn from "connectivity_seed" (default 0), not from the seed of the
+simulation, so all the simulations have the same connectivity, whatever their
+seeds. Simulations which find the file missing and create it at the same time
+therefore all write the same contents; sweep.py avoids this by creating the
+file before starting any simulations.
+
+"""
+
+from __future__ import division, print_function
+import os
+import tempfile
+import numpy as np
+from utility import numpy_seed
+
+
+class Connectivity(object):
+    """
+    Connections of the network, in CSR form indexed by the postsynaptic neuron.
+
+    Arguments:
+        indptr: array of size n_exc + n_inh + 1
+        sources: the presynaptic neuron of each connection (int32)
+        n_exc, n_inh: the numbers of excitatory and inhibitory neurons
+        seed: the seed from which the connections were drawn, if known
+    """
+
+    def __init__(self, indptr, sources, n_exc, n_inh, seed=None):
+        self.indptr = indptr
+        self.sources = sources
+        self.n_exc = n_exc
+        self.n_inh = n_inh
+        self.seed = seed
+
+    @classmethod
+    def generate(cls, order=1000, epsilon=0.1, rng=None, seed=None):
+        """
+        Draw random connections for a network of the given order and
+        connection probability, from `rng` or, if it is not given, from a
+        new random number generator seeded with `seed`.
+        """
+        if rng is None:
+            rng = np.random.RandomState(None if seed is None else numpy_seed(seed))
+        Ne = 4 * order
+        Ni = 1 * order
+        Ce = int(epsilon * Ne)
+        Ci = int(epsilon * Ni)
+        N = Ne + Ni
+        sources = np.hstack((rng.randint(0, Ne, size=(N, Ce)),
+                             Ne + rng.randint(0, Ni, size=(N, Ci)))).ravel().astype(np.int32)
+        indptr = np.arange(N + 1, dtype=np.int64) * (Ce + Ci)
+        return cls(indptr, sources, Ne, Ni, seed=seed)
+
+    @classmethod
+    def load(cls, filename):
+        """Load connectivity saved with `save()`."""
+        contents = np.load(filename)
+        seed = int(contents["seed"]) if contents["seed"] >= 0 else None
+        return cls(contents["indptr"], contents["sources"],
+                   int(contents["n_exc"]), int(contents["n_inh"]), seed=seed)
+
+    def save(self, filename):
+        """
+        Save the connectivity to `filename`, in NumPy's ".npz" format. The file
+        is written under a temporary name and then renamed, so that another
+        process never reads a partly-written file.
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_file = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+        with os.fdopen(fd, "wb") as fp:
+            np.savez(fp, indptr=self.indptr, sources=self.sources,
+                     n_exc=self.n_exc, n_inh=self.n_inh,
+                     seed=-1 if self.seed is None else self.seed)
+        os.rename(tmp_file, filename)
+
+    @property
+    def size(self):
+        return self.n_exc + self.n_inh
+
+    @property
+    def n_connections(self):
+        return self.sources.size
+
+    @property
+    def targets(self):
+        """The postsynaptic neuron of each connection."""
+        return np.repeat(np.arange(self.size, dtype=np.int32), np.diff(self.indptr))
+
+    def matches(self, order, epsilon):
+        """Return True if this connectivity is that of a network with the given order and epsilon."""
+        Ne = 4 * order
+        Ni = 1 * order
+        return (self.n_exc == Ne and self.n_inh == Ni and
+                self.n_connections == (Ne + Ni) * (int(epsilon * Ne) + int(epsilon * Ni)))
+
+    def connections(self, excitatory):
+        """
+        Return the (source, target) indices of the connections from the
+        excitatory or the inhibitory neurons, as two arrays.
+        """
+        mask = self.sources < self.n_exc
+        if not excitatory:
+            mask = ~mask
+        return self.sources[mask], self.targets[mask]
+
+
+def connectivity_from_parameters(parameters):
+    """
+    Return the Connectivity in the file given by "connectivity_file" in the
+    "experiment" parameters, or None if there is no such parameter. If the file
+    does not exist, the connectivity is generated, from the seed given by
+    "connectivity_seed" (default 0), and saved to it.
+    """
+    filename = parameters["experiment"].get("connectivity_file")
+    if filename is None:
+        return None
+    order = parameters["network"]["order"]
+    epsilon = parameters["network"]["epsilon"]
+    seed = parameters["experiment"].get("connectivity_seed", 0)
+    if os.path.exists(filename):
+        print("Loading connectivity from {}".format(filename))
+        connectivity = Connectivity.load(filename)
+        if not connectivity.matches(order, epsilon) or connectivity.seed != seed:
+            raise ValueError("The connectivity in {} is not for a network with order={}, "
+                             "epsilon={} and connectivity_seed={}".format(filename, order,
+                                                                          epsilon, seed))
+    else:
+        print("Saving connectivity to {}".format(filename))
+        connectivity = Connectivity.generate(order, epsilon, seed=seed)
+        connectivity.save(filename)
+    return connectivity
@@ -3,7 +3,7 @@
 
 """
 
-from __future__ import division
+from __future__ import division, print_function
 import sys
 import argparse
 import numpy as np
@@ -12,26 +12,16 @@ matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import neo
-from quantities import ms, dimensionless
-
-
-def instantaneous_firing_rate(segment, begin, end):
-    """Computed in bins of 0.1 ms """
-    bin_width = 0.1
-    bins = np.arange(begin, end, bin_width)
-    hist, _ = np.histogram(segment.spiketrains[0].time_slice(begin*ms, end*ms)/ms, bins)
-    for st in segment.spiketrains[1:]:
-        h, _ = np.histogram(st.time_slice(begin*ms, end*ms)/ms, bins)
-        hist += h
-    hist *= 1000/bin_width/len(segment.spiketrains)
-    return neo.AnalogSignal(hist, sampling_period=bin_width*ms, units=dimensionless,
-                            channel_index=0, t_start=begin*ms, name="Instantaneous firing rate")
+from quantities import ms
+from analysis import population_rate, KERNELS
+from spikestore import SpikeStore
+from spikestats import spectral_statistics, classify_regime, cv_isi, mean_statistic
 
 
 def mean_firing_rate(segment):
     duration = segment.spiketrains[0].t_stop - segment.spiketrains[0].t_start
     n = sum(st.size for st in segment.spiketrains)
-    print duration, n, len(segment.spiketrains), n/len(segment.spiketrains)
+    print(duration, n, len(segment.spiketrains), n/len(segment.spiketrains))
     return n/len(segment.spiketrains)/duration.rescale('s')
 
 
@@ -58,7 +48,8 @@ def plot_case(gs, data, t_start=900.0, t_stop=1200.0, title="", yticks=None):
                  np.ones_like(spiketrain) * i,
                  'k.', markersize=1.0)
 
-    ifr = instantaneous_firing_rate(data, t_start, t_stop)
+    ifr = population_rate(data.spiketrains, t_start, t_stop, bin_width=config.bin_width,
+                          kernel=config.kernel, kernel_width=config.kernel_width)
     t = ifr.times.rescale(ms)
     ax2.plot(t, ifr, color='0.5', lw=0.001, solid_joinstyle='miter')
     ax2.fill_between(t, 0, ifr, color='0.5', lw=0)
@@ -66,7 +57,7 @@ def plot_case(gs, data, t_start=900.0, t_stop=1200.0, title="", yticks=None):
     if yticks:
         ticks = yticks
     else:
-	start, stop = ax2.get_ylim()
+        start, stop = ax2.get_ylim()
         stop50 = (stop//50 + 1) * 50
         yres = stop50/5
         ticks = np.arange(0, stop + yres, yres)
@@ -97,6 +88,12 @@ parser.add_argument("-o", "--output",
                     help="filename for the figure",
                     default="brunel_network_alpha_combined.png"
                     )
+parser.add_argument("--bin-width", type=float, default=0.1,
+                    help="bin width (ms) for the population firing rate")
+parser.add_argument("--kernel", choices=KERNELS,
+                    help="kernel used to smooth the population firing rate")
+parser.add_argument("--kernel-width", type=float, default=1.0,
+                    help="width (ms) of the smoothing kernel")
 config = parser.parse_args()
 
 
@@ -141,17 +138,25 @@ firing_rate_ticks = {
 }
 
 
-def get_case(filename):
+def get_case(filename, segment):
     for case in ("SR", "SIfast", "AI", "SIslow"):
         if filename.find(case) > 0:
             return case
-    raise Exception("Couldn't determine case")
+    # the filename doesn't say, so classify the activity from its statistics
+    store = SpikeStore.from_spiketrains(segment.spiketrains)
+    spectrum = spectral_statistics(store, begin=store.t_start + 100.0)
+    case = classify_regime(mean_statistic(cv_isi(store)), spectrum["dominant_frequency"],
+                           spectrum["synchrony_power"])
+    if case not in titles:
+        raise Exception("Couldn't determine case")
+    print("{}: classified as {}".format(filename, case))
+    return case
 
 
 for data_file in config.datafiles:
     io = neo.io.get_io(data_file)
     data = io.read()[0].segments[0]
-    case = get_case(data_file)
+    case = get_case(data_file, data)
     t_start, t_stop = time_range[case]
     plot_case(gs, data, t_start, t_stop, titles[case], yticks=firing_rate_ticks[case])
 
@@ -0,0 +1,45 @@
+"""
+Selection of the implementation of the Brunel (2000) network model.
+
+"""
+
+# the forms of parallel execution supported by each implementation, set by
+# "threads" and "mpi_processes" in the "experiment" parameters
+PARALLELISM = {
+    "nest": ("threads", "mpi"),
+    "pyNN.nest": ("threads", "mpi"),
+    "pyNN.neuron": ("mpi",),
+}
+
+
+def load_implementation(implementation, parameters):
+    """
+    Import the module for the given implementation.
+
+    Returns the run_simulation() function for the implementation and the name
+    of the recorded membrane potential variable. `parameters` is updated with
+    any implementation-specific parameters.
+    """
+    if implementation == "nineml":
+        from brunel_network_nineml import run_simulation
+        vm_var = "nrn_v"
+    elif implementation == "ninemlpartial":
+        from brunel_network_nineml_partial import run_simulation
+        vm_var = "nrn_v"
+    elif implementation == "nest":
+        from brunel_network_nest import run_simulation
+        vm_var = "V_m"
+    elif "pyNN" in implementation:
+        from brunel_network_PyNN import run_simulation
+        parameters["simulator"] = implementation
+        vm_var = "v"
+    elif implementation in ("numpy", "numpy.hybrid"):
+        from brunel_network_numpy import run_simulation
+        parameters["hybrid"] = implementation == "numpy.hybrid"
+        vm_var = "v"
+    elif "9mltoolkit" in implementation:
+        from brunel_network_9ml_toolkit import run_simulation
+        vm_var = "signal0"
+    else:
+        raise NotImplementedError("{} not supported".format(implementation))
+    return run_simulation, vm_var
@@ -0,0 +1,89 @@
+"""
+A persistent record of the simulations in a parameter sweep, so that an
+interrupted sweep can be resumed without repeating finished simulations.
+
+Each simulation is identified by a hash of its parameters, so the same
+parameter set always has the same key.
+
+"""
+
+import json
+import hashlib
+import sqlite3
+from datetime import datetime
+
+
+def parameter_hash(implementation, parameters):
+    """
+    Return a key identifying the simulation of `parameters` with `implementation`.
+
+    The output filename is not included, so the key does not depend on where
+    the results are written.
+    """
+    parameters = json.loads(json.dumps(parameters))  # deep copy
+    parameters["experiment"].pop("full_filename", None)
+    canonical = json.dumps([implementation, parameters], sort_keys=True)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class Ledger(object):
+    """
+    Record of the state of each simulation in a sweep, stored in an SQLite database.
+
+    Each simulation has one of the states "pending", "done" or "failed".
+    A simulation which is still "pending" when the sweep is resumed was
+    interrupted, and is run again.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "  key TEXT PRIMARY KEY,"
+                "  parameters TEXT,"
+                "  output_file TEXT,"
+                "  status TEXT,"
+                "  attempts INTEGER,"
+                "  exit_status INTEGER,"
+                "  wall_time REAL,"
+                "  max_rss INTEGER,"
+                "  updated TEXT)")
+
+    def add(self, key, parameters, output_file):
+        """Add a simulation to the ledger, if it is not already present."""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO jobs (key, parameters, output_file, status, attempts, updated) "
+                "VALUES (?, ?, ?, 'pending', 0, ?)",
+                (key, json.dumps(parameters, sort_keys=True), output_file, datetime.now().isoformat()))
+
+    def get(self, key):
+        """Return the ledger entry for `key` as a dict, or None."""
+        cursor = self.connection.execute("SELECT * FROM jobs WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def should_run(self, key, max_attempts):
+        """
+        A simulation should be run unless it has finished successfully or
+        has already failed `max_attempts` times.
+        """
+        entry = self.get(key)
+        return entry is None or (entry["status"] != "done" and entry["attempts"] < max_attempts)
+
+    def finish(self, key, result):
+        """Record the result of a simulation, as returned by the functions in `scheduler`."""
+        status = "done" if result["exit_status"] == 0 else "failed"
+        with self.connection:
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, exit_status = ?,"
+                "  wall_time = ?, max_rss = ?, updated = ? WHERE key = ?",
+                (status, result["exit_status"], result["wall_time"], result["max_rss"],
+                 datetime.now().isoformat(), key))
+
+    def summary(self):
+        """Return the number of simulations in each state."""
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
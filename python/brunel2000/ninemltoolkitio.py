@@ -21,13 +21,23 @@ Author: Andrew Davison
 """
 
 import os
+import time
+import json
+import shutil
+import tempfile
 from collections import defaultdict
+from io import BytesIO
 from glob import glob
 import numpy as np
 import quantities as pq
 
 from neo.io.baseio import BaseIO
 from neo.core import Block, Segment, SpikeTrain, AnalogSignalArray as AnalogSignal  #, ChannelIndex
+from spikestore import SpikeStore
+
+CHUNK_SIZE = 2**24  # bytes read from the spike file at a time
+CACHE_EXTENSION = ".npcache"  # suffix of the binary cache directory for each data file
+CACHE_VERSION = 2  # increment when the layout of the cached data changes
 
 
 class NineMLToolkitIO(BaseIO):
@@ -56,84 +66,437 @@ class NineMLToolkitIO(BaseIO):
     mode = 'dir'
 
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, use_cache=True):
         # note that filename should actually be a directory name
         BaseIO.__init__(self)
         self.filename = filename
+        self.use_cache = use_cache
+        self._signal_data = {}
+
+    def read_block(self, lazy=False, cascade=True, signal_names=None, signal_units=None,
+                   chunked=True):
+        """
+        Read spike trains and signals into a single Block.
 
-    def read_block(self, lazy=False, cascade=True, signal_names=None, signal_units=None):
+        With `chunked=True` (the default), the spike file is parsed in large
+        blocks using NumPy, rather than line by line.
+
+        With `lazy=True`, the signal files are not parsed: each AnalogSignal
+        is empty, with `lazy_shape` giving the shape of the data. The data can
+        then be loaded with `load_lazy_object()`.
+        """
         block = Block(file_origin=self.filename)
         segment = Segment(name="default")
         block.segments.append(segment)
         segment.block = block
 
-        spike_times = defaultdict(list)
         spike_file = self.filename + ".dat"
         print("SPIKEFILE: {}".format(spike_file))
         if os.path.exists(spike_file):
             print("Loading data from {}".format(spike_file))
-            with open(spike_file, 'r') as fp:
-                for line in fp:
-                    if line[0] != '#':
-                        entries = line.strip().split()
-                        if len(entries) > 1:
-                            time = float(entries[0])
-                            for id in entries[1:]:
-                                spike_times[id].append(time)
-                t_stop = float(entries[0])
-            if spike_times:
-                min_id = min(map(int, spike_times))
-            segment.spiketrains = [SpikeTrain(times, t_stop=t_stop, units="ms",
-                                              id=int(id), source_index=int(id) - min_id)
-                                   for id, times in spike_times.items()]
+            if chunked:
+                segment.spiketrains = self._read_spiketrains_chunked(spike_file)
+            else:
+                segment.spiketrains = self._read_spiketrains_by_line(spike_file)
         signal_files = glob("{}_state.*.dat".format(self.filename))
         print(signal_files)
         for signal_file in signal_files:
-            print("Loading data from {}".format(signal_file))
             population = os.path.basename(signal_file).split(".")[1]
-            try:
-                data = np.loadtxt(signal_file, delimiter=", ")
-            except ValueError:
-                print("Couldn't load data from file {}".format(signal_file))
-                continue
-            t_start = data[0, 1]
-            ids = data[:, 0]
-            unique_ids = np.unique(ids)
-            for column in range(2, data.shape[1]):
+            if lazy:
+                info = self._scan_signal_file(signal_file)
+                if info is None:
+                    continue
+                n_samples = info["n_samples"]
+                n_signals = info["n_columns"] - 2
+            else:
+                print("Loading data from {}".format(signal_file))
+                info = self._read_signal_file(signal_file)
+                if info is None:
+                    continue
+                n_signals = info["values"].shape[2]
+            for column in range(n_signals):
                 if signal_names is None:
-                    signal_name = "signal{}".format(column - 2)
+                    signal_name = "signal{}".format(column)
                 else:
-                    signal_name = signal_names[column - 2]
+                    signal_name = signal_names[column]
                 if signal_units is None:
                     units = "mV"  # seems like a reasonable default
                 else:
-                    units = signal_units[column - 2]
-                signals_by_id = {}
-                for id in unique_ids:
-                    times = data[ids==id, 1]
-                    unique_times, idx = np.unique(times, return_index=True)  # some time points are represented twice
-                    signals_by_id[id] = data[ids==id, column][idx]
-                channel_ids = np.array(list(signals_by_id.keys()))
-                if len(unique_times) > 1:
-                    sampling_period = unique_times[1] - unique_times[0]
-                    assert sampling_period != 0.0, sampling_period
-                    signal_lengths = np.array([s.size for s in signals_by_id.values()])
-                    min_length = signal_lengths.min()
-                    if not (signal_lengths == signal_lengths[0]).all():
-                        print("Warning: signals have different sizes: min={}, max={}".format(min_length,
-                                                                                             signal_lengths.max()))
-                        print("Truncating to length {}".format(min_length))
-                    signal = AnalogSignal(np.vstack([s[:min_length] for s in signals_by_id.values()]).T,
+                    units = signal_units[column]
+                if lazy:
+                    signal = AnalogSignal(np.empty((0, len(info["channel_ids"]))),
                                           units=units,
-                                          t_start=t_start * pq.ms,
-                                          sampling_period=sampling_period*pq.ms,
+                                          t_start=info["t_start"] * pq.ms,
+                                          sampling_period=info["sampling_period"] * pq.ms,
                                           name=signal_name,
-                                          population=population)
-                    #signal.channel_index = ChannelIndex(np.arange(signal.shape[1], int),
-                    #                                    channel_ids=channel_ids)
-                    signal.channel_index = channel_ids
-                    segment.analogsignals.append(signal)
+                                          population=population,
+                                          column=column,
+                                          data_offset=info["offset"],
+                                          data_end=info["end"])
+                    signal.lazy_shape = (n_samples, len(info["channel_ids"]))
+                    signal.file_origin = signal_file
+                else:
+                    signal = self._build_signal(info, column, units, signal_name, population)
+                #signal.channel_index = ChannelIndex(np.arange(signal.shape[1], int),
+                #                                    channel_ids=channel_ids)
+                signal.channel_index = info["channel_ids"]
+                segment.analogsignals.append(signal)
 
         return block
 
+    def load_lazy_object(self, obj):
+        """
+        Load the data for an AnalogSignal returned by `read_block(lazy=True)`.
+
+        The file containing the signal is parsed the first time any of its
+        signals is requested, unless it was cached; all the signals of that
+        population are then available without further parsing.
+        """
+        signal_file = obj.file_origin
+        if signal_file not in self._signal_data:
+            print("Loading data from {}".format(signal_file))
+            self._signal_data[signal_file] = self._read_signal_file(
+                signal_file, offset=obj.annotations["data_offset"],
+                end=obj.annotations["data_end"])
+        signal = self._build_signal(self._signal_data[signal_file],
+                                    obj.annotations["column"], obj.units, obj.name,
+                                    obj.annotations["population"])
+        signal.channel_index = obj.channel_index
+        return signal
+
+    def _scan_signal_file(self, signal_file):
+        """
+        Determine the layout of a signal file without loading the signal values.
+
+        If there is a valid cache for the file, it is used (and kept for
+        `load_lazy_object()`) instead. Otherwise, the byte range of the data
+        rows is recorded and only the ID and time fields of each row are
+        converted to numbers, in large blocks using NumPy. The rows may be in
+        any order; as in `_read_signal_file()`, time points which are
+        represented twice for the same neuron are counted once, so
+        `n_samples` is the length of the signals when they are loaded. Every
+        row must have the same number of columns.
+        """
+        if self.use_cache:
+            info = load_cache(signal_file)
+            if info is not None:
+                self._signal_data[signal_file] = info
+                return {
+                    "offset": 0,
+                    "end": None,
+                    "n_rows": None,
+                    "n_samples": info["values"].shape[1],
+                    "n_columns": info["values"].shape[2] + 2,
+                    "channel_ids": info["channel_ids"],
+                    "t_start": info["t_start"],
+                    "sampling_period": info["sampling_period"]
+                }
+        offset = 0
+        n_columns = None
+        with open(signal_file, 'rb') as fp:
+            for line in fp:
+                if line.startswith(b"#") or not line.strip():
+                    offset += len(line)
+                    continue
+                n_columns = len(line.split(b","))
+                break
+            if n_columns is None:
+                print("Couldn't determine the layout of {}".format(signal_file))
+                return None
+            fp.seek(offset)
+            ids, times = [], []
+            end = offset
+            remainder = b""
+            while True:
+                chunk = fp.read(CHUNK_SIZE)
+                if chunk:
+                    chunk = remainder + chunk
+                    split = chunk.rfind(b"\n") + 1
+                    chunk, remainder = chunk[:split], chunk[split:]
+                else:
+                    chunk, remainder = remainder, b""
+                end += len(chunk)
+                if chunk.strip():
+                    if not chunk.endswith(b"\n"):
+                        chunk += b"\n"
+                    columns = _id_time_columns(chunk)
+                    ids.append(columns[:, 0])
+                    times.append(columns[:, 1])
+                elif not remainder:
+                    break
+        if not ids:
+            print("Couldn't determine the sampling period of {}".format(signal_file))
+            return None
+        ids = np.concatenate(ids)
+        times = np.concatenate(times)
+        n_rows = ids.size
+        t_start = times[0]
+        index = _sample_index(ids, times)
+        ids, times = ids[index], times[index]
+        channel_ids, starts, signal_lengths = np.unique(ids, return_index=True,
+                                                        return_counts=True)
+        n_samples = int(signal_lengths.min())
+        if n_samples < 2:
+            print("Couldn't determine the sampling period of {}".format(signal_file))
+            return None
+        return {
+            "offset": offset,
+            "end": end,
+            "n_rows": n_rows,
+            "n_samples": n_samples,
+            "n_columns": n_columns,
+            "channel_ids": channel_ids,
+            "t_start": t_start,
+            "sampling_period": times[1] - times[0]
+        }
+
+    def _read_signal_file(self, signal_file, offset=0, end=None):
+        """
+        Read all the signals from a file in which each row has the form
+
+            id, time, value0, value1, ...
+
+        Only the rows between the byte positions `offset` and `end` (default:
+        the end of the file) are read.
+
+        The rows are grouped by neuron ID with a single stable sort, giving
+        an array of shape (n_channels, n_samples, n_signals).
+
+        If `use_cache` is True, the result is stored in a binary cache next to
+        the signal file, and later reads map the cache instead of parsing.
+        """
+        if self.use_cache:
+            info = load_cache(signal_file)
+            if info is not None:
+                return info
+        try:
+            with open(signal_file, 'rb') as fp:
+                fp.seek(offset)
+                if end is None:
+                    data = np.loadtxt(fp, delimiter=",", ndmin=2)
+                else:
+                    data = np.loadtxt(BytesIO(fp.read(end - offset)), delimiter=",", ndmin=2)
+        except ValueError:
+            print("Couldn't load data from file {}".format(signal_file))
+            return None
+        t_start = data[0, 1]
+        data = data[_sample_index(data[:, 0], data[:, 1])]
+        channel_ids, starts, signal_lengths = np.unique(data[:, 0], return_index=True,
+                                                        return_counts=True)
+        min_length = signal_lengths.min()
+        if min_length < 2:
+            return None
+        if not (signal_lengths == signal_lengths[0]).all():
+            print("Warning: signals have different sizes: min={}, max={}".format(min_length,
+                                                                                 signal_lengths.max()))
+            print("Truncating to length {}".format(min_length))
+        values = data[starts[:, np.newaxis] + np.arange(min_length)]
+        sampling_period = values[0, 1, 1] - values[0, 0, 1]
+        assert sampling_period != 0.0, sampling_period
+        info = {
+            "channel_ids": channel_ids,
+            "t_start": t_start,
+            "sampling_period": sampling_period,
+            "values": values[:, :, 2:]
+        }
+        if self.use_cache:
+            save_cache(signal_file, info)
+        return info
+
+    def _build_signal(self, info, column, units, name, population):
+        return AnalogSignal(info["values"][:, :, column].T,
+                            units=units,
+                            t_start=info["t_start"] * pq.ms,
+                            sampling_period=info["sampling_period"] * pq.ms,
+                            name=name,
+                            population=population)
+
+    def _read_spiketrains_by_line(self, spike_file):
+        spike_times = defaultdict(list)
+        with open(spike_file, 'r') as fp:
+            for line in fp:
+                if line[0] != '#':
+                    entries = line.strip().split()
+                    if len(entries) > 1:
+                        spike_time = float(entries[0])
+                        for id in entries[1:]:
+                            spike_times[id].append(spike_time)
+            t_stop = float(entries[0])
+        if spike_times:
+            min_id = min(map(int, spike_times))
+        return [SpikeTrain(times, t_stop=t_stop, units="ms",
+                           id=int(id), source_index=int(id) - min_id)
+                for id, times in spike_times.items()]
+
+    def _read_spiketrains_chunked(self, spike_file):
+        cached = load_cache(spike_file) if self.use_cache else None
+        if cached is not None:
+            store = SpikeStore(**cached)
+        else:
+            start = time.time()
+            times, ids, t_stop = read_spike_file(spike_file)
+            elapsed = time.time() - start
+            print("Parsed {} spikes in {:.3f} s ({:.0f} spikes/s)".format(
+                times.size, elapsed, times.size / max(elapsed, 1e-9)))
+            # group by neuron with a single stable sort, so that spike times
+            # remain in increasing order within each group
+            store = SpikeStore.from_events(times, ids, t_stop=t_stop)
+            if self.use_cache:
+                save_cache(spike_file, store.as_dict())
+        return store.spiketrains(id_annotation="id")
+
+
+def _id_time_columns(chunk):
+    """
+    Return the ID and time fields (the first two) of each row of a block of
+    complete lines from a signal file, as an array of shape (n_rows, 2),
+    without converting the remaining fields.
+    """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == ord(b"\n"))
+    starts = np.concatenate(([0], line_ends[:-1] + 1))
+    commas = np.flatnonzero(buf == ord(b","))
+    # the position of the second comma of each line, which ends the time field
+    field_ends = commas[np.minimum(np.searchsorted(commas, starts) + 1, commas.size - 1)]
+    assert commas.size > 1 and (field_ends < line_ends).all(), "Every row should have at least three fields"
+    # gather the bytes from the start of each line up to and including its second comma
+    lengths = field_ends + 1 - starts
+    index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    text = buf[index].tobytes()[:-1].decode("ascii")
+    return np.fromstring(text, sep=",").reshape((-1, 2))
+
 
+def _sample_index(ids, times):
+    """
+    Return the indices of the rows of a signal file sorted by neuron ID then
+    time, keeping only the first row of time points that are represented twice.
+    """
+    # the sort is stable, so for time points that are represented twice,
+    # the first occurrence in the file comes first
+    order = np.lexsort((times, ids))
+    ids = ids[order]
+    times = times[order]
+    first = np.concatenate(([True], (ids[1:] != ids[:-1]) | (times[1:] != times[:-1])))
+    return order[first]
+
+
+def cache_path(source_file):
+    """Return the name of the directory used to cache the contents of `source_file`."""
+    return source_file + CACHE_EXTENSION
+
+
+def load_cache(source_file):
+    """
+    Load the cached contents of `source_file`, if the cache exists and was
+    created from a file with the same size and modification time.
+
+    Arrays are memory-mapped. Returns a dict, or None if there is no valid cache.
+    """
+    cache_dir = cache_path(source_file)
+    try:
+        with open(os.path.join(cache_dir, "source.json")) as fp:
+            contents = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+    source = contents.pop("source")
+    stat = os.stat(source_file)
+    if (contents.pop("version", None) != CACHE_VERSION
+            or source != {"size": stat.st_size, "mtime": stat.st_mtime}):
+        return None
+    for name in contents.pop("arrays"):
+        contents[name] = np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode="r")
+    print("Loaded cached data for {}".format(source_file))
+    return contents
+
+
+def save_cache(source_file, contents):
+    """
+    Save a dict of arrays and scalars obtained by parsing `source_file`.
+
+    The cache is written to a temporary directory which is then renamed, so
+    that a partially written cache is never used.
+    """
+    cache_dir = cache_path(source_file)
+    stat = os.stat(source_file)
+    metadata = {
+        "source": {"size": stat.st_size, "mtime": stat.st_mtime},
+        "version": CACHE_VERSION,
+        "arrays": []
+    }
+    tmp_dir = None
+    try:
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(source_file)))
+        for name, value in contents.items():
+            if isinstance(value, np.ndarray):
+                np.save(os.path.join(tmp_dir, name + ".npy"), value)
+                metadata["arrays"].append(name)
+            else:
+                metadata[name] = value
+        with open(os.path.join(tmp_dir, "source.json"), "w") as fp:
+            json.dump(metadata, fp)
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.rename(tmp_dir, cache_dir)
+    except (IOError, OSError) as err:
+        print("Couldn't write cache for {}: {}".format(source_file, err))
+        if tmp_dir and os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_spike_file(spike_file, chunk_size=CHUNK_SIZE):
+    """
+    Read a 9ML-toolkit spike file into flat arrays of spike times and neuron IDs.
+
+    The file is read in blocks of `chunk_size` bytes. Within each block, all
+    the tokens are converted to numbers in a single NumPy operation; the first
+    token on each line is the time, the remainder are the IDs of the neurons
+    which spiked at that time.
+
+    Returns (times, ids, t_stop), where t_stop is the time on the last line.
+    """
+    all_times = []
+    all_ids = []
+    t_stop = None
+    remainder = b""
+    with open(spike_file, 'rb') as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if chunk:
+                chunk = remainder + chunk
+                end = chunk.rfind(b"\n") + 1
+                chunk, remainder = chunk[:end], chunk[end:]
+            else:
+                chunk, remainder = remainder, b""
+            if chunk:
+                line_times, times, ids = _parse_spike_lines(chunk)
+                if line_times.size > 0:
+                    t_stop = line_times[-1]
+                all_times.append(times)
+                all_ids.append(ids)
+            elif not remainder:
+                break
+    if all_times:
+        return np.concatenate(all_times), np.concatenate(all_ids), t_stop
+    else:
+        return np.array([], float), np.array([], int), t_stop
+
+
+def _parse_spike_lines(chunk):
+    """
+    Parse a block of complete lines from a spike file.
+
+    Returns the time of each line, and the flattened spike times and IDs.
+    """
+    if b"#" in chunk:
+        chunk = b"\n".join(line for line in chunk.split(b"\n")
+                           if not line.startswith(b"#"))
+    # mark the line endings with NaN, so that the numbers are all parsed in C
+    # and the time at the start of each line is the value following a NaN
+    values = np.fromstring(chunk.replace(b"\n", b" nan ").decode("ascii"), sep=" ")
+    is_separator = np.isnan(values)
+    follows_separator = np.concatenate(([True], is_separator[:-1]))
+    is_time = ~is_separator & follows_separator
+    is_id = ~is_separator & ~follows_separator
+    line_times = values[is_time]
+    line_index = np.cumsum(is_time) - 1
+    return line_times, line_times[line_index[is_id]], values[is_id].astype(np.int64)
@@ -12,9 +12,7 @@ import numpy as np
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-import pandas
-from joblib import Parallel, delayed
-from analysis import spike_statistics
+from analysis import update_statistics
 
 
 parser = argparse.ArgumentParser()
@@ -24,35 +22,9 @@ config = parser.parse_args()
 
 results_dir = config.directory
 
-statistics_file = os.path.join(results_dir, "statistics.csv")
-
-if os.path.exists(statistics_file):
-    # read the previously calculated spike train statistics from file
-    data = pandas.read_csv(statistics_file,
-                           delim_whitespace=True)
-else:
-    # for each data file, read the spike trains and calculate the metrics
-    data = pandas.read_csv(os.path.join(results_dir, "sweeps.csv"),
-                           names=("g", "eta", "output_file"),
-                           delim_whitespace=True, comment="#")
-
-    # for idx, row in data.iterrows():
-    #     results = spike_statistics(idx, row)
-    #     for key, value in results.items():
-    #         data.ix[idx, key] = value
-
-    results = Parallel(n_jobs=4)(delayed(
-                  spike_statistics)(idx, row) for idx, row in data.iterrows())
-    for idx, result in enumerate(results):
-        for key, value in result.items():
-            data.ix[idx, key] = value
-
-
-    print(data)
-
-    # save statistics to file
-    data.to_csv(os.path.join(results_dir, "statistics.csv"),
-                sep=" ", index=False)
+# calculate the spike train statistics for any data files which have not yet been analysed
+data = update_statistics(results_dir)
+print(data)
 
 
 # build data structures for plotting
@@ -63,38 +35,49 @@ z = {
     "firing_rate": np.zeros((etavec.size, gvec.size)),
     "spike_counts": np.zeros((etavec.size, gvec.size), dtype=int),
     "cv_isi": np.zeros((etavec.size, gvec.size)),
-    "cc_mean": np.zeros((etavec.size, gvec.size))
+    "cc_mean": np.zeros((etavec.size, gvec.size)),
+    "chi": np.zeros((etavec.size, gvec.size))
 }
 
 for idx, row in data.iterrows():
     # convert g and eta to i and j
     j = np.argwhere(gvec == row["g"])[0]
     i = np.argwhere(etavec == row["eta"])[0]
-    for name in ("firing_rate", "cv_isi", ):  #"cc_mean"):
+    for name in ("firing_rate", "cv_isi", "cc_mean", "chi"):
         z[name][i, j] = row[name]
 
-# plot figure
+# adaptive sweeps (sweep.py --adaptive) do not fill the grid, and so the points are triangulated
+regular = len(data) == gvec.size * etavec.size
 x, y = np.meshgrid(gvec, etavec)
+
+
+def plot_statistic(name, title):
+    if regular:
+        plt.pcolormesh(x, y, z[name], cmap='RdBu', vmin=0, vmax=np.nanmax(z[name]))
+    else:
+        plt.tripcolor(data["g"], data["eta"], data[name], cmap='RdBu', shading='gouraud',
+                      vmin=0, vmax=np.nanmax(data[name]))
+        plt.plot(data["g"], data["eta"], 'k.', markersize=1)
+    plt.title(title)
+    # set the limits of the plot to the limits of the data
+    plt.axis([x.min(), x.max(), y.min(), y.max()])
+    plt.colorbar()
+
+
+# plot figure
 plt.figure(1)
 plt.subplot(2, 2, 1)
-plt.pcolormesh(x, y, z["firing_rate"], cmap='RdBu', vmin=0, vmax=z["firing_rate"].max())
-plt.title('Firing rate')
+plot_statistic("firing_rate", 'Firing rate')
 plt.ylabel("eta")
 plt.xlabel("g")
-# set the limits of the plot to the limits of the data
-plt.axis([x.min(), x.max(), y.min(), y.max()])
-plt.colorbar()
 
 plt.subplot(2, 2, 2)
-plt.pcolormesh(x, y, z["cv_isi"], cmap='RdBu', vmin=0, vmax=z["cv_isi"].max())
-plt.title('CV (ISI)')
-plt.axis([x.min(), x.max(), y.min(), y.max()])
-plt.colorbar()
-
-# plt.subplot(2, 2, 3)
-# plt.pcolormesh(x, y, z["cc_mean"], cmap='RdBu', vmin=0, vmax=z["cc_mean"].max())
-# plt.title('Mean correlation coefficient')
-# plt.axis([x.min(), x.max(), y.min(), y.max()])
-# plt.colorbar()
+plot_statistic("cv_isi", 'CV (ISI)')
+
+plt.subplot(2, 2, 3)
+plot_statistic("cc_mean", 'Mean correlation coefficient')
+
+plt.subplot(2, 2, 4)
+plot_statistic("chi", 'Synchrony (chi)')
 
 plt.savefig(os.path.join(results_dir, "brunel_network_phase_plots.png"))
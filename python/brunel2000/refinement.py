@@ -0,0 +1,83 @@
+"""
+Adaptive refinement of a two-dimensional parameter sweep.
+
+The sweep starts from a coarse grid, a subset of a regular fine grid. Each
+rectangular cell of the coarse grid whose corners give sharply different
+results is split into four, adding new points at the midpoints of its edges
+and at its centre, until the resolution of the fine grid is reached.
+Cells which lie entirely within one regime are not refined.
+
+Points are identified by their indices (i, j) in the fine grid; a cell is a
+tuple (i0, i1, j0, j1) of the indices of its corners.
+
+"""
+
+from __future__ import division
+import numpy as np
+
+
+def coarse_cells(shape, step):
+    """
+    Divide a fine grid of the given shape into cells which are `step` points
+    wide, except at the upper edges, where the cells may be narrower.
+    """
+    edges = []
+    for n in shape:
+        indices = list(range(0, n, step))
+        if indices[-1] != n - 1:
+            indices.append(n - 1)
+        edges.append(indices)
+    (i_edges, j_edges) = edges
+    return [(i0, i1, j0, j1)
+            for i0, i1 in zip(i_edges[:-1], i_edges[1:])
+            for j0, j1 in zip(j_edges[:-1], j_edges[1:])]
+
+
+def corners(cell):
+    i0, i1, j0, j1 = cell
+    return [(i0, j0), (i0, j1), (i1, j0), (i1, j1)]
+
+
+def split(cell):
+    """Split a cell into four (or two, if it is only one point wide in one dimension)."""
+    i0, i1, j0, j1 = cell
+    i_edges = [i0, (i0 + i1) // 2, i1] if i1 - i0 > 1 else [i0, i1]
+    j_edges = [j0, (j0 + j1) // 2, j1] if j1 - j0 > 1 else [j0, j1]
+    return [(a0, a1, b0, b1)
+            for a0, a1 in zip(i_edges[:-1], i_edges[1:])
+            for b0, b1 in zip(j_edges[:-1], j_edges[1:])]
+
+
+def cells_to_refine(cells, values, threshold):
+    """
+    Return the cells whose corners differ sharply in any of the measured quantities.
+
+    Arguments:
+        cells: list of cells
+        values: dict containing, for each point (i, j), an array of measured quantities.
+                Points for which the simulation failed may be missing.
+        threshold: a cell is refined if, for any quantity, the difference between
+                   its largest and smallest corner values is greater than
+                   `threshold` times the range of that quantity over all points.
+    """
+    if not values:
+        print("There are no results to compare, so no cells are refined")
+        return []
+    all_values = np.array(list(values.values()))
+    # quantities which are not defined at some points (NaN) are ignored there
+    finite = np.isfinite(all_values)
+    value_range = np.array([np.ptp(column[ok]) if ok.any() else 0.0
+                            for column, ok in zip(all_values.T, finite.T)])
+    value_range[value_range == 0] = 1.0
+    selected = []
+    for cell in cells:
+        if cell[1] - cell[0] <= 1 and cell[3] - cell[2] <= 1:
+            continue  # already at the finest resolution
+        corner_values = np.array([values[point] for point in corners(cell) if point in values])
+        if len(corner_values) < 2:
+            continue
+        with np.errstate(invalid="ignore"):
+            change = (corner_values.max(axis=0) - corner_values.min(axis=0)) / value_range
+        if (change > threshold).any():
+            selected.append(cell)
+    return selected
@@ -2,38 +2,71 @@
 """
 Run a simulation of the Brunel (2000) network model.
 
+With the "nest" and "pyNN.*" implementations, the simulation may be distributed
+over the number of threads given by "threads" in the "experiment" section of the
+parameter file (NEST only), and over "mpi_processes" MPI processes (the script
+re-launches itself with mpirun if necessary).
 
-Usage: run_brunel_network_alpha.py [-h] [--plot-figure]
+Modules are imported only when they are needed: the simulator when the
+implementation is loaded, and matplotlib and PyNN's plotting module only with
+--plot-figure.
+
+Usage: run_brunel_network_alpha.py [-h] [--plot-figure] [--timings TIMINGS]
+                                   [--profile {cprofile,tracemalloc}]
+                                   [--profile-startup]
                                    implementation parameter_file
 
 positional arguments:
   implementation  the implementation to use ('nineml', 'nest',
-                  'pyNN.nest' or 'pyNN.neuron')
+                  'pyNN.nest', 'pyNN.neuron', 'numpy' or 'numpy.hybrid')
   parameter_file  parameter file for this experiment
 
 optional arguments:
   -h, --help      show this help message and exit
   --plot-figure   plot the simulation results to a PNG file
+  --timings TIMINGS
+                  write the time taken by each phase of the simulation to
+                  this file, in JSON format (they are also written next
+                  to the data file, as "<data file>.timings.json")
+  --profile {cprofile,tracemalloc}
+                  profile each phase of the simulation with cProfile (the
+                  statistics are written to "<timings file>.<phase>.prof")
+                  or measure its peak memory use with tracemalloc
+  --profile-startup
+                  print the time taken to import each module
 
 """
 
 from __future__ import division, print_function
+import sys
+from timing import Timer, ImportTimer
+if "--profile-startup" in sys.argv:
+    # installed before any other imports, so that they are all measured
+    import_timer = ImportTimer()
+    import_timer.install()
+else:
+    import_timer = None
 from datetime import datetime
 import argparse
 import yaml
-import matplotlib
-matplotlib.use("Agg")
-from pyNN.utility.plotting import Figure, Panel
-from analysis import instantaneous_firing_rate
+from implementations import load_implementation, PARALLELISM
+from utility import relaunch_with_mpi, mpi_rank
 
 parser = argparse.ArgumentParser()
 parser.add_argument("implementation",
-                    help="the implementation to use ('nineml', 'nest', 'pyNN.nest' or 'pyNN.neuron'")
+                    help="the implementation to use ('nineml', 'nest', 'pyNN.nest', 'pyNN.neuron', 'numpy' or 'numpy.hybrid')")
 parser.add_argument("parameter_file",
                     help="parameter file for this experiment")
 parser.add_argument("--plot-figure",
                     help="plot the simulation results to a PNG file",
                     action="store_true")
+parser.add_argument("--timings",
+                    help="write the time taken by each phase of the simulation to this file, in JSON format")
+parser.add_argument("--profile", choices=("cprofile", "tracemalloc"),
+                    help="profile each phase of the simulation with cProfile, or measure "
+                         "its peak memory use with tracemalloc")
+parser.add_argument("--profile-startup", action="store_true",
+                    help="print the time taken to import each module")
 config = parser.parse_args()
 
 # parameters = {
@@ -48,32 +81,27 @@ config = parser.parse_args()
 with open(config.parameter_file) as fp:
     parameters = yaml.load(fp)
 
+if "mpi" in PARALLELISM.get(config.implementation, ()):
+    status = relaunch_with_mpi(parameters["experiment"].get("mpi_processes", 1))
+    if status is not None:
+        sys.exit(status)
 
-if config.implementation == "nineml":
-    from brunel_network_nineml import run_simulation
-    vm_var = "nrn_v"
-elif config.implementation == "ninemlpartial":
-    from brunel_network_nineml_partial import run_simulation
-    vm_var = "nrn_v"
-elif config.implementation == "nest":
-    from brunel_network_nest import run_simulation
-    vm_var = "V_m"
-elif "pyNN" in config.implementation:
-    from brunel_network_PyNN import run_simulation
-    parameters["simulator"] = config.implementation
-    vm_var = "v"
-elif "9mltoolkit" in config.implementation:
-    from brunel_network_9ml_toolkit import run_simulation
-    vm_var = "signal0"
-else:
-    raise NotImplementedError("{} not supported".format(config.implementation))
+timer = Timer(profile=config.profile)
+with timer.phase("import"):
+    run_simulation, vm_var = load_implementation(config.implementation, parameters)
 
 
-data = run_simulation(parameters, config.plot_figure)
+data = run_simulation(parameters, config.plot_figure, timer=timer)
 
+if config.timings and mpi_rank() == 0:
+    timer.save(config.timings)
 
-if config.plot_figure:
+if config.plot_figure and "exc" in data:  # with MPI, only the first process has the data
     print("Plotting figure")
+    import matplotlib
+    matplotlib.use("Agg")
+    from pyNN.utility.plotting import Figure, Panel
+    from analysis import instantaneous_firing_rate
     filename = "{}_{}_{:%Y%m%d%H%M%S}.png".format(
                     parameters["experiment"]["base_filename"],
                     config.implementation,
@@ -91,3 +119,7 @@ if config.plot_figure:
         #Panel(instantaneous_firing_rate(data["inh"], *plot_limits),
         #      xticks=True, xlabel="Time (ms)", yticks=True),
     ).save(filename)
+
+if import_timer:
+    import_timer.uninstall()
+    import_timer.report()
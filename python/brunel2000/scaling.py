@@ -0,0 +1,104 @@
+# encoding: utf-8
+"""
+Measure how the wall-clock time of the NEST implementation of the Brunel (2000)
+network model scales with the number of threads.
+
+The simulation is run once for each number of threads (in the same process,
+resetting the NEST kernel each time) and a table of the time taken to build
+the network, to run the simulation and to write the data is printed, with the
+speedup and parallel efficiency relative to the first number of threads.
+To include MPI processes, launch this script with mpirun, e.g.:
+
+    mpirun -np 2 python scaling.py parameters/AI.yml --threads 1 2 4
+
+Usage: scaling.py [-h] [--threads THREADS [THREADS ...]] [--repeats REPEATS]
+                  [--output OUTPUT]
+                  parameter_file
+
+positional arguments:
+  parameter_file        parameter file for this experiment
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --threads THREADS [THREADS ...]
+                        numbers of threads per MPI process
+  --repeats REPEATS     number of times to repeat each simulation (the
+                        shortest time is reported)
+  --output OUTPUT       also write the table to this file
+"""
+
+from __future__ import division, print_function
+import os
+import argparse
+import shutil
+import tempfile
+from copy import deepcopy
+import yaml
+from timing import Timer
+
+PHASES = ("build", "simulate", "write")
+
+
+def measure(parameters, threads, repeats):
+    """
+    Run the simulation `repeats` times with the given number of threads, and
+    return the timings of the repeat with the shortest total time.
+    """
+    import nest
+    from brunel_network_nest import run_simulation
+    parameters = deepcopy(parameters)
+    parameters["experiment"]["threads"] = threads
+    directory = tempfile.mkdtemp()
+    # every process must use the same file name, although only the first writes it
+    parameters["experiment"]["full_filename"] = os.path.join(directory, "scaling.h5")
+    best = None
+    try:
+        for i in range(repeats):
+            timer = Timer()
+            run_simulation(parameters, timer=timer)
+            if best is None or timer.total() < best.total():
+                best = timer
+    finally:
+        shutil.rmtree(directory)
+    return best.timings, nest.NumProcesses(), nest.GetKernelStatus("total_num_virtual_procs")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("parameter_file", help="parameter file for this experiment")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="numbers of threads per MPI process")
+    parser.add_argument("--repeats", type=int, default=1,
+                        help="number of times to repeat each simulation (the shortest time is reported)")
+    parser.add_argument("--output", help="also write the table to this file")
+    config = parser.parse_args()
+
+    with open(config.parameter_file) as fp:
+        parameters = yaml.load(fp)
+
+    rows = []
+    for threads in config.threads:
+        timings, n_processes, n_vp = measure(parameters, threads, config.repeats)
+        rows.append((n_processes, threads, n_vp,
+                     [timings.get(phase, 0.0) for phase in PHASES], sum(timings.values())))
+
+    import nest
+    if nest.Rank() > 0:
+        return
+    header = "{:>9} {:>7} {:>5} {:>9} {:>9} {:>9} {:>9} {:>8} {:>10}".format(
+        "processes", "threads", "VPs", "build", "simulate", "write", "total", "speedup", "efficiency")
+    lines = [header]
+    reference_vp, reference_total = rows[0][2], rows[0][4]
+    for n_processes, threads, n_vp, phase_times, total in rows:
+        speedup = reference_total / total
+        lines.append("{:>9} {:>7} {:>5} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.2f} {:>10.2f}".format(
+            n_processes, threads, n_vp, phase_times[0], phase_times[1], phase_times[2], total,
+            speedup, speedup * reference_vp / n_vp))
+    print("\n".join(lines))
+    if config.output:
+        with open(config.output, "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Run a queue of simulations concurrently.
+
+With run_jobs(), each simulation is a separate command, run as a subprocess.
+With run_in_process(), simulations are run in a pool of long-lived worker
+processes, so that the simulator and other modules are imported only once
+per worker.
+
+In both cases a new simulation is started as soon as any running one finishes,
+so that all the workers are kept busy even when some jobs take much longer
+than others.
+
+"""
+
+from __future__ import division, print_function
+import os
+import shlex
+import subprocess
+import time
+import traceback
+import multiprocessing
+import resource
+try:
+    from queue import Empty
+except ImportError:  # Python 2
+    from Queue import Empty
+import yaml
+from timing import Timer
+
+
+def run_jobs(jobs, n_workers=None, on_finish=None):
+    """
+    Run each command in `jobs`, with at most `n_workers` running at once.
+
+    Arguments:
+        jobs: an iterable of (key, command) pairs, where command is a string
+              or a list of arguments
+        n_workers: the number of concurrent jobs; defaults to the number of cores
+        on_finish: a function which is called as on_finish(key, result) as soon
+                   as each job has finished, where result is a dict containing
+                   the exit status, the wall-clock time (s), the user and system
+                   CPU times (s) and the peak resident set size (kB) of the job
+
+    Returns a dict of results, indexed by key.
+
+    Note that this waits for any child process of the current process, so it
+    should not be used while other subprocesses are running.
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    queue = iter(jobs)
+    running = {}  # pid: (key, process, start time)
+    results = {}
+    try:
+        while True:
+            while len(running) < n_workers:
+                try:
+                    key, command = next(queue)
+                except StopIteration:
+                    break
+                if not isinstance(command, list):
+                    command = shlex.split(command)
+                print(" ".join(command))
+                process = subprocess.Popen(command)
+                running[process.pid] = (key, process, time.time())
+            if not running:
+                break
+            pid, status, usage = os.wait4(-1, 0)
+            if pid not in running:
+                continue
+            key, process, start_time = running.pop(pid)
+            if os.WIFSIGNALED(status):
+                process.returncode = -os.WTERMSIG(status)
+            else:
+                process.returncode = os.WEXITSTATUS(status)
+            results[key] = {
+                "exit_status": process.returncode,
+                "wall_time": time.time() - start_time,
+                "user_time": usage.ru_utime,
+                "system_time": usage.ru_stime,
+                "max_rss": usage.ru_maxrss
+            }
+            if on_finish:
+                on_finish(key, results[key])
+    finally:
+        for key, process, start_time in running.values():
+            process.terminate()
+            process.wait()
+    return results
+
+
+def run_in_process(jobs, n_workers=None, on_finish=None):
+    """
+    Run each simulation in `jobs` in a pool of `n_workers` worker processes.
+
+    Arguments:
+        jobs: an iterable of (key, implementation, parameter_file) tuples
+        n_workers: the number of worker processes; defaults to the number of cores
+        on_finish: a function which is called as on_finish(key, result) as soon
+                   as each simulation has finished, where result is a dict containing
+                   the exit status, the wall-clock time (s), the peak resident
+                   set size of the worker (kB) and a dict of the time taken by each
+                   phase of the simulation (see timing.PHASES)
+
+    Each worker imports the simulator the first time it runs a simulation with
+    a given implementation; the run_simulation() functions reset the simulator
+    state at the start of each simulation. Since the workers are reused, the
+    peak resident set size is the largest reached by the worker in any of the
+    simulations it has run so far, not necessarily in this one.
+
+    The exit status is 0 if the simulation succeeded and 1 if it raised an
+    exception. If the worker process died (e.g. the simulator crashed or was
+    killed for lack of memory), it is the exit code of the worker (negative
+    for a signal, and -1 if the worker exited with status 0), the peak
+    resident set size is not known, and a new worker replaces it.
+
+    Returns a dict of results, indexed by key.
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    queue = iter(jobs)
+    results = {}
+    result_queue = multiprocessing.Queue()
+    workers = []  # (process, job queue)
+    idle = []
+    running = {}  # key: (worker, start time)
+    try:
+        while True:
+            while len(running) < n_workers:
+                try:
+                    job = next(queue)
+                except StopIteration:
+                    break
+                if idle:
+                    worker = idle.pop()
+                else:
+                    worker = _start_worker(result_queue)
+                    workers.append(worker)
+                worker[1].put(job)
+                running[job[0]] = (worker, time.time())
+            if not running:
+                break
+            try:
+                key, result = result_queue.get(timeout=1.0)
+            except Empty:
+                pass
+            else:
+                worker, start_time = running.pop(key)
+                idle.append(worker)
+                results[key] = result
+                if on_finish:
+                    on_finish(key, result)
+            # a worker which dies does not return a result
+            for key, (worker, start_time) in list(running.items()):
+                process = worker[0]
+                if not process.is_alive():
+                    print("The worker process running {} died, with exit code {}".format(
+                          key, process.exitcode))
+                    del running[key]
+                    workers.remove(worker)
+                    results[key] = {
+                        "exit_status": process.exitcode or -1,
+                        "wall_time": time.time() - start_time,
+                        "max_rss": None,
+                        "timings": {}
+                    }
+                    if on_finish:
+                        on_finish(key, results[key])
+    finally:
+        busy = [worker for worker, start_time in running.values()]
+        for process, job_queue in workers:
+            if (process, job_queue) in busy:  # we were interrupted
+                process.terminate()
+            else:
+                job_queue.put(None)
+        for process, job_queue in workers:
+            process.join()
+    return results
+
+
+def _start_worker(result_queue):
+    """Start a worker process for run_in_process(), and return it with the queue of its jobs."""
+    job_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_worker, args=(job_queue, result_queue))
+    process.daemon = True
+    process.start()
+    return process, job_queue
+
+
+def _worker(job_queue, result_queue):
+    for job in iter(job_queue.get, None):
+        result_queue.put(_run_point(job))
+
+
+def _run_point(job):
+    # a crash in the simulator will kill the worker process, rather than
+    # raising an exception; run_in_process() then finds it is no longer alive
+    key, implementation, parameter_file = job
+    from implementations import load_implementation
+    timer = Timer()
+    start_time = time.time()
+    try:
+        with open(parameter_file) as fp:
+            parameters = yaml.load(fp)
+        with timer.phase("import"):
+            run_simulation, vm_var = load_implementation(implementation, parameters)
+        run_simulation(parameters, timer=timer)
+        exit_status = 0
+    except Exception:
+        traceback.print_exc()
+        exit_status = 1
+    return key, {
+        "exit_status": exit_status,
+        "wall_time": time.time() - start_time,
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "timings": timer.timings
+    }
@@ -0,0 +1,159 @@
+"""
+Delivery of spikes, with a fixed delay, through static connections.
+
+The connections are stored in CSR form, indexed by the source neuron, so that
+the targets of all the neurons which spiked in a time step can be gathered
+with a few array operations. The synaptic input to each target is accumulated
+in a circular buffer with one row per time step of the delay, and each row is
+collected by the target population at the start of the step in which it arrives.
+
+For simulation with precise spike times, TimedSpikeDelivery instead keeps the
+precise arrival time of each spike.
+
+"""
+
+from __future__ import division
+import numpy as np
+
+METHODS = ("bincount", "add.at")
+
+
+class SpikeDelivery(object):
+    """
+    Delayed delivery of spikes through static connections.
+
+    Arguments:
+        indptr, targets: the connections in CSR form; the targets of source
+                         neuron i are targets[indptr[i]:indptr[i + 1]]
+        weights: the synaptic weight of the connections from each source neuron
+        n_targets: the size of the target population
+        delay_steps: the delay, in time steps
+        method: how the weights are summed for each target: with np.bincount
+                (the default, fastest when many neurons spike in each step)
+                or np.add.at
+    """
+
+    def __init__(self, indptr, targets, weights, n_targets, delay_steps, method="bincount"):
+        if method not in METHODS:
+            raise ValueError("method should be one of {}".format(", ".join(METHODS)))
+        self.indptr = indptr
+        self.targets = targets
+        self.weights = weights
+        self.n_targets = n_targets
+        self.delay_steps = delay_steps
+        self.method = method
+        # a spike sent in step s arrives at the start of step s + 1 + delay_steps,
+        # after row (s % n_rows) has been collected, so one extra row is needed
+        self.buffer = np.zeros((delay_steps + 1, n_targets))
+
+    @classmethod
+    def from_pairs(cls, sources, targets, weights, n_targets, delay_steps, method="bincount"):
+        """
+        Create a SpikeDelivery from arrays of the source and target of each connection.
+        `weights` gives the weight of the connections from each source neuron.
+        """
+        sources = np.asarray(sources)
+        order = np.argsort(sources, kind="mergesort")
+        indptr = np.append(0, np.cumsum(np.bincount(sources, minlength=len(weights))))
+        return cls(indptr, np.asarray(targets, dtype=np.int32)[order], weights, n_targets,
+                   delay_steps, method)
+
+    @property
+    def n_connections(self):
+        return self.targets.size
+
+    def connections_from(self, spiking):
+        """
+        Return the targets and weights of all the connections from the neurons
+        in `spiking`, as two flat arrays.
+        """
+        starts = self.indptr[spiking]
+        lengths = self.indptr[spiking + 1] - starts
+        # the indices, in self.targets, of the connections from all spiking neurons
+        index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return self.targets[index], np.repeat(self.weights[spiking], lengths)
+
+    def send(self, spiking, step):
+        """
+        Send the spikes of the neurons in `spiking` (an array of indices),
+        emitted in time step `step`.
+        """
+        targets, weights = self.connections_from(spiking)
+        row = self.buffer[(step + 1 + self.delay_steps) % self.buffer.shape[0]]
+        if self.method == "bincount":
+            row += np.bincount(targets, weights=weights, minlength=self.n_targets)
+        else:
+            np.add.at(row, targets, weights)
+
+    def schedule(self, targets, weights, step):
+        """
+        Add input with the given `weights` to `targets`, arriving at the start
+        of time step `step`, e.g. to inject external spikes. `step` must be no
+        more than delay_steps steps after the next step to be collected.
+        """
+        np.add.at(self.buffer[step % self.buffer.shape[0]], targets, weights)
+
+    def collect(self, step, out):
+        """Add the input arriving at the start of time step `step` to `out`."""
+        row = self.buffer[step % self.buffer.shape[0]]
+        out += row
+        row[:] = 0.0
+
+
+class TimedSpikeDelivery(SpikeDelivery):
+    """
+    Delayed delivery of spikes which are emitted at precise times, rather than
+    at the end of a time step, as in event-driven simulation.
+
+    Instead of summed weights, each row of the buffer holds the targets,
+    arrival times and weights of the individual spikes arriving during that
+    step. The time step `dt` (ms) must not be greater than the delay (ms).
+    """
+
+    def __init__(self, indptr, targets, weights, n_targets, delay, dt):
+        if dt > delay:
+            raise ValueError("The time step must not be greater than the delay")
+        delay_steps = int(np.ceil(delay / dt))
+        SpikeDelivery.__init__(self, indptr, targets, weights, n_targets, delay_steps)
+        self.delay = delay
+        self.dt = dt
+        self.buffer = [[] for i in range(delay_steps + 2)]
+
+    @classmethod
+    def from_pairs(cls, sources, targets, weights, n_targets, delay, dt):
+        delivery = SpikeDelivery.from_pairs(sources, targets, weights, n_targets, delay_steps=0)
+        return cls(delivery.indptr, delivery.targets, weights, n_targets, delay, dt)
+
+    def send(self, spiking, spike_times):
+        """Send the spikes of the neurons in `spiking`, emitted at `spike_times` (ms)."""
+        targets, weights = self.connections_from(spiking)
+        lengths = self.indptr[spiking + 1] - self.indptr[spiking]
+        self.schedule(targets, np.repeat(spike_times + self.delay, lengths), weights)
+
+    def schedule(self, targets, arrival_times, weights):
+        """
+        Add input with the given `weights` to `targets`, arriving at
+        `arrival_times` (ms). The arrival times must be no more than the delay
+        after the start of the next step to be collected.
+        """
+        if arrival_times.size == 0:
+            return
+        arrival_steps = np.floor(arrival_times / self.dt).astype(int)
+        # the arrival times span at most a few steps, so this is faster than np.unique
+        for step in range(arrival_steps.min(), arrival_steps.max() + 1):
+            mask = arrival_steps == step
+            self.buffer[step % len(self.buffer)].append(
+                (targets[mask], arrival_times[mask], weights[mask]))
+
+    def collect(self, step):
+        """
+        Return the targets, arrival times and weights of the spikes arriving
+        during time step `step`.
+        """
+        row = self.buffer[step % len(self.buffer)]
+        if row:
+            targets, times, weights = [np.hstack(arrays) for arrays in zip(*row)]
+        else:
+            targets, times, weights = (np.array([], dtype=int), np.array([]), np.array([]))
+        del row[:]
+        return targets, times, weights
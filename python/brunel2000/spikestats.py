@@ -0,0 +1,273 @@
+"""
+Spike train statistics for all the neurons of a population at once.
+
+The statistics are calculated from the flat representation of a SpikeStore,
+in which the spike times of all neurons are held in a single array. Instead
+of looping over neurons, the inter-spike intervals of all neurons are found
+with a single call to np.diff, and per-neuron sums are calculated with
+np.add.reduceat over the segment of the array belonging to each neuron.
+
+The single-neuron statistics are returned as an array with one value per
+neuron, in the order of SpikeStore.channel_ids, with NaN for neurons with too
+few spikes. The results are the same as those of the corresponding functions
+in elephant.statistics, applied to each spike train in turn.
+
+Measures of synchrony are calculated from the spike counts in time bins,
+held in a sparse matrix so that memory use grows with the number of spikes
+rather than with the number of neurons times the number of bins.
+
+"""
+
+from __future__ import division
+import numpy as np
+
+
+def segment_sums(values, offsets):
+    """
+    Return the sum of values[offsets[i]:offsets[i + 1]] for each i.
+    Empty segments give zero.
+    """
+    sums = np.zeros(offsets.size - 1)
+    nonempty = offsets[1:] > offsets[:-1]
+    if values.size > 0:
+        # np.add.reduceat would return values[j] rather than 0 for an empty segment
+        # starting at j, so only the starts of the non-empty segments are used
+        sums[nonempty] = np.add.reduceat(values, offsets[:-1][nonempty])
+    return sums
+
+
+def consecutive_pairs(values, offsets):
+    """
+    Return the pairs of consecutive values within each segment, as two arrays
+    (earlier, later), and the offsets of each segment in these arrays.
+    """
+    counts = np.diff(offsets)
+    first = np.zeros(values.size, dtype=bool)
+    first[offsets[:-1][counts > 0]] = True
+    keep = ~first[1:]
+    pair_offsets = np.append(0, np.cumsum(np.maximum(counts - 1, 0)))
+    return values[:-1][keep], values[1:][keep], pair_offsets
+
+
+def inter_spike_intervals(store):
+    """Return the inter-spike intervals (ms) of all neurons, and their offsets."""
+    earlier, later, offsets = consecutive_pairs(store.times, store.offsets)
+    return later - earlier, offsets
+
+
+def firing_rates(store):
+    """Return the mean firing rate (spikes/s) of each neuron (see elephant.statistics.mean_firing_rate)."""
+    return 1000.0 * store.spike_counts / (store.t_stop - store.t_start)
+
+
+def cv_isi(store):
+    """
+    Return the coefficient of variation of the inter-spike intervals of each
+    neuron (see elephant.statistics.cv). NaN for neurons with fewer than two spikes.
+    """
+    isis, offsets = inter_spike_intervals(store)
+    n = np.diff(offsets)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = segment_sums(isis, offsets) / n
+        deviations = isis - np.repeat(mean, n)
+        std = np.sqrt(segment_sums(deviations**2, offsets) / n)
+        return std / mean
+
+
+def local_variation(store):
+    """
+    Return the local variation of the inter-spike intervals of each neuron
+    (see elephant.statistics.lv). NaN for neurons with fewer than three spikes.
+    """
+    isis, offsets = inter_spike_intervals(store)
+    earlier, later, pair_offsets = consecutive_pairs(isis, offsets)
+    n_pairs = np.diff(pair_offsets)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        terms = ((earlier - later) / (earlier + later))**2
+        return 3.0 * segment_sums(terms, pair_offsets) / n_pairs
+
+
+def fano_factors(store, window=100.0):
+    """
+    Return the Fano factor (variance/mean) of the spike counts of each neuron
+    in consecutive windows of `window` ms, starting from t_start (see
+    elephant.statistics.fanofactor, applied to the windows of one spike train).
+    Any final partial window is ignored. NaN for neurons which did not spike.
+    """
+    n_windows = int((store.t_stop - store.t_start) // window)
+    neuron = np.repeat(np.arange(len(store)), store.spike_counts)
+    bin = ((store.times - store.t_start) // window).astype(int)
+    mask = (bin >= 0) & (bin < n_windows)
+    counts = np.bincount(neuron[mask] * n_windows + bin[mask],
+                         minlength=len(store) * n_windows).reshape((len(store), n_windows))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return counts.var(axis=1) / counts.mean(axis=1)
+
+
+def mean_statistic(values, default=0.0):
+    """Return the mean of the non-NaN values, or `default` if there are none."""
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return default
+    return values.mean()
+
+
+def binned_spike_counts(store, bin_width):
+    """
+    Return the spike counts of each neuron in bins of `bin_width` (ms), starting
+    from t_start, as a sparse CSR matrix of shape (number of neurons, number of bins).
+    Any final partial bin is ignored.
+    """
+    from scipy.sparse import csr_matrix
+    n_bins = int((store.t_stop - store.t_start) // bin_width)
+    neuron = np.repeat(np.arange(len(store)), store.spike_counts)
+    bin = ((store.times - store.t_start) // bin_width).astype(int)
+    mask = (bin >= 0) & (bin < n_bins)
+    return csr_matrix((np.ones(mask.sum()), (neuron[mask], bin[mask])),
+                      shape=(len(store), n_bins))
+
+
+def correlation_statistics(store, bin_width=5.0, max_pairs=100000, tile_size=256, seed=None):
+    """
+    Return the minimum, maximum and mean of the Pearson correlation coefficients
+    between the binned spike counts of pairs of neurons (see
+    elephant.spike_train_correlation.corrcoef), as a dict with keys "cc_min",
+    "cc_max" and "cc_mean".
+
+    Only pairs of distinct neurons which both spiked are included. If there are
+    no more than `max_pairs` such pairs, all of them are used, calculating the
+    correlations for `tile_size` neurons at a time so that memory use is bounded;
+    otherwise a random sample of `max_pairs` pairs is used.
+    """
+    counts = binned_spike_counts(store, bin_width)
+    counts = counts[np.flatnonzero(store.spike_counts > 0)]
+    n, n_bins = counts.shape
+    if n < 2:
+        return {"cc_min": np.nan, "cc_max": np.nan, "cc_mean": np.nan}
+    sums = np.asarray(counts.sum(axis=1)).ravel()
+    variances = np.asarray(counts.multiply(counts).sum(axis=1)).ravel() - sums**2 / n_bins
+
+    def correlations(i, j, products):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (products - sums[i] * sums[j] / n_bins) / np.sqrt(variances[i] * variances[j])
+
+    if n * (n - 1) // 2 <= max_pairs:
+        total, n_finite, cc_min, cc_max = 0.0, 0, np.inf, -np.inf
+        transposed = counts.T.tocsc()
+        for start in range(0, n, tile_size):
+            stop = min(start + tile_size, n)
+            products = (counts[start:stop] * transposed).toarray()
+            i, j = np.triu_indices(stop - start, 1, n - start)
+            cc = correlations(i + start, j + start, products[i, j + start])
+            cc = cc[np.isfinite(cc)]
+            if cc.size > 0:
+                total += cc.sum()
+                n_finite += cc.size
+                cc_min = min(cc_min, cc.min())
+                cc_max = max(cc_max, cc.max())
+        if n_finite == 0:
+            return {"cc_min": np.nan, "cc_max": np.nan, "cc_mean": np.nan}
+        return {"cc_min": cc_min, "cc_max": cc_max, "cc_mean": total / n_finite}
+    else:
+        rng = np.random.RandomState(seed)
+        i = rng.randint(0, n, size=max_pairs)
+        j = (i + rng.randint(1, n, size=max_pairs)) % n  # never equal to i
+        products = np.asarray(counts[i].multiply(counts[j]).sum(axis=1)).ravel()
+        cc = correlations(i, j, products)
+        cc = cc[np.isfinite(cc)]
+        if cc.size == 0:
+            return {"cc_min": np.nan, "cc_max": np.nan, "cc_mean": np.nan}
+        return {"cc_min": cc.min(), "cc_max": cc.max(), "cc_mean": cc.mean()}
+
+
+def synchrony(store, bin_width=5.0):
+    """
+    Return the synchrony measure chi (Golomb, 2007): the square root of the
+    variance over time of the population-averaged spike count, divided by the
+    mean over neurons of the variance of the individual spike counts, in bins
+    of `bin_width` (ms). Chi is close to zero for asynchronous activity and
+    close to one for fully synchronous activity.
+    """
+    counts = binned_spike_counts(store, bin_width)
+    n, n_bins = counts.shape
+    if n == 0 or n_bins == 0:
+        return np.nan
+    sums = np.asarray(counts.sum(axis=1)).ravel()
+    variances = np.asarray(counts.multiply(counts).sum(axis=1)).ravel() / n_bins - (sums / n_bins)**2
+    population = np.asarray(counts.sum(axis=0)).ravel() / n
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sqrt(population.var() / variances.mean())
+
+
+def population_spectrum(store, bin_width=0.5, segment_length=256.0, begin=None):
+    """
+    Return the power spectral density of the population-averaged firing rate,
+    estimated with Welch's method, as arrays of frequencies (Hz) and power (Hz**2/Hz).
+
+    The rate is calculated in bins of `bin_width` (ms) from `begin` (default: t_start)
+    to t_stop, and the spectrum is averaged over half-overlapping segments of
+    `segment_length` (ms). If the recording is too short to give at least two
+    bins, empty arrays are returned.
+    """
+    from scipy.signal import welch
+    if begin is None:
+        begin = store.t_start
+    n_bins = int((store.t_stop - begin) // bin_width)
+    if n_bins < 2:
+        return np.array([]), np.array([])
+    bin = ((store.times - begin) // bin_width).astype(int)
+    counts = np.bincount(bin[(bin >= 0) & (bin < n_bins)], minlength=n_bins)
+    rate = counts * (1000.0 / bin_width / max(len(store), 1))
+    return welch(rate, fs=1000.0 / bin_width,
+                 nperseg=min(int(segment_length / bin_width), n_bins), detrend="constant")
+
+
+def spectral_statistics(store, bin_width=0.5, segment_length=256.0, begin=None):
+    """
+    Return the frequency (Hz) of the largest peak in the power spectrum of the
+    population rate, and the power at this frequency relative to that expected
+    if the neurons fired as independent Poisson processes at the same mean
+    rate, as a dict with keys "dominant_frequency" and "synchrony_power".
+
+    For asynchronous activity the synchrony power is of order one; a population
+    oscillation gives a much larger value.
+    """
+    frequencies, power = population_spectrum(store, bin_width, segment_length, begin)
+    if begin is None:
+        begin = store.t_start
+    n_spikes = ((store.times >= begin) & (store.times < store.t_stop)).sum()
+    if frequencies.size < 2 or n_spikes == 0:
+        return {"dominant_frequency": np.nan, "synchrony_power": np.nan}
+    peak = 1 + np.argmax(power[1:])  # ignore the zero-frequency component
+    mean_rate = 1000.0 * n_spikes / (store.t_stop - begin) / len(store)
+    # the one-sided spectral density of the mean of N independent Poisson
+    # spike trains with rate r is flat, at 2r/N
+    poisson_level = 2 * mean_rate / len(store)
+    return {"dominant_frequency": frequencies[peak],
+            "synchrony_power": power[peak] / poisson_level}
+
+
+# the boundaries used to classify the dynamical regime, see classify_regime()
+SYNCHRONY_THRESHOLD = 10.0
+REGULAR_CV_THRESHOLD = 0.5
+FAST_OSCILLATION_THRESHOLD = 100.0  # Hz
+
+
+def classify_regime(cv_isi, dominant_frequency, synchrony_power):
+    """
+    Return the dynamical regime of Brunel (2000) matching the given statistics:
+    "AI" (asynchronous irregular) if there is no strong population oscillation,
+    otherwise "SR" (synchronous regular) if single neurons fire regularly, and
+    "SIfast" or "SIslow" (synchronous irregular, with a fast or a slow
+    oscillation) if they fire irregularly. Returns "unknown" if the statistics
+    are not defined, e.g. because there were no spikes.
+    """
+    if np.isnan(synchrony_power) or np.isnan(dominant_frequency):
+        return "unknown"
+    if synchrony_power < SYNCHRONY_THRESHOLD:
+        return "AI"
+    if cv_isi < REGULAR_CV_THRESHOLD:
+        return "SR"
+    if dominant_frequency >= FAST_OSCILLATION_THRESHOLD:
+        return "SIfast"
+    return "SIslow"
@@ -0,0 +1,158 @@
+"""
+Compact storage of the spike times of a population of neurons.
+
+All spikes are held in a single array, grouped by neuron and sorted in time
+within each group, with a CSR-style index giving the start of each group.
+Per-neuron SpikeTrains are views of this array, not copies.
+
+"""
+
+from __future__ import division
+import os
+import json
+import numpy as np
+import neo
+
+ARRAY_NAMES = ("times", "ids", "channel_ids", "offsets")
+
+
+class SpikeStore(object):
+    """
+    Spike times of a population of neurons.
+
+    Arguments:
+        times: spike times, grouped by neuron and in increasing order within each group
+        ids: the neuron ID for each spike time
+        channel_ids: the IDs of the neurons, in increasing order
+        offsets: array of size len(channel_ids) + 1; the spike times of neuron
+                 channel_ids[i] are times[offsets[i]:offsets[i + 1]]
+        t_start, t_stop: the time period over which spikes were recorded (ms)
+    """
+
+    def __init__(self, times, ids, channel_ids, offsets, t_start=0.0, t_stop=None):
+        self.times = times
+        self.ids = ids
+        self.channel_ids = channel_ids
+        self.offsets = offsets
+        self.t_start = t_start
+        if t_stop is None and times.size > 0:
+            t_stop = times.max()
+        self.t_stop = t_stop
+
+    @classmethod
+    def from_events(cls, times, ids, channel_ids=None, t_start=0.0, t_stop=None):
+        """
+        Create a SpikeStore from unsorted (time, ID) pairs, such as the events
+        recorded by a NEST spike detector.
+
+        If `channel_ids` is given, only spikes from these neurons are kept, and
+        neurons which did not spike are included, with no spikes.
+        """
+        times = np.asarray(times, dtype=float)
+        ids = np.asarray(ids)
+        if channel_ids is None:
+            channel_ids = np.unique(ids)
+        else:
+            channel_ids = np.unique(channel_ids)
+            if channel_ids.size == 0:
+                return cls(np.array([]), ids[:0], channel_ids, np.zeros(1, dtype=int),
+                           t_start=t_start, t_stop=t_stop)
+            index = np.minimum(np.searchsorted(channel_ids, ids), channel_ids.size - 1)
+            mask = channel_ids[index] == ids
+            times = times[mask]
+            ids = ids[mask]
+        # a stable sort keeps the spikes from each neuron in their recorded
+        # order; we then sort by time only if they were not already in order
+        order = np.argsort(ids, kind="mergesort")
+        times = times[order]
+        ids = ids[order]
+        offsets = np.append(np.searchsorted(ids, channel_ids), ids.size)
+        if times.size > 1 and ((np.diff(times) < 0) & (np.diff(ids) == 0)).any():
+            order = np.lexsort((times, ids))
+            times = times[order]
+        return cls(times, ids, channel_ids, offsets, t_start=t_start, t_stop=t_stop)
+
+    @classmethod
+    def from_spiketrains(cls, spiketrains, id_annotation="source_id"):
+        """
+        Create a SpikeStore from a list of SpikeTrains, all with the same t_start and t_stop.
+
+        The neuron IDs are taken from the annotation `id_annotation`, if present,
+        otherwise the neurons are numbered from zero in the order of the list.
+        """
+        if len(spiketrains) == 0:
+            return cls(np.array([]), np.array([], dtype=int), np.array([], dtype=int),
+                       np.zeros(1, dtype=int))
+        channel_ids = np.array([st.annotations.get(id_annotation, i)
+                                for i, st in enumerate(spiketrains)])
+        # all the spike trains from a recording are assumed to have the same units
+        scale = float(spiketrains[0].units.rescale("ms").magnitude)
+        times = scale * np.concatenate([np.asarray(st) for st in spiketrains])
+        counts = np.array([st.size for st in spiketrains])
+        ids = np.repeat(channel_ids, counts)
+        t_start = float(spiketrains[0].t_start.rescale("ms"))
+        t_stop = float(spiketrains[0].t_stop.rescale("ms"))
+        order = np.argsort(channel_ids, kind="mergesort")
+        if (np.diff(channel_ids[order]) == 0).any():
+            raise ValueError("The spike trains should have different values of '{}'".format(id_annotation))
+        if (order != np.arange(order.size)).any() or \
+                ((np.diff(times) < 0) & (np.diff(ids) == 0)).any():
+            return cls.from_events(times, ids, channel_ids, t_start=t_start, t_stop=t_stop)
+        offsets = np.append(0, np.cumsum(counts))
+        return cls(times, ids, channel_ids, offsets, t_start=t_start, t_stop=t_stop)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """Load a SpikeStore saved with `save()`, memory-mapping the arrays by default."""
+        with open(os.path.join(directory, "metadata.json")) as fp:
+            metadata = json.load(fp)
+        arrays = dict((name, np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode))
+                      for name in ARRAY_NAMES)
+        return cls(t_start=metadata["t_start"], t_stop=metadata["t_stop"], **arrays)
+
+    def save(self, directory):
+        """Save the arrays as .npy files in `directory`, which is created if necessary."""
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        contents = self.as_dict()
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(directory, name + ".npy"), contents.pop(name))
+        with open(os.path.join(directory, "metadata.json"), "w") as fp:
+            json.dump(contents, fp)
+
+    def as_dict(self):
+        return {
+            "times": self.times,
+            "ids": self.ids,
+            "channel_ids": self.channel_ids,
+            "offsets": self.offsets,
+            "t_start": self.t_start,
+            "t_stop": self.t_stop
+        }
+
+    def __len__(self):
+        return self.channel_ids.size
+
+    @property
+    def spike_counts(self):
+        return np.diff(self.offsets)
+
+    def spiketrain(self, index, id_annotation="source_id", id0=None):
+        """
+        Return the spikes of the neuron with index `index` as a SpikeTrain
+        which shares its data with the store.
+        """
+        if id0 is None:
+            id0 = self.channel_ids[0]
+        id = int(self.channel_ids[index])
+        annotations = {id_annotation: id, "source_index": id - int(id0)}
+        return neo.SpikeTrain(self.times[self.offsets[index]:self.offsets[index + 1]],
+                              t_start=self.t_start,
+                              t_stop=self.t_stop,
+                              units="ms",
+                              copy=False,
+                              **annotations)
+
+    def spiketrains(self, id_annotation="source_id", id0=None):
+        """Return a list of SpikeTrains, one per neuron, in order of increasing ID."""
+        return [self.spiketrain(i, id_annotation, id0) for i in range(len(self))]
@@ -3,29 +3,31 @@
 Calculate spike train statistics over multiple runs with different random seeds,
  for the Brunel (2000) model
 
+The statistics are written to "statistics.csv" in the results directory. When
+this script is run again, only the data files which are new, or which have
+changed, are analysed.
+
 """
 
 from __future__ import division, print_function
 import os
 import argparse
-import numpy as np
-import pandas
-from joblib import Parallel, delayed
+import multiprocessing
 import neo.io
 from ninemltoolkitio import NineMLToolkitIO
-from analysis import spike_statistics
+from analysis import update_statistics
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument("directory",
                     help="directory containing data generated by running sweep.py")
 parser.add_argument("--io", help="name of Neo IO class to use for reading data")
+parser.add_argument("--n-workers", type=int, default=multiprocessing.cpu_count(),
+                    help="number of data files to analyse concurrently (default: number of cores)")
 config = parser.parse_args()
 
 results_dir = config.directory
 
-statistics_file = os.path.join(results_dir, "statistics.csv")
-
 if config.io:
     if config.io == "NineMLToolkitIO":
         ioclass = NineMLToolkitIO
@@ -34,30 +36,6 @@ if config.io:
 else:
     ioclass = None
 
-if os.path.exists(statistics_file):
-    # read the previously calculated spike train statistics from file
-    data = pandas.read_csv(statistics_file,
-                           delim_whitespace=True)
-else:
-    # for each data file, read the spike trains and calculate the metrics
-    data = pandas.read_csv(os.path.join(results_dir, "sweeps.csv"),
-                           names=("seed", "output_file"),
-                           delim_whitespace=True, comment="#")
-
-    for idx, row in data.iterrows():
-        results = spike_statistics(idx, row, ioclass=ioclass)
-        for key, value in results.items():
-            data.ix[idx, key] = value
-
-    # results = Parallel(n_jobs=4)(delayed(
-    #               spike_statistics)(idx, row) for idx, row in data.iterrows())
-    # for idx, result in enumerate(results):
-    #     for key, value in result.items():
-    #         data.ix[idx, key] = value
-
-
-    print(data)
+data = update_statistics(results_dir, ioclass=ioclass, n_workers=config.n_workers)
 
-    # save statistics to file
-    data.to_csv(os.path.join(results_dir, "statistics.csv"),
-                sep=" ", index=False)
+print(data)
@@ -1,31 +1,76 @@
 """
 Run a parameter sweep for the Brunel (2000) model
 
-Usage: sweep.py [-h] implementation
+Usage: sweep.py [-h] [--n-workers N_WORKERS] [--in-process] [--resume RESUME]
+                [--max-attempts MAX_ATTEMPTS] [--adaptive]
+                [--refinements REFINEMENTS] [--threshold THRESHOLD]
+                implementation parameter_file
 
 positional arguments:
-  implementation  the implementation to use ('nineml', 'nest', 'pyNN.nest' or
-                  'pyNN.neuron'
+  implementation        the implementation to use ('nineml', 'nest', 'pyNN.nest',
+                        'pyNN.neuron', 'numpy' or 'numpy.hybrid')
+  parameter_file        baseline parameter file for this experiment
 
 optional arguments:
-  -h, --help      show this help message and exit
+  -h, --help            show this help message and exit
+  --n-workers N_WORKERS
+                        number of simulations to run concurrently (default:
+                        number of cores)
+  --in-process          run many simulations in each of a pool of worker
+                        processes, rather than starting a new process for
+                        each simulation
+  --resume RESUME       directory of a previous sweep to resume; simulations
+                        which have already finished are not repeated
+  --max-attempts MAX_ATTEMPTS
+                        maximum number of times to run a simulation which
+                        fails (default: 3)
+  --adaptive            sweep over g and eta, starting from a coarse grid and
+                        adding points only where the firing rate or CV(ISI)
+                        changes sharply
+  --refinements REFINEMENTS
+                        number of times the coarse grid may be refined
+                        (default: 2)
+  --threshold THRESHOLD
+                        relative change between neighbouring points above
+                        which the grid is refined (default: 0.2)
 """
 
+from __future__ import print_function
 import os
 import sys
 from datetime import datetime
-from uuid import uuid1
 import argparse
-from time import sleep
+import multiprocessing
 import yaml
 import numpy as np
-from sarge import run
+from scheduler import run_jobs, run_in_process
+from timing import PHASES, timings_filename, load_timings
+from ledger import Ledger, parameter_hash
+from refinement import coarse_cells, corners, split, cells_to_refine
 
 parser = argparse.ArgumentParser()
 parser.add_argument("implementation",
-                    help="the implementation to use ('nineml', 'nest', 'pyNN.nest' or 'pyNN.neuron'")
+                    help="the implementation to use ('nineml', 'nest', 'pyNN.nest', 'pyNN.neuron', 'numpy' or 'numpy.hybrid')")
 parser.add_argument("parameter_file",
                     help="baseline parameter file for this experiment")
+parser.add_argument("--n-workers", type=int, default=multiprocessing.cpu_count(),
+                    help="number of simulations to run concurrently (default: number of cores)")
+parser.add_argument("--in-process", action="store_true",
+                    help="run many simulations in each of a pool of worker processes, "
+                         "rather than starting a new process for each simulation")
+parser.add_argument("--resume",
+                    help="directory of a previous sweep to resume; simulations which "
+                         "have already finished are not repeated")
+parser.add_argument("--max-attempts", type=int, default=3,
+                    help="maximum number of times to run a simulation which fails (default: 3)")
+parser.add_argument("--adaptive", action="store_true",
+                    help="sweep over g and eta, starting from a coarse grid and adding points "
+                         "only where the firing rate or CV(ISI) changes sharply")
+parser.add_argument("--refinements", type=int, default=2,
+                    help="number of times the coarse grid may be refined (default: 2)")
+parser.add_argument("--threshold", type=float, default=0.2,
+                    help="relative change between neighbouring points above which the grid "
+                         "is refined (default: 0.2)")
 config = parser.parse_args()
 
 implementation = config.implementation
@@ -36,47 +81,138 @@ if implementation == "9mltoolkit":
 else:
     suffix = ".pkl"
 
-timestamp = datetime.now()
-results_dir = "results/{:%Y%m%d-%H%M%S}".format(timestamp)
-os.mkdir(results_dir)
+if config.resume:
+    results_dir = config.resume
+else:
+    timestamp = datetime.now()
+    results_dir = "results/{:%Y%m%d-%H%M%S}".format(timestamp)
+    os.mkdir(results_dir)
+ledger = Ledger(os.path.join(results_dir, "ledger.sqlite"))
 
 with open(config.parameter_file) as fp:
     parameters = yaml.load(fp)
 parameters["experiment"].pop("base_filename")
+if "connectivity_file" in parameters["experiment"]:
+    # create the shared connectivity before starting any simulations
+    from connectivity import connectivity_from_parameters
+    connectivity_from_parameters(parameters)
+
+# the finest grid, as in Figure 2 of Brunel (2000)
+g_values = np.arange(1.5, 9, 0.5)
+eta_values = np.arange(0, 5, 0.25)
+
+script_path = os.path.join(os.path.dirname(__file__), "run.py")
+rows = {}
+
+
+def record_job(key, result):
+    ledger.finish(key, result)
+    g, eta, seed, output_file = rows[key]
+    timings = result.get("timings")  # only available with --in-process
+    if timings is None:
+        # otherwise, read the timings written next to the output file
+        if result["exit_status"] == 0 and os.path.exists(timings_filename(output_file)):
+            timings = load_timings(timings_filename(output_file))
+        else:
+            timings = {}
+    sweep_fp.write("{} {} {} {} {:.3f} {} {} {}\n".format(g, eta, seed, output_file,
+                                                         result["wall_time"],
+                                                         result["exit_status"],
+                                                         result["max_rss"],
+                                                         " ".join("{:.3f}".format(timings.get(phase, np.nan))
+                                                                  for phase in PHASES)))
+    sweep_fp.flush()  # flush file buffers in case a later job crashes
+
+
+def run_points(points):
+    """
+    Run a simulation for each point, unless it has already been run successfully.
+
+    Each point is a dict containing any of "g", "eta" and "seed".
+    Returns a list containing the output file for each point, or None if
+    the simulation failed.
+    """
+    jobs = {}
+    keys = []
+    for point in points:
+        for name in ("g", "eta"):
+            if name in point:
+                parameters["network"][name] = point[name]
+        if "seed" in point:
+            parameters["experiment"]["seed"] = point["seed"]
+        # the ID depends only on the parameters, so the same point always has the same output file
+        key = parameter_hash(implementation, parameters)
+        keys.append(key)
+        id = key[:12]
+        output_file = os.path.join(results_dir,
+                                   "brunel_network_alpha_noconnect_{}_{}{}".format(implementation, id, suffix))
+        parameters["experiment"]["full_filename"] = output_file
+        if not ledger.should_run(key, config.max_attempts):
+            print("Skipping {} (already {})".format(id, ledger.get(key)["status"]))
+            continue
+        ledger.add(key, parameters, output_file)
+        parameter_file = "{}/parameters_{}.yml".format(results_dir, id)
+        with open(parameter_file, "w") as fp:
+            yaml.dump(parameters, fp)
+
+        rows[key] = (parameters["network"]["g"], parameters["network"]["eta"],
+                     parameters["experiment"]["seed"], output_file)
+        if config.in_process:
+            jobs[key] = (key, implementation, parameter_file)
+        else:
+            jobs[key] = (key, [sys.executable, script_path, implementation, parameter_file])
+
+    # failed simulations are run again, up to config.max_attempts times
+    while jobs:
+        if config.in_process:
+            run_in_process(jobs.values(), n_workers=config.n_workers, on_finish=record_job)
+        else:
+            run_jobs(jobs.values(), n_workers=config.n_workers, on_finish=record_job)
+        jobs = dict((key, job) for key, job in jobs.items()
+                    if ledger.should_run(key, config.max_attempts))
+
+    output_files = []
+    for key in keys:
+        entry = ledger.get(key)
+        output_files.append(entry["output_file"] if entry["status"] == "done" else None)
+    return output_files
+
+
+sweep_file = os.path.join(results_dir, "sweeps.csv")
+write_header = not os.path.exists(sweep_file)
+with open(sweep_file, "a") as sweep_fp:
+    if write_header:
+        sweep_fp.write("g eta seed output_file wall_time exit_status max_rss {}\n".format(
+            " ".join("{}_time".format(phase) for phase in PHASES)))
+
+    if config.adaptive:
+        # start from a coarse grid, and run simulations at intermediate points only
+        # where the firing rate or CV(ISI) changes sharply between neighbouring points
+        from analysis import spike_statistics
+        from ninemltoolkitio import NineMLToolkitIO
+        ioclass = NineMLToolkitIO if implementation == "9mltoolkit" else None
+        values = {}
+        cells = coarse_cells((g_values.size, eta_values.size), 2**config.refinements)
+        while cells:
+            indices = sorted(set(point for cell in cells for point in corners(cell)
+                                 if point not in values))
+            output_files = run_points([{"g": float(g_values[i]), "eta": float(eta_values[j])}
+                                       for i, j in indices])
+            for (i, j), output_file in zip(indices, output_files):
+                if output_file:
+                    results = spike_statistics((i, j), {"output_file": output_file}, ioclass=ioclass)
+                    values[(i, j)] = np.array([results.get("firing_rate", 0.0),
+                                               results.get("cv_isi", 0.0)], dtype=float)
+            cells = [child for cell in cells_to_refine(cells, values, config.threshold)
+                     for child in split(cell)]
+        print("Ran simulations at {} of {} grid points".format(len(values),
+                                                               g_values.size * eta_values.size))
+    else:
+        run_points([{"seed": seed}
+                    for seed in [9876985, 5735257, 2572357, 2346453, 4532523,
+                                 2236343, 2462373, 8784362, 9636568, 8383843]])
+        #run_points([{"g": float(g), "eta": float(eta)}  # yaml treats numpy floats differently
+        #            for g in g_values
+        #            for eta in eta_values])
 
-n_jobs = 10  # number of concurrent jobs
-jobs = []
-
-with open(os.path.join(results_dir, "sweeps.csv"), "w") as sweep_fp:
-    for seed in [9876985, 5735257, 2572357, 2346453, 4532523,
-                 2236343, 2462373, 8784362, 9636568, 8383843]:
-    #for g in np.arange(1.5, 9, 0.5):
-    #    for eta in np.arange(0, 5, 0.25):
-            id = str(uuid1())[:8]
-    #        parameters["network"]["g"] = float(g)   # yaml treats numpy floats differently
-    #        parameters["network"]["eta"] = float(eta)
-            parameters["experiment"]["seed"] = seed
-            output_file = os.path.join(results_dir,
-                                       "brunel_network_alpha_noconnect_{}_{}{}".format(implementation, id, suffix))
-            parameters["experiment"]["full_filename"] = output_file
-            parameter_file = "{}/parameters_{}.yml".format(results_dir, id)
-            with open(parameter_file, "w") as fp:
-                yaml.dump(parameters, fp)
-
-    #        sweep_fp.write("{} {} {}\n".format(g, eta, output_file))
-            sweep_fp.write("{} {}\n".format(seed, output_file))
-            sweep_fp.flush()  # flush file buffers in case a later iteration crashes
-
-            script_path = os.path.join(os.path.dirname(__file__), "run.py")
-            command = "{} {} {} {}".format(sys.executable, script_path, implementation, parameter_file)
-            #command = "echo '{} {}'".format(g, eta)
-
-            print(command)
-            #run(command)
-            jobs.append(
-                run(command, async=True))
-            sleep(1.0)
-            if len(jobs) == n_jobs:
-                for job in jobs:
-                    job.close()
-                jobs = []
+print(ledger.summary())
@@ -0,0 +1,177 @@
+"""
+This script models a pair of neurons with the precise spike times of
+brunel_network_numpy.HybridNetwork.
+
+Both neurons receive the synaptic input of test_neuron_model.py. The first
+neuron has the weights of that script, and stays below threshold, while the
+second has much larger weights, so that it fires.
+
+The neurons are simulated with time steps of 0.1 and 0.5 ms, and compared with
+brunel_network_numpy.Network, in which spike times are rounded to the time grid,
+with time steps of 0.01 and 0.001 ms, and, if NEST is available, with
+iaf_psc_alpha. The sub-threshold membrane potential should agree to within
+rounding error, and the spike times of the grid-based simulations should differ
+from the precise ones by less than one of their time steps.
+"""
+
+from __future__ import division, print_function
+import os
+import sys
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from brunel_network_numpy import Network, HybridNetwork
+from spike_delivery import SpikeDelivery, TimedSpikeDelivery
+from utility import psp_height
+
+
+t_stop = 120
+dt = 0.01
+cell_parameters = {'R': 1.5, 'v_reset': 10.0, 'tau': 20.0,
+                   'tau_refrac': 2.0, 'theta': 20.0, 'tau_syn': 0.5}
+spike_times = np.arange(45, 155, 10.0)
+spike_times[0] = 5
+spike_times = spike_times[spike_times < t_stop]
+weights = np.array([0.1, 12.0])  # EPSP height from a single spike received at resting potential
+w_eff = weights / psp_height(cell_parameters['tau'], cell_parameters['R'], cell_parameters['tau_syn'])
+delay = 0.5
+arrival_times = spike_times + delay
+
+print("\nEffective weights = {} nA\n".format(w_eff))
+
+no_connections = (np.zeros(3, dtype=int), np.array([], dtype=np.int32), np.zeros(2), 2)
+
+
+def simulate(network, arrival_steps, schedule, **run_options):
+    """
+    Run `network` to t_stop, calling `schedule(i)` to inject the i-th input
+    spike at the start of step arrival_steps[i] of the network.
+    """
+    spikes = {"senders": [], "times": []}
+    signals = {"senders": [], "times": [], "v": []}
+    for i, step in enumerate(np.append(arrival_steps, int(round(t_stop / network.dt)))):
+        if step > network.step:
+            run_spikes, run_signals = network.run((step - network.step) * network.dt,
+                                                  np.arange(2), np.arange(2), **run_options)
+            for events, run_events in ((spikes, run_spikes), (signals, run_signals)):
+                for name in events:
+                    events[name].append(run_events[name])
+        if i < len(arrival_steps):
+            schedule(i)
+    spikes, signals = [dict((name, np.hstack(values)) for name, values in events.items())
+                       for events in (spikes, signals)]
+    return spikes, signals
+
+
+def time_driven(step_size):
+    delivery = SpikeDelivery(*no_connections, delay_steps=int(round(delay / step_size)))
+    network = Network(2, 0, delivery, 0.0, 0.0, dt=step_size, v_init=np.zeros(2),
+                      rng=np.random.RandomState(), **cell_parameters)
+    steps = np.round(arrival_times / step_size).astype(int)
+    return simulate(network, steps,
+                    lambda i: delivery.schedule(np.arange(2), w_eff, steps[i]))
+
+
+def hybrid(step_size):
+    delivery = TimedSpikeDelivery(*no_connections, delay=delay, dt=step_size)
+    network = HybridNetwork(2, 0, delivery, 0.0, 0.0, dt=step_size, v_init=np.zeros(2),
+                            rng=np.random.RandomState(), **cell_parameters)
+    steps = np.floor(arrival_times / step_size).astype(int)
+    return simulate(network, steps,
+                    lambda i: delivery.schedule(np.arange(2), np.repeat(arrival_times[i], 2), w_eff),
+                    sampling_interval=dt)
+
+
+def trace(signals, id):
+    mask = signals["senders"] == id
+    return signals["times"][mask], signals["v"][mask]
+
+
+def on_grid(times):
+    """Return the indices of the times which are multiples of dt, and the multiples."""
+    multiples = np.round(times / dt)
+    index = np.flatnonzero(np.abs(times / dt - multiples) < 1e-6)
+    return index, multiples[index].astype(int)
+
+
+results = {
+    "hybrid, dt=0.1 ms": hybrid(0.1),
+    "hybrid, dt=0.5 ms": hybrid(0.5),
+    "time-driven, dt=0.01 ms": time_driven(0.01),
+    "time-driven, dt=0.001 ms": time_driven(0.001),
+}
+
+try:
+    import nest
+except ImportError:
+    print("NEST not available, not comparing with iaf_psc_alpha")
+else:
+    nest.ResetKernel()
+    nest.SetKernelStatus({"resolution": dt, 'local_num_threads': 1})
+    nest.SetDefaults("iaf_psc_alpha", {"C_m": 1000*cell_parameters["tau"]/cell_parameters["R"],
+                                       "tau_m": cell_parameters["tau"],
+                                       "tau_syn_ex": cell_parameters["tau_syn"],
+                                       "tau_syn_in": cell_parameters["tau_syn"],
+                                       "t_ref": cell_parameters["tau_refrac"],
+                                       "E_L": 0.0,
+                                       "V_reset": cell_parameters["v_reset"],
+                                       "V_m": 0.0,
+                                       "V_th": cell_parameters["theta"]})
+    neurons = nest.Create("iaf_psc_alpha", 2)
+    stim = nest.Create("spike_generator")
+    nest.SetStatus(stim, {"spike_times": spike_times})
+    for neuron, w in zip(neurons, w_eff):
+        # Note the factor of e^-1 in the normalisation of the NEST alpha function
+        nest.Connect(stim, [neuron], syn_spec={"model": "static_synapse",
+                                               "weight": np.exp(-1)*1000*w, "delay": delay})
+    recorder = nest.Create("multimeter")
+    nest.SetStatus(recorder, {"record_from": ["V_m"], "to_memory": True, "interval": dt})
+    nest.Connect(recorder, neurons)
+    detector = nest.Create("spike_detector")
+    nest.Connect(neurons, detector)
+    nest.Simulate(t_stop + dt)
+    events = nest.GetStatus(recorder, 'events')[0]
+    spike_events = nest.GetStatus(detector, 'events')[0]
+    results["NEST iaf_psc_alpha, dt=0.01 ms"] = (
+        {"senders": spike_events["senders"] - neurons[0], "times": spike_events["times"]},
+        {"senders": events["senders"] - neurons[0], "times": events["times"], "v": events["V_m"]})
+
+
+# Compare with the hybrid simulation with the shorter time step
+
+reference = "hybrid, dt=0.1 ms"
+reference_spikes, reference_signals = results[reference]
+t_ref, v_ref = trace(reference_signals, 0)
+print("{} spike times: {}".format(reference, reference_spikes["times"]))
+for label, (spikes, signals) in sorted(results.items()):
+    if label == reference:
+        continue
+    t, v = trace(signals, 0)
+    (i_ref, m_ref), (i_sig, m_sig) = on_grid(t_ref), on_grid(t)
+    common, i, j = np.intersect1d(m_ref, m_sig, return_indices=True)
+    i, j = i_ref[i], i_sig[j]
+    print("{}:".format(label))
+    print("  sub-threshold neuron: max. difference in membrane potential {:.3g} mV".format(
+          np.abs(v_ref[i] - v[j]).max()))
+    print("  spiking neuron: spike times {}".format(spikes["times"]))
+    if spikes["times"].size == reference_spikes["times"].size:
+        print("  max. difference in spike times {:.3g} ms".format(
+              np.abs(spikes["times"] - reference_spikes["times"]).max()))
+    else:
+        print("  different number of spikes")
+
+
+# Plot results
+
+fig, axes = plt.subplots(2, 1, sharex=True, figsize=(8, 8))
+for label, (spikes, signals) in sorted(results.items()):
+    for id, ax in enumerate(axes):
+        ax.plot(*trace(signals, id), label=label)
+axes[0].set_ylabel("Membrane potential (mV)")
+axes[1].set_ylabel("Membrane potential (mV)")
+axes[1].set_xlabel("Time (ms)")
+axes[1].set_xlim(0, t_stop)
+axes[0].legend(loc="upper left", fontsize="small")
+fig.savefig("test_hybrid_network.png")
@@ -13,33 +13,20 @@ Andrew Davison, May 2015
 """
 
 from __future__ import division, print_function
+import os
+import sys
 import nest
 import matplotlib
 matplotlib.use("Agg")
 import numpy as np
-from numpy import exp
 from quantities import nA, mV
 from nineml import read
 from nineml.abstraction import Dynamics
 import pyNN.neuron as sim
 from pyNN.neuron.nineml import nineml_cell_type
 from pyNN.utility.plotting import Figure, Panel
-
-
-def psp_height(tau_m, R_m, tau_syn):
-    """
-    Calculate the height of the EPSP for a synaptic current with
-    peak amplitude 1 nA.
-
-    tau_m and tau_syn: ms
-    R_m: Mohm
-    """
-    a = (tau_m / tau_syn)
-    b = (1.0 / tau_syn - 1.0 / tau_m)
-    # time of maximum
-    t_max = 1.0/b * (-nest.sli_func('LambertWm1', -exp(-1.0/a)/a) - 1.0/a)
-    # height of PSP for current of amplitude 1 nA
-    return 1/(tau_syn*tau_m*b/R_m) * ((exp(-t_max/tau_m) - exp(-t_max/tau_syn)) / b - t_max*exp(-t_max/tau_syn))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utility import psp_height
 
 
 t_stop = 120
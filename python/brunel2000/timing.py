@@ -0,0 +1,216 @@
+"""
+Measurement of the time taken by the different phases of a simulation.
+
+The phases used by the run_simulation() functions are listed in PHASES; each
+implementation uses those which apply to it. Each phase can optionally also be
+profiled, either with cProfile or, to find the peak memory allocated by
+Python during the phase, with tracemalloc (Python 3 only).
+
+"""
+
+from __future__ import division
+import os
+import sys
+import json
+import time
+try:
+    import builtins
+except ImportError:  # Python 2
+    import __builtin__ as builtins
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PHASES = ("import",    # importing the simulator
+          "export",    # generating the NineML model and writing it to XML
+          "compile",   # generating and compiling code from the model
+          "build",     # reading the model and creating the neurons and recording devices
+          "connect",   # creating the connections
+          "simulate",
+          "retrieve",  # gathering the recorded data from the simulator
+          "write")     # writing the data to file
+PROFILERS = (None, "cprofile", "tracemalloc")
+
+
+class Timer(object):
+    """
+    Accumulate the wall-clock time spent in named phases, e.g.:
+
+        timer = Timer()
+        with timer.phase("build"):
+            build_network()
+        print(timer.timings)
+
+    or, for consecutive phases:
+
+        timer.start("build")
+        build_network()
+        timer.start("simulate")
+        run()
+        timer.stop()
+
+    With profile="cprofile", a cProfile.Profile is kept for each phase, in
+    `profiles`; with profile="tracemalloc", the peak memory (bytes) allocated
+    by Python during each phase, above that allocated at its start, is
+    recorded in `peak_memory`. Phases must not be nested when profiling.
+    """
+
+    def __init__(self, profile=None):
+        if profile not in PROFILERS:
+            raise ValueError("profile should be one of {}".format(PROFILERS))
+        if profile == "tracemalloc":
+            try:
+                import tracemalloc
+            except ImportError:
+                raise ValueError("tracemalloc requires Python 3.4 or later")
+        self.profile = profile
+        self.timings = OrderedDict()
+        self.profiles = OrderedDict()
+        self.peak_memory = OrderedDict()
+        self._current = None
+        self._memory_baseline = 0
+
+    def start(self, name):
+        """End the current phase, if any, and start timing the phase `name`."""
+        self.stop()
+        self._begin_profile(name)
+        self._current = (name, time.time())
+
+    def stop(self):
+        """End the current phase."""
+        if self._current:
+            name, start = self._current
+            self.timings[name] = self.timings.get(name, 0.0) + time.time() - start
+            self._end_profile(name)
+            self._current = None
+
+    @contextmanager
+    def phase(self, name):
+        self._begin_profile(name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.time() - start
+            self._end_profile(name)
+
+    def total(self):
+        return sum(self.timings.values())
+
+    def _begin_profile(self, name):
+        if self.profile == "cprofile":
+            import cProfile
+            self.profiles.setdefault(name, cProfile.Profile()).enable()
+        elif self.profile == "tracemalloc":
+            import tracemalloc
+            if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.stop()  # restarting is the only way to reset the peak
+                tracemalloc.start()
+            self._memory_baseline = tracemalloc.get_traced_memory()[0]
+
+    def _end_profile(self, name):
+        if self.profile == "cprofile":
+            self.profiles[name].disable()
+        elif self.profile == "tracemalloc":
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak_memory[name] = max(self.peak_memory.get(name, 0), peak - self._memory_baseline)
+
+    def save(self, filename):
+        """
+        Write the timings (and the peak memory of each phase, if measured) to
+        `filename`, in JSON format. With cProfile, the statistics for each
+        phase are written to "<filename>.<phase>.prof", for use with pstats
+        or e.g. snakeviz.
+        """
+        with open(filename, "w") as fp:
+            json.dump({"timings": self.timings, "peak_memory": self.peak_memory}, fp, indent=2)
+        for name, profile in self.profiles.items():
+            profile.dump_stats("{}.{}.prof".format(os.path.splitext(filename)[0], name))
+
+
+def timings_filename(output_file):
+    """Return the name of the file in which the timings of a simulation are written, next to its output."""
+    return output_file + ".timings.json"
+
+
+def load_timings(filename):
+    """Return the timings written by Timer.save() to `filename`."""
+    with open(filename) as fp:
+        return json.load(fp, object_pairs_hook=OrderedDict)["timings"]
+
+
+class ImportTimer(object):
+    """
+    Measure the time taken to import each module, to find what slows down the
+    start-up of a script, like "python -X importtime" (Python 3.7+ only):
+
+        import_timer = ImportTimer()
+        import_timer.install()
+        import numpy
+        import_timer.uninstall()
+        import_timer.report()
+
+    Only imports which load at least one new module are recorded.
+    """
+
+    def __init__(self):
+        # (name, depth, inclusive time, self time), in the order the imports finish
+        self.records = []
+        self._nested = []  # the time spent in nested imports, for each import in progress
+        self._original_import = None
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        builtins.__import__ = self._original_import
+
+    def _import(self, name, *args, **kwargs):
+        # this must not import anything itself
+        n_modules = len(sys.modules)
+        self._nested.append(0.0)
+        start = time.time()
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            if len(sys.modules) > n_modules:
+                self.records.append((self._full_name(name, *args, **kwargs), len(self._nested),
+                                     elapsed, elapsed - nested))
+
+    @staticmethod
+    def _full_name(name, globals=None, locals=None, fromlist=(), level=0):
+        """Return the absolute name of the module, for relative imports."""
+        if level > 0 and globals:
+            package = (globals.get("__package__") or "").rsplit(".", level - 1)[0]
+            if name:
+                name = package + "." + name
+            else:
+                name = "{}.({})".format(package, ", ".join(fromlist or ()))
+        return name
+
+    def total(self):
+        return sum(elapsed for name, depth, elapsed, self_time in self.records if depth == 0)
+
+    def report(self, n=15):
+        """
+        Print the time taken by each import made directly by the script
+        (including the modules it imports in turn), and the `n` modules whose
+        own import took longest.
+        """
+        print("Import time (s)  {:.3f} in total".format(self.total()))
+        print("  direct imports, including their dependencies:")
+        for name, depth, elapsed, self_time in self.records:
+            if depth == 0:
+                print("  {:8.3f}  {}".format(elapsed, name))
+        print("  slowest modules, excluding their dependencies:")
+        for name, depth, elapsed, self_time in sorted(self.records, key=lambda r: -r[3])[:n]:
+            print("  {:8.3f}  {}".format(self_time, name))
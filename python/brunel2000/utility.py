@@ -3,12 +3,25 @@ Utility functions for the Brunel network simulations.
 
 """
 
-import nest
 from datetime import datetime
 import numpy as np
 from numpy import exp
-from quantities import ms
-import neo
+try:
+    from functools import lru_cache
+except ImportError:  # Python 2
+    def lru_cache(maxsize=128):
+        """A simple replacement for functools.lru_cache, emptied when it holds `maxsize` entries."""
+        def decorator(func):
+            cache = {}
+
+            def wrapper(*args):
+                if args not in cache:
+                    if len(cache) >= maxsize:
+                        cache.clear()
+                    cache[args] = func(*args)
+                return cache[args]
+            return wrapper
+        return decorator
 
 
 def psp_height(tau_m, R_m, tau_syn):
@@ -18,58 +31,184 @@ def psp_height(tau_m, R_m, tau_syn):
 
     tau_m and tau_syn: ms
     R_m: Mohm
+
+    The arguments may also be arrays, which are broadcast together, giving
+    an array of heights. The heights for single values are cached.
     """
+    if np.isscalar(tau_m) and np.isscalar(R_m) and np.isscalar(tau_syn):
+        return _cached_psp_height(float(tau_m), float(R_m), float(tau_syn))
+    return _psp_height(np.asarray(tau_m, dtype=float), np.asarray(R_m, dtype=float),
+                       np.asarray(tau_syn, dtype=float))
+
+
+@lru_cache(maxsize=256)
+def _cached_psp_height(tau_m, R_m, tau_syn):
+    return float(_psp_height(tau_m, R_m, tau_syn))
+
+
+def _psp_height(tau_m, R_m, tau_syn):
+    from scipy.special import lambertw
     a = (tau_m / tau_syn)
     b = (1.0 / tau_syn - 1.0 / tau_m)
     # time of maximum
-    t_max = 1.0/b * (-nest.sli_func('LambertWm1', -exp(-1.0/a)/a) - 1.0/a)
+    t_max = 1.0/b * (-lambertw(-exp(-1.0/a)/a, k=-1).real - 1.0/a)
     # height of PSP for current of amplitude 1 nA
     return 1/(tau_syn*tau_m*b/R_m) * ((exp(-t_max/tau_m) - exp(-t_max/tau_syn)) / b - t_max*exp(-t_max/tau_syn))
 
 
+def numpy_seed(seed):
+    """
+    Return `seed` reduced to the range accepted by NumPy's random number
+    generators (0 to 2**32 - 1); some of the parameter files use larger seeds.
+    Seeds within the range are unchanged.
+    """
+    return seed % 2**32
+
+
+def virtual_process_seeds(seed, n_vp):
+    """
+    Return the seeds for the per-virtual-process random number generators of
+    NEST, and the seed of the global generator, derived from `seed`, so that
+    all are different. With a single virtual process these are `[seed]` and `seed + 1`.
+    """
+    return [seed + i for i in range(n_vp)], seed + n_vp
+
+
+# environment variables set by the common MPI launchers (Open MPI, MPICH/Intel MPI, Slurm)
+MPI_SIZE_VARIABLES = ("OMPI_COMM_WORLD_SIZE", "PMI_SIZE", "SLURM_NTASKS")
+MPI_RANK_VARIABLES = ("OMPI_COMM_WORLD_RANK", "PMI_RANK", "SLURM_PROCID")
+
+
+def mpi_rank():
+    """
+    Return the rank of this MPI process, as set by the MPI launcher, without
+    initialising MPI. Returns 0 if not running under MPI.
+    """
+    import os
+    for name in MPI_RANK_VARIABLES:
+        if name in os.environ:
+            return int(os.environ[name])
+    return 0
+
+
+def relaunch_with_mpi(n_processes):
+    """
+    If `n_processes` is greater than one, and this script is not already
+    running under MPI, run it again with `n_processes` MPI processes, and
+    return its exit status. The MPI launcher is "mpirun" unless the
+    environment variable MPIRUN is set. Returns None if the script should
+    continue in the current process.
+    """
+    import os
+    import sys
+    import subprocess
+    if n_processes <= 1 or any(name in os.environ for name in MPI_SIZE_VARIABLES):
+        return None
+    command = [os.environ.get("MPIRUN", "mpirun"), "-np", str(n_processes), sys.executable] + sys.argv
+    print("Running: {}".format(" ".join(command)))
+    return subprocess.call(command)
+
+
+def gather_events(events):
+    """
+    Gather the events recorded by NEST recording devices (a list of dicts of
+    arrays, one per device) from all MPI processes, each of which records only
+    the neurons local to it.
+
+    Returns the merged events on the first process, and None on the others.
+    """
+    import nest
+    if nest.NumProcesses() == 1:
+        return events
+    from mpi4py import MPI
+    all_events = MPI.COMM_WORLD.gather(events, root=0)
+    if all_events is None:
+        return None
+    return [dict((name, np.hstack([process_events[i][name] for process_events in all_events]))
+                 for name in device_events)
+            for i, device_events in enumerate(events)]
+
+
+def write_population_data(sim, population, filename, timer):
+    """
+    Write the data recorded from a PyNN Population or Assembly to `filename`,
+    like population.write_data(filename), but timing the retrieval of the data
+    from the simulator ("retrieve") separately from writing it ("write").
+    """
+    from pyNN.recording import get_io
+    timer.start("retrieve")
+    block = population.get_data()
+    timer.start("write")
+    if sim.rank() == 0:
+        print("Writing data to {}".format(filename))
+        get_io(filename).write(block)
+
+
 def segment_from_recording_device(devices, variables_to_include, id_lists, t_stop, name="segment00"):
     """
-    Extract data from a NEST recording device and return it as a Neo Segment object.    
+    Extract data from a NEST recording device and return it as a Neo Segment object.
+
+    With MPI, this must be called on all processes; it returns the Segment on
+    the first process, and None on the others.
     """
+    import nest
+    events = gather_events([nest.GetStatus(device, 'events')[0] for device in devices])
+    if events is None:
+        return None
+    for device, variable in zip(devices, variables_to_include):
+        print(name, device, variable)
+    return segment_from_events(events, variables_to_include, id_lists, t_stop, name)
 
-    def get_data(device, variable, id_list):
-        events = nest.GetStatus(device, 'events')[0]
-        ids = events['senders']
-        values = events[variable]
-        data = {}
-        for id in id_list:
-            data[id] = values[ids==id]
-        assert len(data) > 0
-        return data
 
+def segment_from_events(events, variables_to_include, id_lists, t_stop, name="segment00"):
+    """
+    Create a Neo Segment from the events recorded by NEST recording devices.
+
+    Each element of `events` is a dict containing arrays 'senders', 'times'
+    and the recorded variables. The events from each device are grouped by
+    sender with a single stable sort, rather than one pass per sender.
+    """
+    import neo
+    from quantities import ms
+    from spikestore import SpikeStore
     segment = neo.Segment(name=name, rec_datetime=datetime.now())
 
-    for device, variable, id_list in zip(devices, variables_to_include, id_lists):
-        print(name, device, variable)
-        data = get_data(device, variable, id_list)
+    for device_events, variable, id_list in zip(events, variables_to_include, id_lists):
         if variable == 'times':
             print("  adding spiketrain")
-            id0 = min(id_list)
-            segment.spiketrains = [
-                neo.SpikeTrain(spiketrain,
-                               t_start=0.0,
-                               t_stop=t_stop,
-                               units='ms',
-                               source_id=id,
-                               source_index=id - id0)
-                for id, spiketrain in data.items()]
+            store = SpikeStore.from_events(device_events['times'], device_events['senders'],
+                                           channel_ids=id_list, t_start=0.0, t_stop=t_stop)
+            segment.spiketrains = store.spiketrains(id0=min(id_list))
         else:
             print("  adding signal")
-            source_ids = np.array(id_list)
-            channel_indices = source_ids - source_ids.min()
-            signal_array = np.vstack(data.values()).T
-            segment.analogsignalarrays = [
+            source_ids = np.unique(id_list)
+            senders = device_events['senders']
+            order = np.argsort(senders, kind="mergesort")
+            senders = senders[order]
+            starts = np.searchsorted(senders, source_ids, side="left")
+            stops = np.searchsorted(senders, source_ids, side="right")
+            signal_lengths = stops - starts
+            min_length = signal_lengths.min()
+            assert min_length > 0
+            if not (signal_lengths == signal_lengths[0]).all():
+                print("Warning: signals have different sizes: min={}, max={}".format(min_length,
+                                                                                     signal_lengths.max()))
+                print("Truncating to length {}".format(min_length))
+            index = order[starts[:, np.newaxis] + np.arange(min_length)]
+            times = device_events['times'][index[0]]
+            if min_length > 1:
+                t_start = times[0]
+                sampling_period = times[1] - times[0]
+            else:
+                t_start = 0.0
+                sampling_period = 0.1
+            segment.analogsignalarrays.append(
                 neo.AnalogSignalArray(
-                    signal_array,
+                    device_events[variable][index].T,
                     units='mV',
-                    t_start=0.0*ms,
-                    sampling_period=0.1*ms,
+                    t_start=t_start*ms,
+                    sampling_period=sampling_period*ms,
                     name=variable,
-                    channel_index=channel_indices,
-                    source_ids=source_ids)]
+                    channel_index=source_ids - source_ids.min(),
+                    source_ids=source_ids))
     return segment